@@ -0,0 +1 @@
+default_app_config = 'apps.base.apps.BaseConfig'
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.core import checks
+
+
+class BaseConfig(AppConfig):
+    name = 'apps.base'
+
+    def ready(self):
+        from . import sharding_cache, sharding_metrics
+
+        checks.register(sharding_cache.check_lookup_cache)
+        checks.register(sharding_metrics.check_metrics_cache)
+
+        if sharding_metrics.SHARDING_METRICS:
+            sharding_metrics.install()
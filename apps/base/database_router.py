@@ -0,0 +1,23 @@
+class ShardingDatabaseRouter(object):
+    """
+    Database router sending the queries of a shard model to the database its sharding is placed on, see
+    `ShardingMixin.get_sharding_database`. Other models are left to the next routers.
+    """
+
+    def db_for_read(self, model, **hints):
+        sharding_model = getattr(model, '_sharding_model', None)
+        if sharding_model is not None:
+            return sharding_model.get_sharding_database(model._sharding)
+
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        db1 = self.db_for_read(obj1.__class__)
+        db2 = self.db_for_read(obj2.__class__)
+        if db1 is not None and db2 is not None:
+            return db1 == db2
+
+        return None
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.base import model_sharding, sharding_archive, sharding_provisioner
+
+
+class Command(BaseCommand):
+    help = 'Export the date shards expired by SHARDING_RETENTION to gzip NDJSON files, then drop their tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Labels of the sharding models, e.g. demo.log. All by default.')
+        parser.add_argument('--dir', default=sharding_archive.SHARDING_ARCHIVE_DIR,
+                            help='Directory the archive files are written to.')
+        parser.add_argument('--batch-size', type=int, default=sharding_archive.SHARDING_ARCHIVE_BATCH_SIZE,
+                            help='Number of rows fetched per query while exporting.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the shards which would be archived.')
+
+    def handle(self, *args, **options):
+        try:
+            model_classes = [sharding_provisioner.get_sharding_model(label) for label in options['models']] or None
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        if options['dry_run']:
+            for model_class in model_classes or model_sharding.get_sharding_models():
+                shardings = sharding_archive.get_archivable_shardings(model_class)
+                self.stdout.write("Expired shards of '%s': %s" % (
+                    model_class._meta.label_lower, ', '.join(shardings) or 'none'))
+            return
+
+        archived = sharding_archive.archive_expired_shards(model_classes, options['dir'], options['batch_size'])
+        for label, shards in archived.items():
+            if shards:
+                for sharding, (path, count) in shards.items():
+                    self.stdout.write("Archived %d rows of shard %s of '%s' to %s." % (count, sharding, label, path))
+            else:
+                self.stdout.write("No expired shards of '%s'." % label)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.base import sharding_export, sharding_provisioner
+
+
+class Command(BaseCommand):
+    help = ('Export the rows of a sharding model as NDJSON or CSV, shard after shard in primary key batches. An '
+            'export to a file with --checkpoint resumes where an interrupted run stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Label of the sharding model, e.g. demo.user.')
+        parser.add_argument('--format', choices=sharding_export.FORMATS, default='ndjson', help='Output format.')
+        parser.add_argument('--output', help='File to write the export to, stdout by default.')
+        parser.add_argument('--shardings', nargs='+', help='Shardings to export, e.g. 202001 202002. All by default.')
+        parser.add_argument('--batch-size', type=int, default=sharding_export.SHARDING_EXPORT_BATCH_SIZE,
+                            help='Number of rows fetched per query.')
+        parser.add_argument('--parallel', action='store_true',
+                            help='Export the shards concurrently on the sharding thread pool.')
+        parser.add_argument('--checkpoint', help='Checkpoint file to resume the export to --output from.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        if options['checkpoint'] and not options['output']:
+            raise CommandError('--checkpoint needs --output.')
+
+        try:
+            model_class = sharding_provisioner.get_sharding_model(options['model'])
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        shardings = options['shardings']
+        if shardings is not None:
+            unknown = set(shardings) - set(model_class.get_sharding_list())
+            if unknown:
+                raise CommandError("Unknown shardings of '%s': %s." % (
+                    model_class._meta.label_lower, ', '.join(sorted(unknown))))
+
+        try:
+            counts = sharding_export.export(
+                model_class, options['output'] or self.stdout, options['format'], shardings, options['batch_size'],
+                options['parallel'], options['checkpoint'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            self.stdout.write("Exported %d rows of %d shards of '%s' to %s." % (
+                sum(counts.values()), len(counts), model_class._meta.label_lower, options['output']))
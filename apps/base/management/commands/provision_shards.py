@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.base import model_sharding, sharding_provisioner
+
+
+class Command(BaseCommand):
+    help = 'Create the tables of the current and upcoming shards ahead of time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Labels of the sharding models, e.g. demo.log. All by default.')
+        parser.add_argument('--periods', type=int, default=model_sharding.SHARDING_PROVISION_PERIODS_DEFAULT,
+                            help='Number of upcoming date shardings to create after the current one.')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep provisioning the shards every --interval seconds until interrupted.')
+        parser.add_argument('--interval', type=float, default=sharding_provisioner.SHARDING_PROVISION_INTERVAL,
+                            help='Seconds between two provisionings with --watch.')
+
+    def handle(self, *args, **options):
+        try:
+            model_classes = [sharding_provisioner.get_sharding_model(label) for label in options['models']] or None
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        if options['watch']:
+            provisioner = sharding_provisioner.ShardingProvisioner(
+                options['interval'], options['periods'], model_classes)
+            try:
+                provisioner.run()
+            except KeyboardInterrupt:
+                provisioner.stop()
+            return
+
+        created = sharding_provisioner.provision_upcoming_shards(model_classes, options['periods'])
+        for label, shardings in created.items():
+            if shardings:
+                self.stdout.write("Created shards of '%s': %s" % (label, ', '.join(shardings)))
+            else:
+                self.stdout.write("Shards of '%s' are up to date." % label)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.base import model_sharding, sharding_index, sharding_provisioner
+
+
+class Command(BaseCommand):
+    help = 'Index again every row of the sharding models declaring SHARDING_INDEXES.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Labels of the sharding models, e.g. demo.user. All by default.')
+        parser.add_argument('--shardings', nargs='+', help='Shardings to index again. All by default.')
+
+    def handle(self, *args, **options):
+        try:
+            model_classes = [sharding_provisioner.get_sharding_model(label) for label in options['models']] or \
+                model_sharding.get_sharding_models()
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        for model_class in model_classes:
+            indexed_fields = sharding_index.get_indexed_fields(model_class)
+            if not indexed_fields:
+                continue
+
+            count = sharding_index.rebuild_index(model_class, options['shardings'])
+            self.stdout.write("Indexed %d rows of '%s' by %s." % (
+                count, model_class._meta.label_lower, ', '.join(indexed_fields)))
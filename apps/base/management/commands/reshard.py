@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from apps.base import sharding_provisioner, sharding_router
+
+
+class Command(BaseCommand):
+    help = ('Move the buckets of a precise sharding model routed by BucketRouter onto a new number of shards online, '
+            'or with --rebalance move the rows which are not on the shard their routing key maps to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help='Label of the sharding model, e.g. demo.user.')
+        parser.add_argument('--count', type=int, help='New number of shards.')
+        parser.add_argument('--rebalance', action='store_true',
+                            help='Move the rows written under a previous routing to the shard they are routed to.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows moved per transaction.')
+        parser.add_argument('--grace', type=float, default=sharding_router.SHARDING_ROUTER_REFRESH,
+                            help='Seconds to wait for every process to reload the bucket map before moving rows.')
+
+    def handle(self, *args, **options):
+        if options['rebalance']:
+            return self.rebalance(options)
+        if options['count'] is None or options['count'] < 1:
+            raise CommandError('--count must be positive.')
+
+        try:
+            model_class = sharding_provisioner.get_sharding_model(options['model'])
+            moves, moved = sharding_router.reshard(model_class, options['count'], options['batch_size'],
+                                                   options['grace'])
+        except (LookupError, TypeError, IntegrityError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write("Moved %d buckets and %d rows of '%s' onto %d shards." % (
+            len(moves), moved, model_class._meta.label_lower, options['count']))
+
+    def rebalance(self, options):
+        try:
+            model_class = sharding_provisioner.get_sharding_model(options['model'])
+            moved = sharding_router.rebalance(model_class, options['batch_size'])
+        except (LookupError, TypeError, IntegrityError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write("Moved %d rows of '%s' to the shards they are routed to." % (
+            moved, model_class._meta.label_lower))
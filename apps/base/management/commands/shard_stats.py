@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.base import model_sharding, sharding_metrics, sharding_provisioner
+
+
+class Command(BaseCommand):
+    help = ('Show the load, latency and size of every shard collected by SHARDING_METRICS, flagging the hot shards '
+            'and the oversized ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='Labels of the sharding models, e.g. demo.user. All by default.')
+        parser.add_argument('--hot-factor', type=float, default=2.0,
+                            help='Flag the shards serving more than this times the mean number of queries.')
+        parser.add_argument('--size-factor', type=float, default=2.0,
+                            help='Flag the shards holding more than this times the mean number of rows.')
+        parser.add_argument('--json', action='store_true', help='Print the stats as JSON.')
+
+    def handle(self, *args, **options):
+        try:
+            model_classes = [sharding_provisioner.get_sharding_model(label) for label in options['models']] or \
+                model_sharding.get_sharding_models()
+        except LookupError as exc:
+            raise CommandError(str(exc))
+
+        report = {}
+        for model_class in model_classes:
+            stats = sharding_metrics.get_shard_stats(model_class)
+            counts = model_class.scatter_gather(lambda shard_model, sharding: model_class.count_sharding(sharding),
+                                                list(stats))
+            for metrics, count in zip(stats.values(), counts):
+                metrics['rows'] = count
+
+            mean_queries = sum(metrics['queries'] for metrics in stats.values()) / (len(stats) or 1)
+            mean_rows = sum(metrics['rows'] for metrics in stats.values()) / (len(stats) or 1)
+            for metrics in stats.values():
+                metrics['hot'] = bool(metrics['queries']) and metrics['queries'] > options['hot_factor'] * mean_queries
+                metrics['oversized'] = bool(metrics['rows']) and metrics['rows'] > options['size_factor'] * mean_rows
+            report[model_class._meta.label_lower] = stats
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        for label, stats in report.items():
+            self.stdout.write("Shards of '%s':" % label)
+            self.stdout.write('  %-12s %10s %10s %12s %12s %10s %10s  %s' % (
+                'sharding', 'rows', 'queries', 'rows_read', 'rows_written', 'mean_ms', 'p95_ms', 'flags'))
+            for sharding, metrics in stats.items():
+                p95 = metrics['latency_p95_ms']
+                if p95 is not None:
+                    p95 = '>%s' % sharding_metrics.LATENCY_BUCKETS[-1] if p95 == 'inf' else '<=%s' % p95
+                flags = ' '.join(flag for flag in ('hot', 'oversized') if metrics[flag])
+                self.stdout.write('  %-12s %10d %10d %12d %12d %10s %10s  %s' % (
+                    sharding, metrics['rows'], metrics['queries'], metrics['rows_read'], metrics['rows_written'],
+                    '-' if metrics['latency_mean_ms'] is None else metrics['latency_mean_ms'],
+                    p95 or '-', flags))
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-16 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardingTable',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(db_index=True, max_length=100)),
+                ('sharding', models.CharField(max_length=50)),
+                ('db_table', models.CharField(max_length=128, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'sharding_table',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-16 22:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardingBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('bucket', models.PositiveIntegerField()),
+                ('sharding', models.CharField(max_length=50)),
+                ('target', models.CharField(blank=True, max_length=50, null=True)),
+            ],
+            options={
+                'db_table': 'sharding_bucket',
+                'unique_together': {('model', 'bucket')},
+            },
+        ),
+    ]
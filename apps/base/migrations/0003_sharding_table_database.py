@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-16 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_sharding_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shardingtable',
+            name='database',
+            field=models.CharField(default='default', max_length=100),
+        ),
+    ]
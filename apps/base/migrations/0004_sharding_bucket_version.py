@@ -0,0 +1,24 @@
+# Generated by Django 3.0.14 on 2026-10-16 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_sharding_table_database'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardingBucketVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'sharding_bucket_version',
+            },
+        ),
+    ]
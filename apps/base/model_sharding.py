@@ -1,21 +1,38 @@
-import calendar
+import base64
+import json
 import math
+import threading
+import time
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
-from importlib import import_module
+from datetime import date, datetime, timedelta
+from hashlib import blake2b, md5
+from itertools import chain
 
+from django.apps import apps
 from django.conf import settings
 from django.contrib import admin
-from django.core.management import commands
-from django.db import connection
-from django.forms import model_to_dict
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, connections, models, router, transaction
 from django.utils import timezone
 
+from . import (
+    sharding_admin, sharding_buffer, sharding_cache, sharding_counts, sharding_executor, sharding_index, sharding_locks,
+    sharding_metrics, sharding_router
+)
+from .sharding_queryset import ShardedQuerySet
+
 SHARDING_COUNT_DEFAULT = getattr(settings, 'SHARDING_COUNT_DEFAULT', 10)
 SHARDING_DATE_START_DEFAULT = getattr(settings, 'SHARDING_DATE_START_DEFAULT', '2020-01-01')
 SHARDING_DATE_FORMAT_DEFAULT = getattr(settings, 'SHARDING_DATE_FORMAT_DEFAULT', '%Y%m')
-
-shard_tables = {}
+SHARDING_PROVISION_PERIODS_DEFAULT = getattr(settings, 'SHARDING_PROVISION_PERIODS_DEFAULT', 3)
+SHARDING_MODEL_CACHE_SIZE = getattr(settings, 'SHARDING_MODEL_CACHE_SIZE', 1000)
+table_catalogs = {}
 admin_opts_map = {}
+sharding_indexes = {}
+sharding_models = []
+# Modules whose `connect(shard_model)` keeps their bookkeeping of a shard model up to date on saves and deletes.
+signal_modules = (sharding_counts, sharding_cache, sharding_index)
 
 
 def get_next_year_and_month(date):
@@ -25,6 +42,284 @@ def get_next_year_and_month(date):
     return date.year, date.month + 1
 
 
+def get_next_sharding_date(date, date_sharding_format):
+    """Return the first date of the sharding period following the one which `date` belongs to."""
+
+    if date_sharding_format.endswith('%Y'):
+        return date.replace(year=date.year + 1, month=1, day=1)
+    elif date_sharding_format.endswith('%d'):
+        return date + timedelta(days=1)
+
+    next_year, next_month = get_next_year_and_month(date)
+    return date.replace(year=next_year, month=next_month, day=1)
+
+
+class ShardModelRegistry(object):
+    """
+    Registry of the shard models by table name, keeping at most `max_size` date shard models loaded. Registering one
+    more evicts the least recently used date shard model from the registry, the admin and django's app registry, and
+    it is created again on next access. Shard models of precise sharding models are never evicted.
+    """
+
+    def __init__(self, max_size=SHARDING_MODEL_CACHE_SIZE):
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.lock = threading.RLock()
+
+    def __contains__(self, db_table):
+        return db_table in self.models
+
+    def __getitem__(self, db_table):
+        model_class = self.get(db_table)
+        if model_class is None:
+            raise KeyError(db_table)
+
+        return model_class
+
+    def __setitem__(self, db_table, model_class):
+        with self.lock:
+            self.models[db_table] = model_class
+            self.models.move_to_end(db_table)
+            self.evict()
+
+    def __len__(self):
+        return len(self.models)
+
+    def get(self, db_table, default=None):
+        with self.lock:
+            model_class = self.models.get(db_table)
+            if model_class is None:
+                return default
+
+            self.models.move_to_end(db_table)
+            return model_class
+
+    def pop(self, db_table, default=None):
+        with self.lock:
+            return self.models.pop(db_table, default)
+
+    def values(self):
+        with self.lock:
+            return list(self.models.values())
+
+    def is_evictable(self, model_class):
+        return getattr(model_class._sharding_model, 'SHARDING_TYPE', 'date') == 'date'
+
+    def evict(self):
+        if not self.max_size:
+            return
+
+        evictable = [model_class for model_class in self.models.values() if self.is_evictable(model_class)]
+        for model_class in evictable[:max(len(evictable) - self.max_size, 0)]:
+            remove_model(model_class)
+
+
+shard_tables = ShardModelRegistry()
+
+
+class TableCatalog(object):
+    """
+    Set of the tables existing in a database, loaded once on first use and kept up to date as the sharding layer
+    creates or drops shard tables, so that checking if a shard exists does not query the database. Call `refresh()`
+    when tables are changed behind the back of the sharding layer.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.tables = None
+        self.lock = threading.Lock()
+
+    def __contains__(self, table):
+        tables = self.tables
+        if tables is None:
+            tables = self.refresh()
+
+        return table in tables
+
+    def refresh(self):
+        with self.lock:
+            self.tables = set(connections[self.using].introspection.table_names())
+
+        return self.tables
+
+    def add(self, table):
+        if table not in self:
+            self.tables.add(table)
+
+    def discard(self, table):
+        if table in self:
+            self.tables.discard(table)
+
+
+def register_database(alias, name, template=DEFAULT_DB_ALIAS):
+    """Add the database `alias` at runtime, with the settings of the database `template` and the NAME `name`."""
+
+    if alias not in connections.databases:
+        database = dict(connections.databases[template], NAME=name)
+        database.pop('TEST', None)
+        connections.databases[alias] = database
+
+    return alias
+
+
+class DatabasePerSharding(object):
+    """
+    `SHARDING_DATABASES` placing every shard in a database of its own, registered on first use, e.g. one SQLite file
+    per month: `DatabasePerSharding('log_%(sharding)s', os.path.join(BASE_DIR, 'log_%(sharding)s.sqlite3'))`.
+    """
+
+    def __init__(self, alias_pattern, name_pattern, template=DEFAULT_DB_ALIAS):
+        self.alias_pattern = alias_pattern
+        self.name_pattern = name_pattern
+        self.template = template
+
+    def __call__(self, sharding):
+        alias = self.alias_pattern % {'sharding': sharding}
+        if alias not in connections.databases:
+            register_database(alias, self.name_pattern % {'sharding': sharding}, self.template)
+
+        return alias
+
+
+def get_table_catalog(using=DEFAULT_DB_ALIAS):
+    catalog = table_catalogs.get(using)
+    if catalog is None:
+        catalog = table_catalogs.setdefault(using, TableCatalog(using))
+
+    return catalog
+
+
+def refresh_table_catalogs():
+    """Reload the table catalogs of all databases, e.g. after tables were created or dropped by hand."""
+
+    for catalog in list(table_catalogs.values()):
+        catalog.refresh()
+
+
+def hash64(value):
+    """Default `SHARDING_HASH`: a 64 bit blake2b digest of the routing key value."""
+
+    if not isinstance(value, bytes):
+        value = str(value).encode()
+
+    return int.from_bytes(blake2b(value, digest_size=8).digest(), 'big')
+
+
+def md5_hash(value):
+    """`SHARDING_HASH` equal to `int(md5(value).hexdigest(), base=16)`, without the detour through hex."""
+
+    if not isinstance(value, bytes):
+        value = str(value).encode()
+
+    return int.from_bytes(md5(value).digest(), 'big')
+
+
+def to_datetime(value):
+    """Return a date `value` as the datetime of its midnight, aware in the current time zone with `USE_TZ`."""
+
+    if isinstance(value, datetime) or not isinstance(value, date):
+        return value
+
+    value = datetime.combine(value, datetime.min.time())
+    return timezone.make_aware(value) if settings.USE_TZ else value
+
+
+def get_field_value(obj, field_name):
+    if isinstance(obj, dict):
+        return obj.get(field_name)
+
+    return getattr(obj, field_name)
+
+
+def get_dict_fields(model_class):
+    """Return the names of the fields `model_to_dict` serializes, to project the rows of `model_class` on."""
+
+    return [field.name for field in model_class._meta.concrete_fields if field.editable]
+
+
+def encode_sharding_cursor(sharding, pk):
+    """Encode the position after row `pk` of `sharding` as an opaque, url-safe pagination cursor."""
+
+    return base64.urlsafe_b64encode(json.dumps([sharding, pk]).encode()).decode()
+
+
+def decode_sharding_cursor(cursor):
+    """Decode a cursor made by `encode_sharding_cursor`, raise `ValueError` if it is malformed."""
+
+    try:
+        sharding, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: %r' % cursor)
+
+    # Anything else than a scalar key, e.g. `[1]`, would only fail once compared to the primary keys.
+    if not all(isinstance(value, (int, str)) and not isinstance(value, bool) for value in (sharding, pk)):
+        raise ValueError('Invalid cursor: %r' % cursor)
+
+    return str(sharding), pk
+
+
+class ShardingIndex(object):
+    """
+    Ordered list and set of the valid shardings of a model. It is built once and extended in place when the
+    current date rolls over into a new sharding period, so membership checks cost O(1) however many shards exist.
+    A date sharding model with a `SHARDING_RETENTION` only keeps its last `SHARDING_RETENTION` shardings.
+    """
+
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self.shardings = []
+        self.sharding_set = set()
+        self.next_date = None
+        self.routed_shardings = None
+        self.lock = threading.Lock()
+
+    def __contains__(self, sharding):
+        return sharding in self.refresh().sharding_set
+
+    def __iter__(self):
+        return iter(self.refresh().shardings)
+
+    def __len__(self):
+        return len(self.refresh().shardings)
+
+    def refresh(self):
+        model_class = self.model_class
+        if getattr(model_class, 'SHARDING_TYPE', 'date') != 'date':
+            routed_shardings = model_class.get_sharding_router().get_shardings()
+            if routed_shardings is not self.routed_shardings:
+                with self.lock:
+                    self.shardings = list(routed_shardings)
+                    self.sharding_set = set(routed_shardings)
+                    self.routed_shardings = routed_shardings
+            return self
+
+        today = timezone.now().date()
+        if self.next_date is None or self.next_date <= today:
+            with self.lock:
+                if self.next_date is None or self.next_date <= today:
+                    self.extend(model_class.get_date_sharding_list(self.next_date))
+
+        return self
+
+    def extend(self, shardings):
+        date_sharding_format = getattr(self.model_class, 'SHARDING_DATE_FORMAT', SHARDING_DATE_FORMAT_DEFAULT)
+        for sharding in shardings:
+            if sharding in self.sharding_set:
+                continue
+
+            self.shardings.append(sharding)
+            self.sharding_set.add(sharding)
+
+        retention = getattr(self.model_class, 'SHARDING_RETENTION', None)
+        if retention and len(self.shardings) > retention:
+            self.sharding_set.difference_update(self.shardings[:-retention])
+            del self.shardings[:-retention]
+
+        if self.shardings and getattr(self.model_class, 'SHARDING_TYPE', 'date') == 'date':
+            last_date = timezone.datetime.strptime(self.shardings[-1], date_sharding_format).date()
+            self.next_date = get_next_sharding_date(last_date, date_sharding_format)
+
+
 def create_model(abstract_model_class, sharding, meta_options=None):
     """Create sharding model which inherit from `abstract_model_class`."""
 
@@ -43,6 +338,9 @@ def create_model(abstract_model_class, sharding, meta_options=None):
 
         setattr(Meta, k, v)
 
+    # Shard tables are created by `ShardingMixin.provision_shards`, not by migrations.
+    Meta.managed = False
+
     meta_options.update(abstract_model_class.default_meta_options(sharding))
     for k, v in meta_options.items():
         setattr(Meta, k, v)
@@ -50,19 +348,57 @@ def create_model(abstract_model_class, sharding, meta_options=None):
     attrs = {
         '__module__': abstract_model_class.__module__,
         'Meta': Meta,
+        '_sharding': sharding,
+        '_sharding_model': abstract_model_class,
     }
 
-    ModelClass = type(model_name, (abstract_model_class,), attrs)
-    shard_tables[table_name] = ModelClass
-
     class Admin(admin.ModelAdmin):
         pass
 
-    label_lower = abstract_model_class._meta.label_lower
-    if admin_opts_map.get(label_lower):
-        for key, value in admin_opts_map[label_lower].items():
-            setattr(Admin, key, value)
-        admin.site.register(ModelClass, Admin)
+    # Django's app registry is not thread-safe, serialize the shard models coming in and out of it.
+    with shard_tables.lock:
+        ModelClass = type(model_name, (abstract_model_class,), attrs)
+        shard_tables[table_name] = ModelClass
+        for module in signal_modules:
+            module.connect(ModelClass)
+
+        label_lower = abstract_model_class._meta.label_lower
+        if admin_opts_map.get(label_lower):
+            for key, value in admin_opts_map[label_lower].items():
+                setattr(Admin, key, value)
+            sharding_admin.register(ModelClass, Admin)
+
+    return ModelClass
+
+
+def remove_model(model_class):
+    """Forget the sharding model `model_class`, unregistering it from the shard models, the admin and django."""
+
+    with shard_tables.lock:
+        shard_tables.pop(model_class._meta.db_table, None)
+        sharding_admin.unregister(model_class)
+        for module in signal_modules:
+            module.disconnect(model_class)
+
+        apps.all_models[model_class._meta.app_label].pop(model_class._meta.model_name, None)
+        apps.clear_cache()
+
+
+def find_shard_model(app_label, model_name):
+    """Return the model of the existing shard whose model name is `model_name`, e.g. `log202005`, or `None`."""
+
+    for model_class in sharding_models:
+        prefix = model_class.__name__.lower()
+        if model_class._meta.app_label != app_label or not model_name.startswith(prefix):
+            continue
+
+        sharding = model_name[len(prefix):]
+        if sharding.isdigit():
+            catalog = get_table_catalog(model_class.get_sharding_database(sharding))
+            if model_class.get_sharding_table(sharding) in catalog:
+                return model_class.get_shard_model(sharding)
+
+    return None
 
 
 def register_admin_opts(app_config_name, opts):
@@ -72,62 +408,375 @@ def register_admin_opts(app_config_name, opts):
         admin_opts_map[app_config_name] = opts
 
 
-def exec_command(command, app_label):
-    """Execute django command even the django app still running."""
+def get_sharding_models():
+    """Return the abstract models which inherit from `ShardingMixin`."""
+
+    return list(sharding_models)
+
 
-    cmd_module_name = '%s.%s' % (commands.__name__, command)
-    cmd_module = import_module(cmd_module_name)
-    cmd = getattr(cmd_module, 'Command')()
-    parser = cmd.create_parser('./manage.py', cmd)
-    options = parser.parse_args([app_label])
-    cmd_options = vars(options)
-    args = cmd_options.pop('args', ())
-    cmd.execute(*args, **cmd_options)
+def create_table(model_class, using=None):
+    """
+    Issue the DDL of `model_class` through the schema editor of the database, without going through the migration
+    framework. The editor is used without entering it as a context manager, because the SQLite schema editor
+    refuses to be entered inside a transaction.
+    """
+
+    schema_editor = connections[using or router.db_for_write(model_class)].schema_editor()
+    schema_editor.deferred_sql = []
+    schema_editor.create_model(model_class)
+    for sql in schema_editor.deferred_sql:
+        schema_editor.execute(sql)
+
+
+def drop_table(model_class, using=None):
+    """Issue the DROP TABLE of `model_class` through the schema editor of the database, see `create_table`."""
+
+    schema_editor = connections[using or router.db_for_write(model_class)].schema_editor()
+    schema_editor.deferred_sql = []
+    schema_editor.delete_model(model_class)
 
 
 class ShardingMixin(object):
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '_sharding_model' not in cls.__dict__:
+            sharding_models.append(cls)
+
     @classmethod
     def shard(cls, sharding_source=None):
-        sharding = cls.get_sharding(str(sharding_source))
-        db_table = "%s_%s%s" % (cls._meta.app_label, cls._meta.db_table, sharding)
-        if db_table not in shard_tables:
-            create_model(cls, sharding)
+        sharding = cls.get_sharding(sharding_source)
+        sharding_metrics.record_routing(cls, sharding)
+        return cls.get_shard_model(sharding)
 
-            cursor = connection.cursor()
-            tables = [table_info.name for table_info in connection.introspection.get_table_list(cursor)]
-            if db_table not in tables:
-                for cmd in ('makemigrations', 'migrate'):
-                    exec_command(cmd, cls._meta.app_label)
+    @classmethod
+    def get_shard_model(cls, sharding):
+        """Return the model of the shard named `sharding`, creating it and its table if needed."""
+
+        db_table = cls.get_sharding_table(sharding)
+        shard_model = shard_tables.get(db_table)
+        if shard_model is None or db_table not in get_table_catalog(cls.get_sharding_database(sharding)):
+            cls.provision_shards([sharding])
+            shard_model = shard_tables.get(db_table)
+            if shard_model is None:
+                # Evicted meanwhile by the shard models other threads registered, its table exists.
+                with sharding_locks.process_lock(db_table):
+                    shard_model = shard_tables.get(db_table) or create_model(cls, sharding)
 
-        return shard_tables[db_table]
+        return shard_model
 
     @classmethod
-    def get_sharding(cls, sharding_source=None):
-        sharding_list = cls.get_sharding_list()
-        if sharding_source not in sharding_list:
-            return cls.default_sharding()
+    def get_sharding_database(cls, sharding):
+        """
+        Return the alias of the database the shard `sharding` is placed on. `SHARDING_DATABASES` is either a dict
+        mapping shardings to aliases or a callable taking the sharding, shards are placed on `default` otherwise.
+        The shard models are routed accordingly by `apps.base.database_router.ShardingDatabaseRouter`.
+        """
+
+        databases = getattr(cls, 'SHARDING_DATABASES', None)
+        if databases is None:
+            return DEFAULT_DB_ALIAS
+        elif callable(databases):
+            return databases(sharding)
+
+        return databases.get(sharding, DEFAULT_DB_ALIAS)
+
+    @classmethod
+    def shards_for_read(cls, sharding_source=None):
+        """
+        Return the shard models holding the rows of `sharding_source`: its shard, followed while it is being
+        resharded by the shard its rows are moved from.
+        """
 
         if getattr(cls, 'SHARDING_TYPE', 'date') == 'date':
-            return sharding_source
+            return [cls.shard(sharding_source)]
 
-        return str(int(sharding_source) % int(getattr(cls, 'SHARDING_COUNT', SHARDING_COUNT_DEFAULT)))
+        try:
+            shardings = cls.get_sharding_router().get_read_shardings(int(sharding_source))
+        except (TypeError, ValueError):
+            shardings = [cls.default_sharding()]
+
+        return [cls.get_shard_model(sharding) for sharding in shardings]
 
     @classmethod
-    def get_sharding_list(cls):
+    def get_routed(cls, sharding_source=None, **filters):
+        """
+        Return the row matching `filters` from the shards of `sharding_source`, see `shards_for_read`. The source is
+        computed from the `SHARDING_KEY` lookup of `filters` if not given, e.g. `User.get_routed(user_name=name)`.
+        Lookups by the `SHARDING_KEY` only are cached if the model sets `SHARDING_LOOKUP_CACHE_TIMEOUT`.
+        """
+
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if sharding_source is None and sharding_key in filters:
+            sharding_source = cls.get_key_source(filters[sharding_key])
+
+        shard_models = cls.shards_for_read(sharding_source)
+        cached = list(filters) == [sharding_key] and sharding_cache.get_cache_timeout(cls)
+        if cached:
+            obj = sharding_cache.get_row(cls, shard_models, filters[sharding_key])
+            if obj is not None:
+                return obj
+
+        for shard_model in shard_models:
+            obj = shard_model.objects.filter(**filters).first()
+            if obj is not None:
+                if cached:
+                    sharding_cache.cache_row(obj)
+                return obj
+
+        raise ObjectDoesNotExist('%s matching query does not exist.' % cls.__name__)
+
+    @classmethod
+    def update_routed(cls, values, sharding_source=None, **filters):
+        """
+        Update the rows matching `filters` with `values` in a single `UPDATE` on the shards of `sharding_source`
+        (see `get_routed`), return the number of rows updated. Fields with `auto_now` are set as `save()` does. No
+        signal is sent, the cached lookups of the rows updated are invalidated. Updating fields of `SHARDING_INDEXES`
+        reads the primary keys of the rows first, to index them again.
+        """
+
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if sharding_key in values:
+            raise ValueError('%s.%s routes the rows and cannot be updated.' % (cls.__name__, sharding_key))
+
+        for shard_model, qs in cls.get_routed_querysets(sharding_source, filters):
+            auto_now_fields = [field for field in shard_model._meta.concrete_fields
+                               if getattr(field, 'auto_now', False) and field.name not in values]
+            if auto_now_fields:
+                obj = shard_model()
+                values = dict(values, **{field.name: field.pre_save(obj, False) for field in auto_now_fields})
+
+            keys = cls.get_cached_keys(qs, filters)
+            indexed_fields = set(values).intersection(sharding_index.get_indexed_fields(cls))
+            pks = list(qs.values_list('pk', flat=True)) if indexed_fields else []
+            rows = qs.update(**values)
+            if rows:
+                for key in keys:
+                    sharding_cache.invalidate_row(cls, shard_model._sharding, key, qs.db)
+                sharding_index.reindex_pks(cls, shard_model._sharding, pks, indexed_fields)
+                return rows
+
+        return 0
+
+    @classmethod
+    def delete_routed(cls, sharding_source=None, **filters):
+        """
+        Delete the rows matching `filters` with a single `DELETE ... WHERE` on the shards of `sharding_source` (see
+        `get_routed`), return the number of rows deleted. No signal is sent and no relation is collected, the cached
+        row counts and lookups are updated. Models with `SHARDING_INDEXES` read the primary keys of the rows first, to
+        remove them from the indexes.
+        """
+
+        for shard_model, qs in cls.get_routed_querysets(sharding_source, filters):
+            keys = cls.get_cached_keys(qs, filters)
+            pks = list(qs.values_list('pk', flat=True)) if sharding_index.get_indexed_fields(cls) else []
+            rows = qs._raw_delete(qs.db)
+            if rows:
+                sharding_counts.update_count(cls, shard_model._sharding, -rows)
+                for key in keys:
+                    sharding_cache.invalidate_row(cls, shard_model._sharding, key, qs.db)
+                if pks:
+                    sharding_index.unindex_pks(cls, shard_model._sharding, pks)
+                return rows
+
+        return 0
+
+    @classmethod
+    def get_routed_querysets(cls, sharding_source, filters):
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if sharding_source is None and sharding_key in filters:
+            sharding_source = cls.get_key_source(filters[sharding_key])
+
+        for shard_model in cls.shards_for_read(sharding_source):
+            qs = shard_model.objects.filter(**filters)
+            yield shard_model, qs.using(router.db_for_write(shard_model))
+
+    @classmethod
+    def get_cached_keys(cls, qs, filters):
+        """Return the `SHARDING_KEY` values of the rows of `qs` whose lookups may be cached."""
+
+        if not sharding_cache.get_cache_timeout(cls):
+            return []
+
+        sharding_key = cls.SHARDING_KEY
+        if sharding_key in filters:
+            return [filters[sharding_key]]
+
+        # Filtered by other fields, the keys of the cached rows are read before they change.
+        return list(qs.values_list(sharding_key, flat=True))
+
+    @classmethod
+    def get_sharding_source(cls, obj):
+        """Return the sharding source of `obj`, a row or a dict of field values, from its `SHARDING_KEY` field."""
+
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if sharding_key is None:
+            raise TypeError('%s declares no SHARDING_KEY.' % cls.__name__)
+
+        return cls.get_key_source(get_field_value(obj, sharding_key))
+
+    @classmethod
+    def get_key_source(cls, value):
+        """
+        Return the sharding source of a `SHARDING_KEY` value: its `SHARDING_HASH` (`hash64` by default) for a
+        precise sharding model, its date formatted with `SHARDING_DATE_FORMAT` for a date sharding model. Aware
+        datetimes are formatted in UTC with `USE_TZ`, like the current date routing rows written now.
+        """
+
+        if getattr(cls, 'SHARDING_TYPE', 'date') == 'date':
+            if value is None:
+                return None
+
+            if settings.USE_TZ and isinstance(value, datetime) and timezone.is_aware(value):
+                value = value.astimezone(timezone.utc)
+            return value.strftime(getattr(cls, 'SHARDING_DATE_FORMAT', SHARDING_DATE_FORMAT_DEFAULT))
+
+        if value is None:
+            raise TypeError('%s needs a %s value to be routed.' % (cls.__name__, getattr(cls, 'SHARDING_KEY', None)))
+
+        return getattr(cls, 'SHARDING_HASH', hash64)(value)
+
+    @classmethod
+    def shard_for(cls, **kwargs):
+        """Return the shard model of a `SHARDING_KEY` value, e.g. `User.shard_for(user_name='iTraceur')`."""
+
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if len(kwargs) != 1 or sharding_key not in kwargs:
+            raise TypeError('%s.shard_for() takes the single keyword argument %s.' % (cls.__name__, sharding_key))
+
+        return cls.shard(cls.get_key_source(kwargs[sharding_key]))
+
+    @classmethod
+    def create(cls, **values):
+        """Create a row in the shard its `SHARDING_KEY` value is routed to."""
+
+        return cls.shard(cls.get_sharding_source(values)).objects.create(**values)
+
+    @classmethod
+    def get_sharding_table(cls, sharding):
+        return "%s_%s%s" % (cls._meta.app_label, cls._meta.db_table, sharding)
+
+    @classmethod
+    def provision_shards(cls, shardings):
+        """
+        Create the models of `shardings` and the database tables which do not exist yet, return the shardings whose
+        tables were created. Tables are created with plain DDL and recorded in `ShardingTable`, no migration is
+        written or run. Run it ahead of time (see the `provision_shards` command) to keep table creation out of the
+        request path.
+        """
+
+        from .models import ShardingTable
+
+        shard_models = {}
+        for sharding in shardings:
+            db_table = cls.get_sharding_table(sharding)
+            shard_model = shard_tables.get(db_table)
+            if shard_model is None:
+                with sharding_locks.process_lock(db_table):
+                    shard_model = shard_tables.get(db_table) or create_model(cls, sharding)
+            shard_models[sharding] = shard_model
+
+        created = []
+        for sharding in shardings:
+            db_table = cls.get_sharding_table(sharding)
+            using = cls.get_sharding_database(sharding)
+            catalog = get_table_catalog(using)
+            if db_table in catalog:
+                continue
+
+            # Single flight: concurrent creators of the same shard, in this process or in another one, wait for the
+            # first one and then find the table created.
+            with sharding_locks.sharding_lock(db_table, using):
+                if db_table not in catalog.refresh():
+                    start = time.perf_counter()
+                    create_table(shard_models[sharding], using)
+                    ShardingTable.objects.get_or_create(db_table=db_table, defaults={
+                        'model': cls._meta.label_lower,
+                        'sharding': sharding,
+                        'database': using,
+                    })
+                    catalog.add(db_table)
+                    created.append(sharding)
+                    sharding_metrics.record_creation(cls, sharding, time.perf_counter() - start)
+
+        return created
+
+    @classmethod
+    def get_upcoming_shardings(cls, periods=SHARDING_PROVISION_PERIODS_DEFAULT):
+        """Return the current and the next `periods` date shardings, or all shardings of a precise sharding model."""
+
+        if getattr(cls, 'SHARDING_TYPE', 'date') != 'date':
+            return cls.get_sharding_list()
+
+        date_sharding_format = getattr(cls, 'SHARDING_DATE_FORMAT', SHARDING_DATE_FORMAT_DEFAULT)
+        date = timezone.now().date()
+        shardings = []
+        for _ in range(periods + 1):
+            shardings.append(date.strftime(date_sharding_format))
+            date = get_next_sharding_date(date, date_sharding_format)
+
+        return shardings
+
+    @classmethod
+    def get_expired_shardings(cls):
+        """Return the date shardings left out of the sharding index by `SHARDING_RETENTION`, oldest first."""
+
+        if getattr(cls, 'SHARDING_TYPE', 'date') != 'date' or not getattr(cls, 'SHARDING_RETENTION', None):
+            return []
+
+        index = cls.get_sharding_index()
+        return [sharding for sharding in cls.get_date_sharding_list() if sharding not in index]
+
+    @classmethod
+    def get_sharding(cls, sharding_source=None):
         if getattr(cls, 'SHARDING_TYPE', 'date') == 'date':
-            return cls.get_date_sharding_list()
+            sharding_source = str(sharding_source)
+            if sharding_source not in cls.get_sharding_index():
+                return cls.default_sharding()
+
+            return sharding_source
+
+        # Hashes of the sharding key are routed as they are, other sources are parsed, e.g. `'42'`.
+        if isinstance(sharding_source, int):
+            return cls.get_sharding_router().get_sharding(sharding_source)
+
+        try:
+            return cls.get_sharding_router().get_sharding(int(sharding_source))
+        except (TypeError, ValueError):
+            return cls.default_sharding()
+
+    @classmethod
+    def get_sharding_count(cls):
+        return int(getattr(cls, 'SHARDING_COUNT', SHARDING_COUNT_DEFAULT))
+
+    @classmethod
+    def get_sharding_router(cls):
+        """Return the router of a precise sharding model, picked by `SHARDING_ROUTER`."""
 
-        sharding_count = int(getattr(cls, 'SHARDING_COUNT', SHARDING_COUNT_DEFAULT))
-        return (str(sharding) for sharding in range(sharding_count))
+        return sharding_router.get_router(cls)
 
     @classmethod
-    def get_date_sharding_list(cls):
+    def get_sharding_index(cls):
+        """Return the `ShardingIndex` of this model, building it on first use."""
+
+        index = sharding_indexes.get(cls)
+        if index is None:
+            index = sharding_indexes.setdefault(cls, ShardingIndex(cls))
+
+        return index
+
+    @classmethod
+    def get_sharding_list(cls):
+        return list(cls.get_sharding_index())
+
+    @classmethod
+    def get_date_sharding_list(cls, date_start=None):
         """
         Generate a date sharding sequence of year or month or day, which starts from date setting named
-        `SHARDING_DATE_START` to ends of current date.
+        `SHARDING_DATE_START` (or `date_start` if given) to ends of current date.
         """
 
-        date_start = getattr(cls, 'SHARDING_DATE_START', SHARDING_DATE_START_DEFAULT)
+        if date_start is None:
+            date_start = getattr(cls, 'SHARDING_DATE_START', SHARDING_DATE_START_DEFAULT)
         date_end = timezone.now().date()
         date_sharding_format = getattr(cls, 'SHARDING_DATE_FORMAT', SHARDING_DATE_FORMAT_DEFAULT)
 
@@ -135,23 +784,8 @@ class ShardingMixin(object):
             date_start = timezone.datetime.strptime(date_start, '%Y-%m-%d').date()
 
         while date_start <= date_end:
-            if date_sharding_format.endswith('%Y'):
-                yield date_start.strftime(date_sharding_format)
-                date_start = date_start.replace(year=date_start.year + 1, day=1)
-            elif date_sharding_format.endswith('%d'):
-                _, month_length = calendar.monthrange(date_start.year, date_start.month)
-                if date_start.day <= month_length:
-                    yield date_start.strftime(date_sharding_format)
-                    date_start = date_start.replace(day=date_start.day + 1)
-
-                if date_start.day == month_length:
-                    yield date_start.strftime(date_sharding_format)
-                    next_year, next_month = get_next_year_and_month(date_start)
-                    date_start = date_start.replace(year=next_year, month=next_month, day=1)
-            else:
-                yield date_start.strftime('%Y%m')
-                next_year, next_month = get_next_year_and_month(date_start)
-                date_start = date_start.replace(year=next_year, month=next_month, day=1)
+            yield date_start.strftime(date_sharding_format)
+            date_start = get_next_sharding_date(date_start, date_sharding_format)
 
     @classmethod
     def default_sharding(cls):
@@ -169,15 +803,197 @@ class ShardingMixin(object):
         }
 
     @classmethod
-    def paginate_sharding(cls, page, page_size):
-        """Paginate the querysets of all shardings."""
+    def count_sharding(cls, sharding):
+        """
+        Return the row count of `sharding`. The count is cached and maintained by the save and delete paths, and
+        recounted exactly at the latest `SHARDING_COUNT_CACHE_TIMEOUT` seconds after it was last counted.
+        """
+
+        return sharding_counts.get_count(cls, sharding)
+
+    @classmethod
+    def bulk_create_routed(cls, objs, key=None, batch_size=None):
+        """
+        Insert `objs`, model instances or dicts of field values, into the shards their routing `key` maps them to.
+        `key` is a field name whose value is routed like a `SHARDING_KEY` value (the `SHARDING_KEY` by default), or
+        a callable returning the sharding source of an object. Missing shards are created once and every shard is
+        written with `bulk_create` inside one transaction. Return the created shard model instances in the order of
+        `objs`, with their primary keys.
+        """
+
+        key = getattr(cls, 'SHARDING_KEY', None) if key is None else key
+        groups = OrderedDict()
+        for obj in objs:
+            if callable(key):
+                source = key(obj)
+            else:
+                source = cls.get_key_source(get_field_value(obj, key))
+            groups.setdefault(cls.get_sharding(source), []).append(obj)
+
+        cls.provision_shards(list(groups))
+        created = {}
+        for sharding, shard_objs in groups.items():
+            shard_model = cls.get_shard_model(sharding)
+            instances = [shard_model(**cls.get_field_values(obj)) for obj in shard_objs]
+            with transaction.atomic(using=router.db_for_write(shard_model)):
+                shard_model.objects.bulk_create(instances, batch_size=batch_size)
+            cls.fill_bulk_created_pks(shard_model, instances,
+                                      getattr(cls, 'SHARDING_KEY', None) if callable(key) else key)
+            sharding_counts.update_count(cls, sharding, len(instances))
+            sharding_index.index_objects(cls, sharding, instances, created=True)
 
-        total_count = 0
-        sharding_count_map = OrderedDict()
-        for sharding in cls.get_sharding_list():
-            count = cls.shard(sharding).objects.count()
-            sharding_count_map[sharding] = count
-            total_count += count
+            for obj, instance in zip(shard_objs, instances):
+                created[id(obj)] = instance
+
+        return [created[id(obj)] for obj in objs]
+
+    @classmethod
+    def uses_write_buffer(cls):
+        return bool(getattr(cls, 'SHARDING_WRITE_BUFFER', sharding_buffer.SHARDING_WRITE_BUFFER_DEFAULT))
+
+    @classmethod
+    def create_buffered(cls, sharding_source=None, wait=False, **values):
+        """
+        Queue a row for a write-behind multi-row insert into the shard of `sharding_source`. With `wait`, return the
+        created instance with its primary key once the queue is flushed, otherwise return `None` right away.
+        """
+
+        return sharding_buffer.get_write_buffer(cls).put(values, sharding_source, wait=wait)
+
+    @classmethod
+    def bulk_update_routed(cls, objs, fields, batch_size=None):
+        """
+        Update `fields` of the shard model instances `objs` with one `bulk_update` transaction per shard. No signal is
+        sent, the cached lookups of the rows are invalidated and their `SHARDING_INDEXES` entries are updated, like
+        `update_routed` does.
+        """
+
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if sharding_key in fields:
+            raise ValueError('%s.%s routes the rows and cannot be updated.' % (cls.__name__, sharding_key))
+
+        groups = OrderedDict()
+        for obj in objs:
+            if getattr(obj, '_sharding_model', None) is not cls:
+                raise TypeError('%r is not an instance of a shard model of %s.' % (obj, cls.__name__))
+            groups.setdefault(obj.__class__, []).append(obj)
+
+        indexed_fields = set(fields).intersection(sharding_index.get_indexed_fields(cls))
+        for shard_model, shard_objs in groups.items():
+            using = router.db_for_write(shard_model)
+            with transaction.atomic(using=using):
+                shard_model.objects.bulk_update(shard_objs, fields, batch_size=batch_size)
+
+            if sharding_key is not None and sharding_cache.get_cache_timeout(cls):
+                for obj in shard_objs:
+                    sharding_cache.invalidate_row(cls, shard_model._sharding, getattr(obj, sharding_key), using)
+            if indexed_fields:
+                sharding_index.index_objects(cls, shard_model._sharding, shard_objs, indexed_fields)
+
+    @classmethod
+    def get_field_values(cls, obj):
+        """Return the field values of `obj` to create it in another shard, without its primary key."""
+
+        if isinstance(obj, dict):
+            return obj
+
+        return {field.attname: getattr(obj, field.attname) for field in obj._meta.concrete_fields
+                if not field.primary_key}
+
+    @classmethod
+    def fill_bulk_created_pks(cls, shard_model, instances, key):
+        """Read back the primary keys of `instances` by the unique `key` field, if the backend did not return them."""
+
+        if isinstance(key, str) and any(instance.pk is None for instance in instances):
+            if not shard_model._meta.get_field(key).unique:
+                return
+
+            values = [getattr(instance, key) for instance in instances]
+            pks = dict(shard_model.objects.filter(**{key + '__in': values}).values_list(key, 'pk'))
+            for instance in instances:
+                instance.pk = pks.get(getattr(instance, key))
+                instance._state.adding = False
+                instance._state.db = router.db_for_write(shard_model)
+
+    @classmethod
+    def filter_indexed(cls, **filters):
+        """
+        Return a `ShardedQuerySet` of the rows matching `filters` over only the shards holding rows whose value of an
+        indexed field matches, e.g. `User.filter_indexed(name='iTraceur')`, see `apps.base.sharding_index`.
+        """
+
+        return sharding_index.filter_indexed(cls, **filters)
+
+    @classmethod
+    def all_shards(cls, shardings=None):
+        """
+        Return a lazy `ShardedQuerySet` over `shardings` (all shardings by default) supporting `filter()`, `exclude()`,
+        `order_by()` and slicing across shards, e.g. `Log.all_shards().order_by('-time')[:50]`.
+        """
+
+        return ShardedQuerySet(cls, shardings)
+
+    @classmethod
+    def get_range_shardings(cls, start, end):
+        """Return the live date shardings overlapping the `SHARDING_KEY` range [`start`, `end`), oldest first."""
+
+        # The range ends in the period of its last instant, a range ending at the start of a period stops before it.
+        last = end - (timedelta(microseconds=1) if isinstance(end, datetime) else timedelta(days=1))
+        shardings = cls.get_sharding_list()
+        # Date suffixes of a given format sort like the dates they stand for, so the range is bisected in the live
+        # shardings instead of walking every period of the range.
+        return shardings[bisect_left(shardings, cls.get_key_source(start)):
+                         bisect_right(shardings, cls.get_key_source(last))]
+
+    @classmethod
+    def between(cls, start, end):
+        """
+        Return a `ShardedQuerySet` of the rows whose `SHARDING_KEY` is in [`start`, `end`), ordered by it, e.g.
+        `Log.between(yesterday, today)`. Only the date shards overlapping the range are queried, the range is only
+        filtered on the first and the last of them, and the rows are streamed shard after shard. Dates bound a
+        datetime `SHARDING_KEY` at their midnight.
+        """
+
+        sharding_key = getattr(cls, 'SHARDING_KEY', None)
+        if getattr(cls, 'SHARDING_TYPE', 'date') != 'date' or sharding_key is None:
+            raise TypeError('%s.between() needs a date sharding model with a SHARDING_KEY.' % cls.__name__)
+
+        if isinstance(cls._meta.get_field(sharding_key), models.DateTimeField):
+            start, end = to_datetime(start), to_datetime(end)
+
+        shardings = cls.get_range_shardings(start, end) if start < end else []
+        qs = ShardedQuerySet(cls, shardings, sharding_ordered=True).order_by(sharding_key)
+        if shardings:
+            qs = qs.filter_sharding(shardings[0], **{sharding_key + '__gte': start})
+            qs = qs.filter_sharding(shardings[-1], **{sharding_key + '__lt': end})
+
+        return qs
+
+    @classmethod
+    def scatter_gather(cls, func, shardings=None, merge=None):
+        """
+        Call `func(shard_model, sharding)` for every sharding of `shardings` (all shardings by default) in parallel
+        and return the results in sharding order, or `merge(results)` if `merge` is given, e.g.:
+        `User.scatter_gather(lambda model, sharding: model.objects.filter(active=True).count(), merge=sum)`
+        """
+
+        shardings = cls.get_sharding_list() if shardings is None else shardings
+        items = [(cls.get_shard_model(sharding), sharding) for sharding in shardings]
+        return sharding_executor.scatter_gather(func, items, merge=merge)
+
+    @classmethod
+    def paginate_sharding(cls, page, page_size, stream=False):
+        """
+        Paginate the querysets of all shardings, rows are projected as dicts on the fields of `get_dict_fields`. With
+        `stream`, the result is an iterator reading the rows shard after shard while it is consumed, see
+        `apps.base.sharding_stream`, instead of a list of the rows read from the shards in parallel.
+        """
+
+        page_size = max(page_size, 1)
+        shardings = cls.get_sharding_list()
+        counts = cls.scatter_gather(lambda shard_model, sharding: cls.count_sharding(sharding), shardings)
+        sharding_count_map = OrderedDict(zip(shardings, counts))
+        total_count = sum(counts)
 
         max_page = math.ceil(total_count / page_size) or 1
         if page == 0:
@@ -185,27 +1001,25 @@ class ShardingMixin(object):
         elif page > max_page or page < 0:
             page = max_page
 
-        diff = 0
+        start = (page - 1) * page_size
+        end = page * page_size
         accumulation_count = 0
-        results = []
+        slices = OrderedDict()
         for sharding, count in sharding_count_map.items():
+            if accumulation_count + count > start and accumulation_count < end:
+                slices[sharding] = (max(start - accumulation_count, 0), min(end - accumulation_count, count))
             accumulation_count += count
-            page_num = math.ceil(accumulation_count / page_size)
-            if page <= page_num:
-                if diff:
-                    qs = cls.shard(sharding).objects.all()[0:diff]
-                else:
-                    start = count - (accumulation_count - (page - 1) * page_size)
-                    end = start + page_size
-                    qs = cls.shard(sharding).objects.all()[start:end]
-
-                for obj in qs:
-                    results.append(model_to_dict(obj))
-                diff = page_size - len(results)
-                if diff:
-                    continue
 
-                break
+        def fetch_slice(shard_model, sharding):
+            slice_start, slice_end = slices[sharding]
+            return shard_model.objects.values(*get_dict_fields(shard_model))[slice_start:slice_end]
+
+        if stream:
+            results = chain.from_iterable(fetch_slice(cls.get_shard_model(sharding), sharding).iterator()
+                                          for sharding in slices)
+        else:
+            results = cls.scatter_gather(lambda shard_model, sharding: list(fetch_slice(shard_model, sharding)),
+                                         slices, merge=lambda pages: list(chain.from_iterable(pages)))
 
         ret = {
             'result': results,
@@ -213,3 +1027,46 @@ class ShardingMixin(object):
             'next_page': page + 1 if page < max_page else None
         }
         return ret
+
+    @classmethod
+    def paginate_sharding_by_cursor(cls, cursor=None, page_size=10, shardings=None):
+        """
+        Keyset paginate the querysets of `shardings` (all shardings by default) in sharding and primary key order.
+        Each page resumes right after the (sharding, pk) position stored in `cursor`, so no shard is counted and
+        deep pages cost the same as the first one.
+        """
+
+        page_size = max(page_size, 1)
+        shardings = list(cls.get_sharding_list() if shardings is None else shardings)
+        resume_pk = None
+        if cursor:
+            sharding, resume_pk = decode_sharding_cursor(cursor)
+            if sharding not in shardings:
+                raise ValueError('Invalid cursor: %r' % cursor)
+
+            shardings = shardings[shardings.index(sharding):]
+
+        results = []
+        sharding = last_pk = None
+        for sharding in shardings:
+            shard_model = cls.get_shard_model(sharding)
+            fields = get_dict_fields(shard_model)
+            pk_name = shard_model._meta.pk.name
+            # The primary key positions the cursor even when it is not serialized.
+            projection = fields if pk_name in fields else [pk_name] + fields
+            qs = shard_model.objects.order_by('pk')
+            if resume_pk is not None:
+                qs = qs.filter(pk__gt=resume_pk)
+                resume_pk = None
+
+            for row in qs.values(*projection)[:page_size - len(results)]:
+                last_pk = row[pk_name] if pk_name in fields else row.pop(pk_name)
+                results.append(row)
+            if len(results) >= page_size:
+                break
+
+        ret = {
+            'result': results,
+            'next_cursor': encode_sharding_cursor(sharding, last_pk) if len(results) >= page_size else None
+        }
+        return ret
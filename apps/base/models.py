@@ -0,0 +1,52 @@
+from django.db import models
+
+
+class ShardingTable(models.Model):
+    """Metadata of a shard table created by the sharding layer instead of a migration."""
+
+    model = models.CharField(max_length=100, db_index=True)
+    sharding = models.CharField(max_length=50)
+    db_table = models.CharField(max_length=128, unique=True)
+    database = models.CharField(max_length=100, default='default')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.db_table
+
+    class Meta:
+        db_table = 'sharding_table'
+
+
+class ShardingBucket(models.Model):
+    """
+    Virtual bucket of a precise sharding model routed by `BucketRouter`. `target` is set while the bucket is being
+    moved to another sharding by the `reshard` command.
+    """
+
+    model = models.CharField(max_length=100)
+    bucket = models.PositiveIntegerField()
+    sharding = models.CharField(max_length=50)
+    target = models.CharField(max_length=50, null=True, blank=True)
+
+    def __str__(self):
+        return '%s:%s' % (self.model, self.bucket)
+
+    class Meta:
+        db_table = 'sharding_bucket'
+        unique_together = ('model', 'bucket')
+
+
+class ShardingBucketVersion(models.Model):
+    """
+    Version of the `ShardingBucket` map of a precise sharding model, bumped with every change of the map. Every
+    process polls it to re-read the map once it changed.
+    """
+
+    model = models.CharField(max_length=100, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return '%s:%s' % (self.model, self.version)
+
+    class Meta:
+        db_table = 'sharding_bucket_version'
@@ -0,0 +1,130 @@
+"""
+Lazy admin registration of shard models. The `ModelAdmin` of a shard model is registered when the model is first
+created on access, instead of registering every shard on startup. An admin site served with `get_urls(site)`
+(`path('admin/', sharding_admin.get_urls(admin.site))`) has one static catch-all route for the shard models: every
+request looks its shard model up, loading an existing shard not loaded yet, and is dispatched to the URLs of its
+`ModelAdmin`. The request is served with a URLconf adding these URLs to the admin URLs, so that the admin pages of the
+shard reverse them, and the admin indexes link the shard models they list, while django's URL resolver never changes.
+"""
+
+from functools import partial
+
+from django.apps import apps
+from django.contrib import admin
+from django.http import Http404
+from django.urls import (
+    Resolver404, ResolverMatch, URLResolver, get_resolver, include, path, re_path, reverse, set_urlconf
+)
+from django.urls.resolvers import RegexPattern
+
+admin_urlpatterns = {}
+
+
+def get_urls(site=admin.site):
+    """Return the URLs of the admin `site` to include at its root, serving the shard models registered later."""
+
+    from .model_sharding import get_sharding_models
+
+    urlpatterns = [path('', site.admin_view(partial(link_shard_models, site.index)), name='index')]
+    # The index of the apps of the sharding models, whatever shard models they have registered.
+    app_labels = sorted({model_class._meta.app_label for model_class in get_sharding_models()})
+    if app_labels:
+        urlpatterns.append(re_path(r'^(?P<app_label>%s)/$' % '|'.join(app_labels),
+                                   site.admin_view(partial(link_shard_models, site.app_index)), name='app_list'))
+    urlpatterns += site.get_urls()
+    urlpatterns.append(re_path(r'^(?P<app_label>\w+)/(?P<model_name>\w+)/(?P<url>.*)$',
+                               site.admin_view(partial(shard_admin_view, site))))
+    admin_urlpatterns[site] = urlpatterns
+    return urlpatterns, 'admin', site.name
+
+
+def get_model_route(model_class):
+    return '%s/%s/' % (model_class._meta.app_label, model_class._meta.model_name)
+
+
+def get_shard_model_admin(site, app_label, model_name):
+    """Return the `ModelAdmin` of the shard model named `model_name` in `site`, loading the shard if needed."""
+
+    from .model_sharding import find_shard_model
+
+    try:
+        model_class = apps.get_model(app_label, model_name)
+    except LookupError:
+        model_class = find_shard_model(app_label, model_name)
+
+    if getattr(model_class, '_sharding_model', None) is None or not site.is_registered(model_class):
+        return None
+
+    return site._registry[model_class]
+
+
+class ShardAdminURLConf(object):
+    """
+    URLconf of a request to the admin of a shard model: the root URLconf with the URLs of the shard model added to
+    the admin of `site` included at `prefix`. Django caches a resolver per URLconf, the URLconfs of a shard are equal
+    whatever its model class, so that a shard model evicted and created again does not add a resolver.
+    """
+
+    def __init__(self, site, model_admin, prefix):
+        self.key = (site.name, model_admin.opts.label_lower, prefix)
+        model_urls = [path(get_model_route(model_admin.model), include(model_admin.urls))]
+        self.urlpatterns = [path(prefix, (model_urls + admin_urlpatterns[site], 'admin', site.name))]
+        self.urlpatterns += get_resolver().url_patterns
+
+    def __eq__(self, other):
+        return isinstance(other, ShardAdminURLConf) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+def shard_admin_view(site, request, app_label, model_name, url):
+    """Serve `url` of the admin of the shard model named `model_name`, e.g. `change/1/` of `log202005`."""
+
+    model_admin = get_shard_model_admin(site, app_label, model_name)
+    if model_admin is None:
+        raise Http404('Unknown shard %s.%s' % (app_label, model_name))
+
+    try:
+        match = URLResolver(RegexPattern(r'^'), model_admin.urls).resolve(url)
+    except Resolver404:
+        raise Http404('Unknown admin page of %s.%s' % (app_label, model_name))
+
+    path_info = request.path_info
+    prefix = path_info[1:len(path_info) - len('%s/%s/%s' % (app_label, model_name, url))]
+    # Reversed when the response is rendered, the URLconf is reset once the request is finished.
+    set_urlconf(ShardAdminURLConf(site, model_admin, prefix))
+    request.resolver_match = ResolverMatch(match.func, match.args, match.kwargs, match.url_name, ['admin'],
+                                           [site.name])
+    return match.func(request, *match.args, **match.kwargs)
+
+
+def link_shard_models(view, request, *args, **kwargs):
+    """Serve the admin index `view`, linking the shard models it lists, whose URLs it cannot reverse."""
+
+    response = view(request, *args, **kwargs)
+    index_url = reverse('admin:index', current_app=request.current_app)
+    for app in response.context_data['app_list']:
+        for model in app['models']:
+            model_class = apps.get_model(app['app_label'], model['object_name'])
+            if getattr(model_class, '_sharding_model', None) is None:
+                continue
+
+            url = '%s%s' % (index_url, get_model_route(model_class))
+            if model['admin_url'] is None and (model['perms'].get('change') or model['perms'].get('view')):
+                model['admin_url'] = url
+            if model['add_url'] is None and model['perms'].get('add'):
+                model['add_url'] = url + 'add/'
+
+    return response
+
+
+def register(model_class, admin_class, site=admin.site):
+    """Register `model_class` with the admin `site`, its URLs are served by the shard route of `get_urls`."""
+
+    site.register(model_class, admin_class)
+
+
+def unregister(model_class, site=admin.site):
+    if site.is_registered(model_class):
+        site.unregister(model_class)
@@ -0,0 +1,94 @@
+"""
+Retention of date sharding models. A model declaring `SHARDING_RETENTION = N` only keeps its last N shardings in its
+`ShardingIndex`, so older shardings are neither routed to nor included in cross-shard queries any more.
+`archive_expired_shards()`, what the `archive_shards` command runs, then exports the rows of the expired shards to
+gzip compressed NDJSON files in `SHARDING_ARCHIVE_DIR`, drops their tables and forgets their models.
+"""
+
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import model_sharding, sharding_counts, sharding_index, sharding_locks
+
+SHARDING_ARCHIVE_DIR = getattr(settings, 'SHARDING_ARCHIVE_DIR',
+                               os.path.join(getattr(settings, 'BASE_DIR', os.getcwd()), 'archive'))
+SHARDING_ARCHIVE_BATCH_SIZE = getattr(settings, 'SHARDING_ARCHIVE_BATCH_SIZE', 2000)
+
+
+def get_archivable_shardings(model_class):
+    """Return the expired shardings of `model_class` whose tables still exist."""
+
+    shardings = []
+    for sharding in model_class.get_expired_shardings():
+        catalog = model_sharding.get_table_catalog(model_class.get_sharding_database(sharding))
+        if model_class.get_sharding_table(sharding) in catalog:
+            shardings.append(sharding)
+
+    return shardings
+
+
+def export_shard(shard_model, path, batch_size=SHARDING_ARCHIVE_BATCH_SIZE):
+    """Write the rows of `shard_model` in primary key order to the gzip NDJSON file `path`, return the row count."""
+
+    count = 0
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for row in shard_model.objects.order_by('pk').values().iterator(chunk_size=batch_size):
+            f.write(json.dumps(row, cls=DjangoJSONEncoder))
+            f.write('\n')
+            count += 1
+
+    # The archive only appears once it is complete, a run interrupted before the table is dropped is just run again.
+    os.replace(tmp_path, path)
+    return count
+
+
+def archive_shard(model_class, sharding, directory=SHARDING_ARCHIVE_DIR, batch_size=SHARDING_ARCHIVE_BATCH_SIZE):
+    """
+    Export the shard `sharding` of `model_class` to `<directory>/<db_table>.ndjson.gz`, then drop its table and
+    unregister its model. Return the path and the row count of the archive, or `None` if the shard has no table.
+    """
+
+    from .models import ShardingTable
+
+    db_table = model_class.get_sharding_table(sharding)
+    using = model_class.get_sharding_database(sharding)
+    catalog = model_sharding.get_table_catalog(using)
+    with sharding_locks.sharding_lock(db_table, using):
+        if db_table not in catalog.refresh():
+            return None
+
+        shard_model = model_sharding.shard_tables.get(db_table) or model_sharding.create_model(model_class, sharding)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%s.ndjson.gz' % db_table)
+        count = export_shard(shard_model, path, batch_size)
+
+        model_sharding.drop_table(shard_model, using)
+        ShardingTable.objects.filter(db_table=db_table).delete()
+        catalog.discard(db_table)
+        model_sharding.remove_model(shard_model)
+        sharding_counts.invalidate_count(model_class, sharding)
+        sharding_index.unindex_sharding(model_class, sharding)
+
+    return path, count
+
+
+def archive_expired_shards(model_classes=None, directory=SHARDING_ARCHIVE_DIR, batch_size=SHARDING_ARCHIVE_BATCH_SIZE):
+    """
+    Archive the expired shards of `model_classes`, all sharding models by default. Return `{label: {sharding:
+    (path, count)}}` of the archived shards.
+    """
+
+    archived = {}
+    for model_class in (model_sharding.get_sharding_models() if model_classes is None else model_classes):
+        shards = archived[model_class._meta.label_lower] = {}
+        for sharding in get_archivable_shardings(model_class):
+            archive = archive_shard(model_class, sharding, directory, batch_size)
+            if archive is not None:
+                shards[sharding] = archive
+
+    return archived
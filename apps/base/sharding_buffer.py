@@ -0,0 +1,162 @@
+"""
+Write-behind buffering of inserts into sharding models, enabled per model by `SHARDING_WRITE_BUFFER`. Rows are queued
+in process and written to their shards with one multi-row insert per shard once `SHARDING_WRITE_BUFFER_SIZE` rows are
+queued, every `SHARDING_WRITE_BUFFER_DELAY` seconds, and on interpreter shutdown. Rows are assigned to the shard that is
+current when they are queued, while fields like `auto_now_add` get the time of the flush. The rows a caller waits for
+are inserted one by one on databases not returning the primary keys of multi-row inserts, e.g. SQLite, so that the
+instances returned have their primary key.
+"""
+
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+
+SHARDING_WRITE_BUFFER_DEFAULT = getattr(settings, 'SHARDING_WRITE_BUFFER_DEFAULT', False)
+SHARDING_WRITE_BUFFER_SIZE_DEFAULT = getattr(settings, 'SHARDING_WRITE_BUFFER_SIZE_DEFAULT', 500)
+SHARDING_WRITE_BUFFER_DELAY_DEFAULT = getattr(settings, 'SHARDING_WRITE_BUFFER_DELAY_DEFAULT', 1.0)
+
+logger = logging.getLogger(__name__)
+
+write_buffers = {}
+_write_buffers_lock = threading.Lock()
+
+
+class PendingWrite(object):
+    def __init__(self, sharding, values, wait=False):
+        self.sharding = sharding
+        self.values = values
+        self.wait = wait
+        self.instance = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ShardingWriteBuffer(object):
+    def __init__(self, model_class, max_size=None, max_delay=None):
+        self.model_class = model_class
+        self.max_size = max_size or int(
+            getattr(model_class, 'SHARDING_WRITE_BUFFER_SIZE', SHARDING_WRITE_BUFFER_SIZE_DEFAULT))
+        self.max_delay = max_delay or float(
+            getattr(model_class, 'SHARDING_WRITE_BUFFER_DELAY', SHARDING_WRITE_BUFFER_DELAY_DEFAULT))
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, values, sharding_source=None, wait=False, timeout=None):
+        """
+        Queue a row of field `values` for the shard `sharding_source` maps to. With `wait`, flush the queue right
+        away and return the created instance once it is written, raising the error of its insert if any.
+        """
+
+        pending = PendingWrite(self.model_class.get_sharding(sharding_source), values, wait)
+        with self.lock:
+            self.pending.append(pending)
+            full = len(self.pending) >= self.max_size
+            self.start_flusher()
+
+        if full or wait:
+            self.flush()
+        if not wait:
+            return None
+
+        if not pending.done.wait(timeout):
+            raise TimeoutError('Timed out waiting for the buffered write to be flushed.')
+        if pending.error is not None:
+            raise pending.error
+
+        return pending.instance
+
+    def flush(self):
+        """Write every queued row with one `bulk_create` per shard, return the number of rows written."""
+
+        with self.lock:
+            pending, self.pending = self.pending, []
+
+        groups = {}
+        for item in pending:
+            groups.setdefault(item.sharding, []).append(item)
+
+        written = 0
+        for sharding, items in groups.items():
+            try:
+                instances = self.write(sharding, items)
+            except Exception as exc:
+                logger.exception('Failed to flush %d buffered rows of %s%s', len(items),
+                                 self.model_class.__name__, sharding)
+                for item in items:
+                    item.error = exc
+                    item.done.set()
+                continue
+
+            for item, instance in zip(items, instances):
+                item.instance = instance
+                item.done.set()
+            written += len(items)
+
+        return written
+
+    def write(self, sharding, items):
+        """Insert the rows of `items` into the shard `sharding`, return the created instances in order."""
+
+        shard_model = self.model_class.get_shard_model(sharding)
+        using = router.db_for_write(shard_model)
+        if connections[using].features.can_return_rows_from_bulk_insert:
+            waited = []
+        else:
+            waited = [item for item in items if item.wait]
+
+        bulk = [item for item in items if not item.wait] if waited else items
+        instances = dict(zip(bulk, self.model_class.bulk_create_routed(
+            [item.values for item in bulk], key=lambda values: sharding)))
+        with transaction.atomic(using=using):
+            for item in waited:
+                instances[item] = shard_model.objects.create(**item.values)
+
+        return [instances[item] for item in items]
+
+    def start_flusher(self):
+        if self.flusher is None and not self.stopped.is_set():
+            self.flusher = threading.Thread(target=self.run_flusher, name='sharding-write-buffer', daemon=True)
+            self.flusher.start()
+
+    def run_flusher(self):
+        while not self.stopped.wait(self.max_delay):
+            if self.pending:
+                try:
+                    self.flush()
+                finally:
+                    close_old_connections()
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+
+def get_write_buffer(model_class):
+    buffer = write_buffers.get(model_class)
+    if buffer is None:
+        with _write_buffers_lock:
+            buffer = write_buffers.setdefault(model_class, ShardingWriteBuffer(model_class))
+
+    return buffer
+
+
+def flush_write_buffers():
+    for buffer in list(write_buffers.values()):
+        buffer.flush()
+
+
+@atexit.register
+def close_write_buffers():
+    for buffer in list(write_buffers.values()):
+        try:
+            buffer.close()
+        except Exception:
+            logger.exception('Failed to flush the write buffer of %s', buffer.model_class.__name__)
@@ -0,0 +1,104 @@
+"""
+Read-through cache of the routed point lookups of `ShardingMixin.get_routed()` by `SHARDING_KEY`, through django's
+cache framework. A model opts in with `SHARDING_LOOKUP_CACHE_TIMEOUT` (seconds, `0` disables the cache), rows are
+cached by model, shard and `SHARDING_KEY` value, and the row of a shard is invalidated when it is saved or deleted,
+then again when the write commits. Bound the size of the cache with the options of the `SHARDING_LOOKUP_CACHE_ALIAS`
+cache, e.g. `MAX_ENTRIES`. The cache must be shared by all processes, a row written by one process is invalidated in
+the cache of that process only otherwise: the `sharding.E001` system check rejects local memory and dummy caches.
+"""
+
+from hashlib import md5
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+SHARDING_LOOKUP_CACHE_ALIAS = getattr(settings, 'SHARDING_LOOKUP_CACHE_ALIAS', 'default')
+SHARDING_LOOKUP_CACHE_TIMEOUT_DEFAULT = getattr(settings, 'SHARDING_LOOKUP_CACHE_TIMEOUT_DEFAULT', 0)
+
+
+def get_cache():
+    return caches[SHARDING_LOOKUP_CACHE_ALIAS]
+
+
+def is_process_local(cache):
+    """Whether `cache` is only seen by the current process, e.g. django's default local memory cache."""
+
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def check_lookup_cache(app_configs, **kwargs):
+    from .model_sharding import get_sharding_models
+
+    if not is_process_local(get_cache()):
+        return []
+
+    return [checks.Error(
+        '%s caches its lookups in the process local cache %r.' % (model_class.__name__, SHARDING_LOOKUP_CACHE_ALIAS),
+        hint='Configure a cache shared by all processes, e.g. memcached, as SHARDING_LOOKUP_CACHE_ALIAS, or unset '
+             'SHARDING_LOOKUP_CACHE_TIMEOUT.',
+        obj=model_class, id='sharding.E001',
+    ) for model_class in get_sharding_models() if get_cache_timeout(model_class)]
+
+
+def get_cache_timeout(model_class):
+    return int(getattr(model_class, 'SHARDING_LOOKUP_CACHE_TIMEOUT', SHARDING_LOOKUP_CACHE_TIMEOUT_DEFAULT))
+
+
+def get_cache_key(model_class, sharding, value):
+    digest = md5(str(value).encode()).hexdigest()
+    return 'sharding_lookup:%s:%s:%s' % (model_class._meta.label_lower, sharding, digest)
+
+
+def get_row(model_class, shard_models, value):
+    """Return the cached row of `value` from the first of `shard_models` having it cached, or `None`."""
+
+    keys = [get_cache_key(model_class, shard_model._sharding, value) for shard_model in shard_models]
+    cached = get_cache().get_many(keys)
+    for key, shard_model in zip(keys, shard_models):
+        if key in cached:
+            field_names, values = cached[key]
+            return shard_model.from_db(router.db_for_read(shard_model), field_names, values)
+
+    return None
+
+
+def cache_row(obj):
+    model_class = obj._sharding_model
+    fields = obj._meta.concrete_fields
+    value = ([field.attname for field in fields], [getattr(obj, field.attname) for field in fields])
+    key = get_cache_key(model_class, obj._sharding, getattr(obj, model_class.SHARDING_KEY))
+    get_cache().set(key, value, get_cache_timeout(model_class))
+
+
+def invalidate_row(model_class, sharding, value, using=DEFAULT_DB_ALIAS):
+    """
+    Invalidate the cached row of `value` now and again once the transaction of `using` commits, so that a reader
+    caching the row before the commit cannot keep serving its old version until the cache timeout.
+    """
+
+    key = get_cache_key(model_class, sharding, value)
+    get_cache().delete(key)
+    transaction.on_commit(lambda: get_cache().delete(key), using=using)
+
+
+def invalidate_on_change(sender, instance=None, raw=False, using=DEFAULT_DB_ALIAS, **kwargs):
+    sharding_model = getattr(sender, '_sharding_model', None)
+    if sharding_model is not None and not raw and get_cache_timeout(sharding_model):
+        invalidate_row(sharding_model, sender._sharding, getattr(instance, sharding_model.SHARDING_KEY), using)
+
+
+def connect(shard_model):
+    """Invalidate the cached lookups of the rows of `shard_model` when they are saved or deleted."""
+
+    post_save.connect(invalidate_on_change, sender=shard_model, dispatch_uid='sharding_cache.invalidate_on_save')
+    post_delete.connect(invalidate_on_change, sender=shard_model, dispatch_uid='sharding_cache.invalidate_on_delete')
+
+
+def disconnect(shard_model):
+    post_save.disconnect(sender=shard_model, dispatch_uid='sharding_cache.invalidate_on_save')
+    post_delete.disconnect(sender=shard_model, dispatch_uid='sharding_cache.invalidate_on_delete')
@@ -0,0 +1,97 @@
+"""
+Per-shard row counts cached through django's cache framework. The counts are kept up to date incrementally by the
+save and delete paths of the sharding models and are recounted exactly once they are older than the staleness bound
+`SHARDING_COUNT_CACHE_TIMEOUT` (in seconds, `0` disables the cache).
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+
+SHARDING_COUNT_CACHE_ALIAS = getattr(settings, 'SHARDING_COUNT_CACHE_ALIAS', 'default')
+SHARDING_COUNT_CACHE_TIMEOUT_DEFAULT = getattr(settings, 'SHARDING_COUNT_CACHE_TIMEOUT_DEFAULT', 60)
+
+
+def get_cache():
+    return caches[SHARDING_COUNT_CACHE_ALIAS]
+
+
+def get_cache_key(model_class, sharding):
+    return 'sharding_count:%s:%s' % (model_class._meta.label_lower, sharding)
+
+
+def get_cache_timeout(model_class):
+    return int(getattr(model_class, 'SHARDING_COUNT_CACHE_TIMEOUT', SHARDING_COUNT_CACHE_TIMEOUT_DEFAULT))
+
+
+def get_count(model_class, sharding):
+    """Return the row count of `sharding`, counting the table only when the cached count is missing or expired."""
+
+    timeout = get_cache_timeout(model_class)
+    if not timeout:
+        return model_class.get_shard_model(sharding).objects.count()
+
+    key = get_cache_key(model_class, sharding)
+    count = get_cache().get(key)
+    if count is None:
+        count = model_class.get_shard_model(sharding).objects.count()
+        get_cache().set(key, count, timeout)
+
+    return count
+
+
+def reconcile_counts(model_class, shardings=None):
+    """Recount `shardings` (all shardings by default) exactly and reset their cached counts."""
+
+    timeout = get_cache_timeout(model_class)
+    counts = {}
+    for sharding in (model_class.get_sharding_list() if shardings is None else shardings):
+        counts[sharding] = model_class.get_shard_model(sharding).objects.count()
+        if timeout:
+            get_cache().set(get_cache_key(model_class, sharding), counts[sharding], timeout)
+
+    return counts
+
+
+def update_count(model_class, sharding, delta):
+    """Add `delta` to the cached count of `sharding`. A missing count is left alone to be recounted on next read."""
+
+    if not delta or not get_cache_timeout(model_class):
+        return
+
+    try:
+        get_cache().incr(get_cache_key(model_class, sharding), delta)
+    except ValueError:
+        pass
+
+
+def invalidate_count(model_class, sharding):
+    get_cache().delete(get_cache_key(model_class, sharding))
+
+
+def update_count_on_save(sender, created=False, raw=False, **kwargs):
+    sharding_model = getattr(sender, '_sharding_model', None)
+    if sharding_model is not None and created and not raw:
+        update_count(sharding_model, sender._sharding, 1)
+
+
+def update_count_on_delete(sender, **kwargs):
+    sharding_model = getattr(sender, '_sharding_model', None)
+    if sharding_model is not None:
+        update_count(sharding_model, sender._sharding, -1)
+
+
+def connect(shard_model):
+    """
+    Count the rows saved in and deleted from `shard_model`. The receivers are connected to the shard models only, so
+    that the deletes of every other model keep django's fast delete.
+    """
+
+    post_save.connect(update_count_on_save, sender=shard_model, dispatch_uid='sharding_counts.update_count_on_save')
+    post_delete.connect(
+        update_count_on_delete, sender=shard_model, dispatch_uid='sharding_counts.update_count_on_delete')
+
+
+def disconnect(shard_model):
+    post_save.disconnect(sender=shard_model, dispatch_uid='sharding_counts.update_count_on_save')
+    post_delete.disconnect(sender=shard_model, dispatch_uid='sharding_counts.update_count_on_delete')
@@ -0,0 +1,115 @@
+"""
+Scatter-gather execution of per-shard work on a bounded thread pool. Each pool thread talks to the database through
+its own django connection, so the latency of a cross-shard read tracks the slowest shard instead of the sum of them.
+The connections of a pool thread are kept open across its tasks whatever `CONN_MAX_AGE`, instead of connecting again
+for every shard read, and closed by `shutdown_executor()`.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+SHARDING_EXECUTOR_MAX_WORKERS = getattr(settings, 'SHARDING_EXECUTOR_MAX_WORKERS', 8)
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+# Connections of the pool threads, closed once the pool is shut down.
+_pool_connections = []
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SHARDING_EXECUTOR_MAX_WORKERS,
+                                               thread_name_prefix='sharding')
+
+    return _executor
+
+
+def shutdown_executor(wait=True):
+    """Shut the pool down, closing the connections of its threads once they finished with `wait`."""
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+        if not wait:
+            return
+        pool_connections = list(_pool_connections)
+        del _pool_connections[:]
+
+    for conn in pool_connections:
+        # Opened by a pool thread which is done with it.
+        conn.inc_thread_sharing()
+        conn.close()
+
+
+def can_run_parallel():
+    """
+    Work is kept in the calling thread when it is already a pool thread, to not deadlock the bounded pool, or when it
+    is inside a transaction, whose uncommitted rows the connections of the pool threads could not see.
+    """
+
+    if SHARDING_EXECUTOR_MAX_WORKERS <= 1 or getattr(_local, 'in_pool', False):
+        return False
+
+    return not any(conn.in_atomic_block for conn in connections.all())
+
+
+def release_connections():
+    """Close the connections of the current thread left unusable by a task, keep the others open for the next task."""
+
+    for conn in connections.all():
+        if conn.connection is None:
+            continue
+
+        if conn.in_atomic_block or conn.get_autocommit() != conn.settings_dict['AUTOCOMMIT']:
+            conn.close()
+        elif conn.errors_occurred:
+            if conn.is_usable():
+                conn.errors_occurred = False
+            else:
+                conn.close()
+
+
+def run_in_pool(func, *args):
+    if not getattr(_local, 'pool_connections', False):
+        _local.pool_connections = True
+        with _executor_lock:
+            _pool_connections.extend(connections.all())
+
+    _local.in_pool = True
+    try:
+        return func(*args)
+    finally:
+        release_connections()
+        _local.in_pool = False
+
+
+def scatter_gather(func, items, merge=None):
+    """
+    Call `func(*item)` for every tuple of `items` on the sharding thread pool and return the results in the order of
+    `items`, or `merge(results)` if `merge` is given. Exceptions raised by `func` are propagated to the caller.
+    """
+
+    items = list(items)
+    if len(items) > 1 and can_run_parallel():
+        executor = get_executor()
+        futures = [executor.submit(run_in_pool, func, *item) for item in items]
+        results = [future.result() for future in futures]
+    else:
+        results = [func(*item) for item in items]
+
+    if merge is not None:
+        return merge(results)
+
+    return results
@@ -0,0 +1,227 @@
+"""
+Bulk export of the rows of the sharding models as NDJSON or CSV. Every shard is read in primary key order by keyset
+batches of `SHARDING_EXPORT_BATCH_SIZE` rows, so that an export is linear in the number of rows and its memory is
+bounded by a batch, unlike paging through `paginate_sharding` which counts the shards for every page. `export()`,
+what the `export_shards` command runs, writes to a file or a stream, optionally exports the shards in parallel on the
+sharding thread pool and resumes an interrupted export from its checkpoint file. `export_view` streams an export to
+staff users over HTTP.
+"""
+
+import csv
+import io
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+
+from . import sharding_executor
+
+SHARDING_EXPORT_BATCH_SIZE = getattr(settings, 'SHARDING_EXPORT_BATCH_SIZE', 2000)
+
+FORMATS = ('ndjson', 'csv')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def get_export_fields(shard_model):
+    return [field.attname for field in shard_model._meta.concrete_fields]
+
+
+def iter_shard_batches(shard_model, fields, after_pk=None, batch_size=SHARDING_EXPORT_BATCH_SIZE):
+    """Yield the rows of `shard_model` after the primary key `after_pk`, as lists of at most `batch_size` tuples."""
+
+    pk_index = fields.index(shard_model._meta.pk.attname)
+    qs = shard_model.objects.order_by('pk').values_list(*fields)
+    while True:
+        batch = list((qs if after_pk is None else qs.filter(pk__gt=after_pk))[:batch_size])
+        if batch:
+            yield batch
+        if len(batch) < batch_size:
+            return
+
+        after_pk = batch[-1][pk_index]
+
+
+def encode_header(fields, fmt):
+    return encode_rows([fields], fields, 'csv') if fmt == 'csv' else ''
+
+
+def encode_rows(rows, fields, fmt):
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+class Checkpoint(object):
+    """
+    Progress of an export to a file, saved to `path` after every batch written: the size of the export file, the
+    last primary key written of every shard and the shards done. An export resumed from it truncates the export file
+    to that size, so that no row is written twice.
+    """
+
+    def __init__(self, path, label, fmt, fields):
+        self.path = path
+        self.label = label
+        self.format = fmt
+        self.fields = fields
+        self.offset = 0
+        self.positions = {}
+        self.done = set()
+
+    @classmethod
+    def load(cls, path, label, fmt, fields):
+        checkpoint = cls(path, label, fmt, fields)
+        if path is None or not os.path.exists(path):
+            return checkpoint
+
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if (state['model'], state['format'], state['fields']) != (label, fmt, fields):
+            raise ValueError('The checkpoint %s belongs to another export: %s as %s.' % (
+                path, state['model'], state['format']))
+
+        checkpoint.offset = state['offset']
+        checkpoint.positions = state['positions']
+        checkpoint.done = set(state['done'])
+        return checkpoint
+
+    def save(self, stream):
+        if self.path is None:
+            return
+
+        stream.flush()
+        self.offset = stream.tell()
+        state = {
+            'model': self.label,
+            'format': self.format,
+            'fields': self.fields,
+            'offset': self.offset,
+            'positions': self.positions,
+            'done': sorted(self.done),
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, cls=DjangoJSONEncoder)
+        os.replace(tmp_path, self.path)
+
+    def delete(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def export(model_class, output, fmt='ndjson', shardings=None, batch_size=SHARDING_EXPORT_BATCH_SIZE, parallel=False,
+           checkpoint_path=None):
+    """
+    Export the rows of `shardings` (all shardings by default) of `model_class` as `fmt` to `output`, a file path or
+    a writable text stream. With `parallel`, shards are exported concurrently on the sharding thread pool and their
+    batches are interleaved in the output. With `checkpoint_path`, the export to the file `output` resumes from the
+    checkpoint of an interrupted run, if any, and the checkpoint is deleted once the export is complete. Return
+    `{sharding: rows}` of the rows written by this run.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError('Unknown export format %r, expected one of %s.' % (fmt, ', '.join(FORMATS)))
+    if checkpoint_path is not None and not isinstance(output, str):
+        raise ValueError('A checkpointed export needs a file to write to.')
+
+    shardings = list(model_class.get_sharding_list() if shardings is None else shardings)
+    if not shardings:
+        return {}
+
+    shard_model = model_class.get_shard_model(shardings[0])
+    fields = get_export_fields(shard_model)
+    pk_index = fields.index(shard_model._meta.pk.attname)
+    checkpoint = Checkpoint.load(checkpoint_path, model_class._meta.label_lower, fmt, fields)
+
+    stream = output
+    if isinstance(output, str):
+        resumed = checkpoint.offset and os.path.exists(output)
+        stream = open(output, 'r+' if resumed else 'w', encoding='utf-8', newline='')
+        if resumed:
+            stream.seek(checkpoint.offset)
+            stream.truncate()
+        else:
+            checkpoint.offset, checkpoint.positions, checkpoint.done = 0, {}, set()
+
+    lock = threading.Lock()
+
+    def export_shard(sharding):
+        shard_model = model_class.get_shard_model(sharding)
+        rows = 0
+        for batch in iter_shard_batches(shard_model, fields, checkpoint.positions.get(sharding), batch_size):
+            data = encode_rows(batch, fields, fmt)
+            with lock:
+                stream.write(data)
+                checkpoint.positions[sharding] = batch[-1][pk_index]
+                checkpoint.save(stream)
+            rows += len(batch)
+
+        with lock:
+            checkpoint.done.add(sharding)
+            checkpoint.save(stream)
+        return rows
+
+    try:
+        header = encode_header(fields, fmt)
+        # Nothing is written for the empty NDJSON header, a management command's stdout would end it with a newline.
+        if header and not checkpoint.offset:
+            stream.write(header)
+        pending = [sharding for sharding in shardings if sharding not in checkpoint.done]
+        if parallel:
+            counts = sharding_executor.scatter_gather(export_shard, [(sharding,) for sharding in pending])
+        else:
+            counts = [export_shard(sharding) for sharding in pending]
+    finally:
+        if stream is not output:
+            stream.close()
+
+    checkpoint.delete()
+    return dict(zip(pending, counts))
+
+
+def iter_export(model_class, fmt='ndjson', shardings=None, batch_size=SHARDING_EXPORT_BATCH_SIZE):
+    """Yield the export of `shardings` (all shardings by default) of `model_class` as `fmt`, a batch at a time."""
+
+    shardings = list(model_class.get_sharding_list() if shardings is None else shardings)
+    fields = None
+    for sharding in shardings:
+        shard_model = model_class.get_shard_model(sharding)
+        if fields is None:
+            fields = get_export_fields(shard_model)
+            yield encode_header(fields, fmt)
+
+        for batch in iter_shard_batches(shard_model, fields, batch_size=batch_size):
+            yield encode_rows(batch, fields, fmt)
+
+
+@staff_member_required
+def export_view(request):
+    """
+    Stream the export of a sharding model to staff users, e.g. `?model=demo.log&format=csv&shardings=202001,202002`.
+    Anonymous users are redirected to the admin login.
+    """
+
+    from .sharding_provisioner import get_sharding_model
+
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return JsonResponse({'message': 'Unknown export format %r.' % fmt, 'status_code': 400}, status=400)
+
+    try:
+        model_class = get_sharding_model(request.GET.get('model', ''))
+    except LookupError as exc:
+        return JsonResponse({'message': str(exc), 'status_code': 404}, status=404)
+
+    shardings = model_class.get_sharding_list()
+    if request.GET.get('shardings'):
+        shardings = [sharding for sharding in request.GET['shardings'].split(',') if sharding in shardings]
+
+    response = StreamingHttpResponse(iter_export(model_class, fmt, shardings), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (model_class._meta.label_lower, fmt)
+    return response
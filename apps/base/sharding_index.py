@@ -0,0 +1,225 @@
+"""
+Global secondary indexes of the sharding models. A model declaring `SHARDING_INDEXES = ('name', ...)` gets a table
+per indexed field, `<app_label>_<db_table>index_<field>`, mapping every value of the field to the sharding and the
+primary key of its rows. The indexes are maintained by the write paths of the sharding layer: saves and deletes of
+shard model instances, `bulk_create_routed()`, `update_routed()`, `delete_routed()`, resharding and archiving.
+`ShardingMixin.filter_indexed()` looks the filtered values up in an index, then only queries the shards holding
+matching rows instead of all of them. Rows written behind the back of the sharding layer, e.g. with
+`QuerySet.update()` or raw SQL, are indexed again by `rebuild_index()` (the `rebuild_indexes` command).
+"""
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import model_sharding, sharding_locks
+from .sharding_queryset import ShardedQuerySet
+
+# Shards with more matching rows than this are filtered by the lookups only, not by the primary keys found.
+SHARDING_INDEX_MAX_PKS = getattr(settings, 'SHARDING_INDEX_MAX_PKS', 500)
+# Number of primary keys per statement maintaining an index, below the number of parameters SQLite allows.
+SHARDING_INDEX_BATCH_SIZE = getattr(settings, 'SHARDING_INDEX_BATCH_SIZE', 500)
+
+index_models = {}
+index_lock = threading.Lock()
+
+
+def get_indexed_fields(model_class):
+    return tuple(getattr(model_class, 'SHARDING_INDEXES', ()))
+
+
+def get_index_table(model_class, field_name):
+    return '%s_%sindex_%s' % (model_class._meta.app_label, model_class._meta.db_table, field_name)
+
+
+def create_index_model(model_class, field_name):
+    """Create the model of the index of `field_name`, whose `value` field is a plain copy of the indexed field."""
+
+    field = model_class._meta.get_field(field_name)
+    if field.is_relation:
+        raise TypeError('%s.%s is a relation and cannot be indexed.' % (model_class.__name__, field_name))
+
+    name, path, args, kwargs = field.deconstruct()
+    for key in ('primary_key', 'unique', 'db_index', 'db_column', 'default', 'auto_now', 'auto_now_add', 'editable'):
+        kwargs.pop(key, None)
+
+    class Meta:
+        app_label = model_class._meta.app_label
+        db_table = get_index_table(model_class, field_name)
+        managed = False
+        unique_together = ('sharding', 'row_id')
+
+    attrs = {
+        '__module__': model_class.__module__,
+        'Meta': Meta,
+        'value': field.__class__(*args, db_index=True, **kwargs),
+        'sharding': models.CharField(max_length=50),
+        'row_id': models.BigIntegerField(),
+    }
+    model_name = '%sIndex%s' % (model_class.__name__, field_name.title().replace('_', ''))
+    # Registered with django's app registry like the shard models, see `model_sharding.create_model`.
+    with model_sharding.shard_tables.lock:
+        return type(model_name, (models.Model,), attrs)
+
+
+def get_index_model(model_class, field_name):
+    """Return the model of the index of `field_name`, creating it and its table if needed."""
+
+    key = (model_class._meta.label_lower, field_name)
+    index_model = index_models.get(key)
+    if index_model is None:
+        with index_lock:
+            index_model = index_models.get(key)
+            if index_model is None:
+                index_model = index_models[key] = create_index_model(model_class, field_name)
+
+    db_table = index_model._meta.db_table
+    using = router.db_for_write(index_model)
+    catalog = model_sharding.get_table_catalog(using)
+    if db_table not in catalog:
+        with sharding_locks.sharding_lock(db_table, using):
+            if db_table not in catalog.refresh():
+                model_sharding.create_table(index_model, using)
+                catalog.add(db_table)
+
+    return index_model
+
+
+def iter_batches(items, batch_size=SHARDING_INDEX_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def index_rows(model_class, sharding, rows, field_names=None, created=False):
+    """
+    Index the `(pk, {field_name: value})` `rows` of the shard `sharding` in the indexes of `field_names`, all the
+    `SHARDING_INDEXES` of `model_class` by default. The entries of rows which are not `created` are replaced.
+    """
+
+    rows = [(pk, values) for pk, values in rows if pk is not None]
+    for field_name in get_indexed_fields(model_class):
+        if not rows or (field_names is not None and field_name not in field_names):
+            continue
+
+        index_model = get_index_model(model_class, field_name)
+        using = router.db_for_write(index_model)
+        with transaction.atomic(using=using):
+            if not created:
+                for batch in iter_batches(pk for pk, values in rows):
+                    index_model.objects.using(using).filter(sharding=sharding, row_id__in=batch).delete()
+            index_model.objects.using(using).bulk_create(
+                [index_model(value=values[field_name], sharding=sharding, row_id=pk) for pk, values in rows],
+                batch_size=SHARDING_INDEX_BATCH_SIZE)
+
+
+def index_objects(model_class, sharding, objs, field_names=None, created=False):
+    """Index the shard model instances `objs` of the shard `sharding`, see `index_rows`."""
+
+    index_rows(model_class, sharding, [(obj.pk, {field_name: getattr(obj, field_name) for field_name in
+                                                 get_indexed_fields(model_class)}) for obj in objs],
+               field_names, created)
+
+
+def reindex_pks(model_class, sharding, pks, field_names=None):
+    """Index again the rows of the shard `sharding` whose primary keys are `pks`, e.g. after an `UPDATE`."""
+
+    indexed_fields = get_indexed_fields(model_class)
+    shard_model = model_class.get_shard_model(sharding)
+    for batch in iter_batches(pks):
+        rows = shard_model.objects.filter(pk__in=batch).values_list('pk', *indexed_fields)
+        index_rows(model_class, sharding, [(row[0], dict(zip(indexed_fields, row[1:]))) for row in rows],
+                   field_names)
+
+
+def unindex_pks(model_class, sharding, pks):
+    """Remove the rows of the shard `sharding` whose primary keys are `pks` from the indexes of `model_class`."""
+
+    for field_name in get_indexed_fields(model_class):
+        index_model = get_index_model(model_class, field_name)
+        using = router.db_for_write(index_model)
+        for batch in iter_batches(pks):
+            index_model.objects.using(using).filter(sharding=sharding, row_id__in=batch).delete()
+
+
+def unindex_sharding(model_class, sharding):
+    """Remove all rows of the shard `sharding` from the indexes of `model_class`, e.g. once it is archived."""
+
+    for field_name in get_indexed_fields(model_class):
+        index_model = get_index_model(model_class, field_name)
+        index_model.objects.using(router.db_for_write(index_model)).filter(sharding=sharding).delete()
+
+
+def rebuild_index(model_class, shardings=None, batch_size=SHARDING_INDEX_BATCH_SIZE):
+    """Index again every row of `shardings` (all shardings by default) of `model_class`, return the rows indexed."""
+
+    from .sharding_export import iter_shard_batches
+
+    indexed_fields = list(get_indexed_fields(model_class))
+    count = 0
+    for sharding in (model_class.get_sharding_list() if shardings is None else shardings):
+        unindex_sharding(model_class, sharding)
+        shard_model = model_class.get_shard_model(sharding)
+        fields = [shard_model._meta.pk.attname] + indexed_fields
+        for batch in iter_shard_batches(shard_model, fields, batch_size=batch_size):
+            index_rows(model_class, sharding, [(row[0], dict(zip(indexed_fields, row[1:]))) for row in batch],
+                       created=True)
+            count += len(batch)
+
+    return count
+
+
+def filter_indexed(model_class, **filters):
+    """
+    Return a `ShardedQuerySet` of the rows of `model_class` matching `filters`, over the shards the index of the
+    first indexed field filtered has entries for, e.g. `filter_indexed(User, name='iTraceur', active=True)`.
+    """
+
+    for lookup, value in filters.items():
+        field_name, _, transforms = lookup.partition('__')
+        if field_name in get_indexed_fields(model_class):
+            break
+    else:
+        raise ValueError('None of the lookups %s is on a field of %s.SHARDING_INDEXES.' % (
+            ', '.join(filters), model_class.__name__))
+
+    index_model = get_index_model(model_class, field_name)
+    value_lookup = 'value__%s' % transforms if transforms else 'value'
+    pks = OrderedDict()
+    for sharding, pk in index_model.objects.filter(**{value_lookup: value}).values_list('sharding', 'row_id'):
+        pks.setdefault(sharding, []).append(pk)
+
+    shardings = [sharding for sharding in model_class.get_sharding_list() if sharding in pks]
+    qs = ShardedQuerySet(model_class, shardings).filter(**filters)
+    for sharding in shardings:
+        if len(pks[sharding]) <= SHARDING_INDEX_MAX_PKS:
+            qs = qs.filter_sharding(sharding, pk__in=pks[sharding])
+
+    return qs
+
+
+def index_on_save(sender, instance=None, created=False, raw=False, update_fields=None, **kwargs):
+    sharding_model = getattr(sender, '_sharding_model', None)
+    if sharding_model is not None and not raw and get_indexed_fields(sharding_model):
+        index_objects(sharding_model, sender._sharding, [instance], update_fields, created)
+
+
+def unindex_on_delete(sender, instance=None, **kwargs):
+    sharding_model = getattr(sender, '_sharding_model', None)
+    if sharding_model is not None and get_indexed_fields(sharding_model):
+        unindex_pks(sharding_model, sender._sharding, [instance.pk])
+
+
+def connect(shard_model):
+    """Index the rows of `shard_model` when they are saved and unindex them when they are deleted."""
+
+    post_save.connect(index_on_save, sender=shard_model, dispatch_uid='sharding_index.index_on_save')
+    post_delete.connect(unindex_on_delete, sender=shard_model, dispatch_uid='sharding_index.unindex_on_delete')
+
+
+def disconnect(shard_model):
+    post_save.disconnect(sender=shard_model, dispatch_uid='sharding_index.index_on_save')
+    post_delete.disconnect(sender=shard_model, dispatch_uid='sharding_index.unindex_on_delete')
@@ -0,0 +1,103 @@
+"""
+Locks serializing the creation of a shard across the threads of a process and across processes. The cross-process
+lock is an advisory lock of the database on PostgreSQL and MySQL, and a file lock in `SHARDING_LOCK_DIR` otherwise.
+Taken inside a transaction on PostgreSQL, the advisory lock is held until the end of the transaction.
+"""
+
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from hashlib import md5
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+SHARDING_LOCK_DIR = getattr(settings, 'SHARDING_LOCK_DIR', tempfile.gettempdir())
+SHARDING_LOCK_TIMEOUT = getattr(settings, 'SHARDING_LOCK_TIMEOUT', 60)
+
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+
+
+def get_process_lock(name):
+    lock = _process_locks.get(name)
+    if lock is None:
+        with _process_locks_guard:
+            lock = _process_locks.setdefault(name, threading.RLock())
+
+    return lock
+
+
+@contextmanager
+def process_lock(name):
+    """Hold the lock `name` among the threads of the current process."""
+
+    with get_process_lock(name):
+        yield
+
+
+@contextmanager
+def database_lock(name, using=DEFAULT_DB_ALIAS):
+    conn = connections[using]
+    if conn.vendor == 'postgresql':
+        key = int.from_bytes(md5(name.encode()).digest()[:8], 'big', signed=True)
+        if conn.in_atomic_block:
+            # An error inside the block aborts the transaction, which could not unlock the lock anymore: the lock is
+            # released by the end of the transaction instead.
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+            yield
+            return
+
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [key])
+        try:
+            yield
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+    elif conn.vendor == 'mysql':
+        # MySQL limits the names of user-level locks to 64 characters.
+        key = md5(name.encode()).hexdigest()
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT GET_LOCK(%s, %s)', [key, SHARDING_LOCK_TIMEOUT])
+            if not cursor.fetchone()[0]:
+                raise TimeoutError("Timed out waiting for sharding lock '%s'." % name)
+        try:
+            yield
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT RELEASE_LOCK(%s)', [key])
+    else:
+        with file_lock(name):
+            yield
+
+
+@contextmanager
+def file_lock(name):
+    if fcntl is None:
+        yield
+        return
+
+    path = os.path.join(SHARDING_LOCK_DIR, 'sharding-%s.lock' % re.sub(r'[^\w.-]', '_', name))
+    with open(path, 'a') as fp:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def sharding_lock(name, using=DEFAULT_DB_ALIAS):
+    """Hold the lock `name` among the threads of the current process and among all processes."""
+
+    with process_lock(name), database_lock(name, using):
+        yield
@@ -0,0 +1,317 @@
+"""
+Per-shard instrumentation, enabled by `SHARDING_METRICS`. Every query on a shard table is counted with its latency
+in a histogram and the rows it read or wrote, along with the routings of `ShardingMixin.shard()`, the creation of
+shard tables and the rows moved by resharding. Metrics are accumulated in process and added every
+`SHARDING_METRICS_FLUSH_INTERVAL` seconds, by a daemon thread started with the first metric recorded, to counters of
+the `SHARDING_METRICS_CACHE_ALIAS` cache, which aggregates the metrics of all processes sharing it: the
+`sharding.E002` system check rejects local memory and dummy caches, which the `shard_stats` command and the other
+workers would not see.
+`get_shard_stats()` reads them back for the staff only metrics endpoint (`metrics_view`) and the `shard_stats`
+command.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import checks
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+
+SHARDING_METRICS = getattr(settings, 'SHARDING_METRICS', False)
+SHARDING_METRICS_CACHE_ALIAS = getattr(settings, 'SHARDING_METRICS_CACHE_ALIAS', 'default')
+SHARDING_METRICS_FLUSH_INTERVAL = getattr(settings, 'SHARDING_METRICS_FLUSH_INTERVAL', 10)
+# Upper bounds (milliseconds) of the buckets of the query latency histogram, the last bucket is unbounded.
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000)
+
+METRICS = ('routed', 'queries', 'rows_read', 'rows_written', 'latency_us', 'created', 'creation_us', 'migrated_rows',
+           'migration_us') + tuple('latency_le_%s' % bound for bound in LATENCY_BUCKETS + ('inf',))
+
+TABLE_RE = re.compile(r'^\s*(?:SELECT\b.*?\bFROM|INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+[`"\[]?(\w+)',
+                      re.IGNORECASE | re.DOTALL)
+
+logger = logging.getLogger(__name__)
+
+shard_metrics = {}
+metrics_lock = threading.Lock()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[SHARDING_METRICS_CACHE_ALIAS]
+
+
+def check_metrics_cache(app_configs, **kwargs):
+    from .sharding_cache import is_process_local
+
+    if not SHARDING_METRICS or not is_process_local(get_cache()):
+        return []
+
+    return [checks.Error(
+        'Shard metrics are aggregated in the process local cache %r.' % SHARDING_METRICS_CACHE_ALIAS,
+        hint='Configure a cache shared by all processes, e.g. memcached, as SHARDING_METRICS_CACHE_ALIAS.',
+        id='sharding.E002',
+    )]
+
+
+def get_cache_key(label, sharding, metric):
+    return 'sharding_metrics:%s:%s:%s' % (label, sharding, metric)
+
+
+def get_latency_bucket(seconds):
+    milliseconds = seconds * 1000
+    for bound in LATENCY_BUCKETS:
+        if milliseconds <= bound:
+            return 'latency_le_%s' % bound
+
+    return 'latency_le_inf'
+
+
+def record(model_class, sharding, **deltas):
+    """Add `deltas` to the metrics of the shard `sharding` of the sharding model `model_class`."""
+
+    key = (model_class._meta.label_lower, sharding)
+    with metrics_lock:
+        metrics = shard_metrics.get(key)
+        if metrics is None:
+            metrics = shard_metrics[key] = Counter()
+        metrics.update(deltas)
+
+    if _flusher is None:
+        start_flusher()
+
+
+def record_routing(model_class, sharding):
+    if SHARDING_METRICS:
+        record(model_class, sharding, routed=1)
+
+
+def record_creation(model_class, sharding, seconds):
+    if SHARDING_METRICS:
+        record(model_class, sharding, created=1, creation_us=int(seconds * 1e6))
+
+
+def record_migration(model_class, sharding, rows, seconds):
+    if SHARDING_METRICS:
+        record(model_class, sharding, migrated_rows=rows, migration_us=int(seconds * 1e6))
+
+
+def record_query(shard_model, seconds, rows_read=0, rows_written=0):
+    record(shard_model._sharding_model, shard_model._sharding, queries=1, rows_read=rows_read,
+           rows_written=rows_written, latency_us=int(seconds * 1e6), **{get_latency_bucket(seconds): 1})
+
+
+def flush():
+    """Add the metrics accumulated by this process to the counters of the metrics cache."""
+
+    with metrics_lock:
+        flushed = dict(shard_metrics)
+        shard_metrics.clear()
+
+    cache = get_cache()
+    for (label, sharding), metrics in flushed.items():
+        for metric, delta in metrics.items():
+            if not delta:
+                continue
+
+            cache_key = get_cache_key(label, sharding, metric)
+            cache.add(cache_key, 0, None)
+            try:
+                cache.incr(cache_key, delta)
+            except ValueError:
+                # Evicted right after it was added, count it again from now on.
+                cache.set(cache_key, delta, None)
+
+
+class MetricsFlusher(threading.Thread):
+    def __init__(self, interval=SHARDING_METRICS_FLUSH_INTERVAL):
+        super().__init__(name='sharding-metrics-flusher', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                flush()
+            except Exception:
+                logger.exception('Failed to flush the shard metrics')
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_flusher(**kwargs):
+    global _flusher
+
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = MetricsFlusher(**kwargs)
+            _flusher.start()
+
+    return _flusher
+
+
+def stop_flusher():
+    global _flusher
+
+    with _flusher_lock:
+        if _flusher is not None:
+            _flusher.stop()
+            _flusher = None
+
+    flush()
+
+
+def reset(model_class, shardings):
+    get_cache().delete_many([get_cache_key(model_class._meta.label_lower, sharding, metric)
+                             for sharding in shardings for metric in METRICS])
+
+
+def get_latency_percentile(metrics, percentile):
+    """Return the upper bound (milliseconds, `'inf'` for the last bucket) of the bucket of the `percentile` latency."""
+
+    if not metrics['queries']:
+        return None
+
+    seen = 0
+    for bound in LATENCY_BUCKETS + ('inf',):
+        seen += metrics['latency_le_%s' % bound]
+        if seen >= metrics['queries'] * percentile / 100:
+            return bound
+
+    return None
+
+
+def get_shard_stats(model_class, shardings=None):
+    """Return `{sharding: metrics}` of `shardings` (all shardings by default) of `model_class`, from all processes."""
+
+    flush()
+    label = model_class._meta.label_lower
+    shardings = model_class.get_sharding_list() if shardings is None else shardings
+    values = get_cache().get_many([get_cache_key(label, sharding, metric)
+                                   for sharding in shardings for metric in METRICS])
+
+    stats = {}
+    for sharding in shardings:
+        metrics = {metric: values.get(get_cache_key(label, sharding, metric), 0) for metric in METRICS}
+        metrics['latency_mean_ms'] = round(metrics['latency_us'] / metrics['queries'] / 1000, 3) \
+            if metrics['queries'] else None
+        metrics['latency_p95_ms'] = get_latency_percentile(metrics, 95)
+        stats[sharding] = metrics
+
+    return stats
+
+
+class CountingCursor(object):
+    """Database cursor proxy counting the rows fetched from a query on a shard table."""
+
+    def __init__(self, cursor, shard_model, seconds):
+        self.cursor = cursor
+        self.shard_model = shard_model
+        self.seconds = seconds
+        self.rows_read = 0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.rows_read += 1
+            yield row
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.rows_read += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.rows_read += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.rows_read += len(rows)
+        return rows
+
+    def close(self):
+        self.report()
+        return self.cursor.close()
+
+    def report(self):
+        if self.shard_model is not None:
+            record_query(self.shard_model, self.seconds, rows_read=self.rows_read)
+            self.shard_model = None
+
+
+def instrument_query(execute, sql, params, many, context):
+    """`execute_wrapper` of the database connections recording the queries on shard tables."""
+
+    from .model_sharding import shard_tables
+
+    cursor_wrapper = context['cursor']
+    if isinstance(cursor_wrapper.cursor, CountingCursor):
+        # The previous query of the cursor is done.
+        cursor_wrapper.cursor.report()
+        cursor_wrapper.cursor = cursor_wrapper.cursor.cursor
+
+    match = TABLE_RE.match(sql)
+    shard_model = shard_tables.get(match.group(1)) if match else None
+    if shard_model is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    seconds = time.perf_counter() - start
+    if sql.lstrip()[:6].upper() == 'SELECT':
+        # Rows are counted while they are fetched and the query is recorded once the cursor is closed or reused.
+        cursor_wrapper.cursor = CountingCursor(cursor_wrapper.cursor, shard_model, seconds)
+    else:
+        record_query(shard_model, seconds, rows_written=max(cursor_wrapper.cursor.rowcount, 0))
+
+    return result
+
+
+def install_connection(connection, **kwargs):
+    if instrument_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(instrument_query)
+
+
+def install():
+    """Instrument the queries of every database connection, open or opened from now on."""
+
+    connection_created.connect(install_connection, dispatch_uid='sharding_metrics.install_connection')
+    for connection in connections.all():
+        install_connection(connection)
+
+
+def uninstall():
+    connection_created.disconnect(dispatch_uid='sharding_metrics.install_connection')
+    for connection in connections.all():
+        if instrument_query in connection.execute_wrappers:
+            connection.execute_wrappers.remove(instrument_query)
+    stop_flusher()
+
+
+@staff_member_required
+def metrics_view(request):
+    """JSON metrics of the shards of the sharding models for staff users, e.g. `?model=demo.user` for one model."""
+
+    from .sharding_provisioner import get_sharding_model
+    from .model_sharding import get_sharding_models
+
+    try:
+        model_classes = [get_sharding_model(request.GET['model'])] if 'model' in request.GET else get_sharding_models()
+    except LookupError as exc:
+        return JsonResponse({'message': str(exc), 'status_code': 404}, status=404)
+
+    result = {model_class._meta.label_lower: get_shard_stats(model_class) for model_class in model_classes}
+    return JsonResponse({'result': result, 'status_code': 200})
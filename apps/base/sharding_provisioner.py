@@ -0,0 +1,85 @@
+"""
+Provisioning of upcoming shards ahead of time, so that no request has to pay the latency of creating a shard table.
+`provision_upcoming_shards()` is what the `provision_shards` command runs, `ShardingProvisioner` does the same every
+`SHARDING_PROVISION_INTERVAL` seconds. It is never started on django startup, which every worker and management
+command goes through: `provision_shards --watch` runs it in the foreground of one dedicated process, and
+`start_provisioner()` runs it as a daemon thread of the process calling it.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import model_sharding
+
+SHARDING_PROVISION_INTERVAL = getattr(settings, 'SHARDING_PROVISION_INTERVAL', 3600)
+
+logger = logging.getLogger(__name__)
+
+_provisioner = None
+_provisioner_lock = threading.Lock()
+
+
+def get_sharding_model(label):
+    for model_class in model_sharding.get_sharding_models():
+        if model_class._meta.label_lower == label.lower():
+            return model_class
+
+    raise LookupError("Sharding model '%s' not found." % label)
+
+
+def provision_upcoming_shards(model_classes=None, periods=model_sharding.SHARDING_PROVISION_PERIODS_DEFAULT):
+    """Create the current and the next `periods` shards of `model_classes`, all sharding models by default."""
+
+    created = {}
+    for model_class in (model_sharding.get_sharding_models() if model_classes is None else model_classes):
+        shardings = model_class.get_upcoming_shardings(periods)
+        created[model_class._meta.label_lower] = model_class.provision_shards(shardings)
+
+    return created
+
+
+class ShardingProvisioner(threading.Thread):
+    def __init__(self, interval=SHARDING_PROVISION_INTERVAL, periods=model_sharding.SHARDING_PROVISION_PERIODS_DEFAULT,
+                 model_classes=None):
+        super().__init__(name='sharding-provisioner', daemon=True)
+        self.interval = interval
+        self.periods = periods
+        self.model_classes = model_classes
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                provision_upcoming_shards(self.model_classes, self.periods)
+            except Exception:
+                logger.exception('Failed to provision upcoming shards')
+            finally:
+                close_old_connections()
+
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_provisioner(**kwargs):
+    global _provisioner
+
+    with _provisioner_lock:
+        if _provisioner is None or not _provisioner.is_alive():
+            _provisioner = ShardingProvisioner(**kwargs)
+            _provisioner.start()
+
+    return _provisioner
+
+
+def stop_provisioner():
+    global _provisioner
+
+    with _provisioner_lock:
+        if _provisioner is not None:
+            _provisioner.stop()
+            _provisioner = None
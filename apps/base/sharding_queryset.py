@@ -0,0 +1,201 @@
+"""
+A lazy queryset spanning every shard of a sharding model. Filters, ordering and limits are pushed down to the
+queryset of each shard and the ordered per-shard results are merged with a heap, so the top N rows across all shards
+read at most N rows per shard and results are streamed in constant memory. When the shardings partition the ordering,
+as date shardings do for their `SHARDING_KEY`, the shards are read one after the other instead, so a limited query
+stops at the first shards filling it.
+"""
+
+import heapq
+from itertools import chain, islice
+
+
+class OrderingKey(object):
+    """Comparison key of a row under an `order_by()` with mixed directions, `None` sorts first like in SQLite."""
+
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other):
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+
+            if value is None:
+                less = True
+            elif other_value is None:
+                less = False
+            else:
+                less = value < other_value
+            return less != descending
+
+        return False
+
+
+class ShardedQuerySet(object):
+    def __init__(self, model_class, shardings=None, sharding_ordered=False):
+        self.model_class = model_class
+        self.shardings = list(model_class.get_sharding_list() if shardings is None else shardings)
+        self.sharding_ordered = sharding_ordered
+        self.filters = []
+        self.sharding_filters = {}
+        self.ordering = ()
+        self.low = 0
+        self.high = None
+
+    def __repr__(self):
+        return '<%s %s shardings=%d>' % (self.__class__.__name__, self.model_class.__name__, len(self.shardings))
+
+    def _clone(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.filters = list(self.filters)
+        clone.sharding_filters = {sharding: list(filters) for sharding, filters in self.sharding_filters.items()}
+        return clone
+
+    def _add_filter(self, method, args, kwargs):
+        if self.low or self.high is not None:
+            raise TypeError('Cannot filter a query once a slice has been taken.')
+
+        clone = self._clone()
+        clone.filters.append((method, args, kwargs))
+        return clone
+
+    def filter(self, *args, **kwargs):
+        return self._add_filter('filter', args, kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._add_filter('exclude', args, kwargs)
+
+    def filter_sharding(self, sharding, *args, **kwargs):
+        """Filter the rows of the shard `sharding` only."""
+
+        if self.low or self.high is not None:
+            raise TypeError('Cannot filter a query once a slice has been taken.')
+
+        clone = self._clone()
+        clone.sharding_filters.setdefault(sharding, []).append(('filter', args, kwargs))
+        return clone
+
+    def order_by(self, *field_names):
+        if self.low or self.high is not None:
+            raise TypeError('Cannot reorder a query once a slice has been taken.')
+
+        for field_name in field_names:
+            if not isinstance(field_name, str) or '__' in field_name or field_name.startswith('?'):
+                raise ValueError('Only local fields can be ordered across shardings: %r' % field_name)
+
+        clone = self._clone()
+        clone.ordering = field_names
+        return clone
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if k.step not in (None, 1):
+                raise ValueError('Stepped slicing is not supported.')
+            if (k.start is not None and k.start < 0) or (k.stop is not None and k.stop < 0):
+                raise ValueError('Negative indexing is not supported.')
+
+            clone = self._clone()
+            if k.stop is not None:
+                clone.high = self.low + k.stop if self.high is None else min(self.high, self.low + k.stop)
+            if k.start:
+                clone.low = self.low + k.start if clone.high is None else min(clone.high, self.low + k.start)
+            return clone
+
+        if not isinstance(k, int):
+            raise TypeError('ShardedQuerySet indices must be integers or slices, not %s.' % type(k).__name__)
+        if k < 0:
+            raise ValueError('Negative indexing is not supported.')
+
+        for obj in self[k:k + 1]:
+            return obj
+
+        raise IndexError('ShardedQuerySet index out of range')
+
+    def get_shard_queryset(self, shard_model):
+        qs = shard_model.objects.all()
+        for method, args, kwargs in chain(self.filters, self.sharding_filters.get(shard_model._sharding, ())):
+            qs = getattr(qs, method)(*args, **kwargs)
+        if self.ordering:
+            qs = qs.order_by(*self.ordering)
+
+        return qs
+
+    def get_ordering_key(self, obj):
+        values = tuple(getattr(obj, field_name.lstrip('-')) for field_name in self.ordering)
+        return OrderingKey(values, self.descending)
+
+    @property
+    def descending(self):
+        return tuple(field_name.startswith('-') for field_name in self.ordering)
+
+    def is_sharding_ordered(self):
+        """Whether the shardings, in order, partition the rows by the ordering, e.g. date shardings by the key."""
+
+        sharding_key = getattr(self.model_class, 'SHARDING_KEY', None)
+        return self.sharding_ordered and sharding_key is not None and self.ordering in (
+            (sharding_key,), ('-' + sharding_key,))
+
+    def iter_sharding_ordered(self):
+        """Yield the rows shard after shard, a shard is only queried once the previous ones are exhausted."""
+
+        for sharding in (reversed(self.shardings) if self.descending[0] else self.shardings):
+            qs = self.get_shard_queryset(self.model_class.get_shard_model(sharding))
+            if self.high is not None:
+                qs = qs[:self.high]
+            yield from qs.iterator()
+
+    def iterators(self):
+        """Return one iterator of rows per shard, each reading at most `high` rows when the query is limited."""
+
+        if self.high is None:
+            return [self.get_shard_queryset(self.model_class.get_shard_model(sharding)).iterator()
+                    for sharding in self.shardings]
+
+        high = self.high
+        if not self.ordering:
+            return [self.get_shard_queryset(self.model_class.get_shard_model(sharding))[:high]
+                    for sharding in self.shardings]
+
+        rows = self.model_class.scatter_gather(
+            lambda shard_model, sharding: list(self.get_shard_queryset(shard_model)[:high]), self.shardings)
+        return [iter(shard_rows) for shard_rows in rows]
+
+    def __iter__(self):
+        if self.high is not None and self.low >= self.high:
+            return iter(())
+
+        if self.is_sharding_ordered():
+            return islice(self.iter_sharding_ordered(), self.low, self.high)
+
+        iterators = self.iterators()
+        if self.ordering:
+            merged = heapq.merge(*iterators, key=self.get_ordering_key)
+        else:
+            merged = chain.from_iterable(iterators)
+
+        return islice(merged, self.low, self.high)
+
+    def count(self):
+        count = self.model_class.scatter_gather(
+            lambda shard_model, sharding: self.get_shard_queryset(shard_model).count(), self.shardings, merge=sum)
+        if self.high is not None:
+            count = min(count, self.high)
+
+        return max(count - self.low, 0)
+
+    def exists(self):
+        for _ in self[:1]:
+            return True
+
+        return False
+
+    def first(self):
+        for obj in self[:1]:
+            return obj
+
+        return None
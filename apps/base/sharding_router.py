@@ -0,0 +1,332 @@
+"""
+Pluggable routers mapping the integer sharding source of a precise sharding model to a sharding. A model picks its
+router with `SHARDING_ROUTER`, a router class or its dotted path.
+
+`ModuloRouter` routes by `source % SHARDING_COUNT`, so changing the count remaps almost every row. `BucketRouter`
+routes `source % SHARDING_BUCKET_COUNT` to a virtual bucket and the bucket to a sharding through a map persisted in
+`ShardingBucket`, so the `reshard` command can add shards by moving whole buckets only. As long as no map is
+persisted, bucket `b` lives on sharding `b % SHARDING_COUNT`, which routes exactly like `ModuloRouter` when the bucket
+count is a multiple of the sharding count. Every change of the map bumps its version in `ShardingBucketVersion` within
+the same transaction, which every process checks every `SHARDING_ROUTER_REFRESH` seconds, re-reading the map only when
+it changed.
+"""
+
+import threading
+import time
+from itertools import chain
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from . import sharding_counts, sharding_index, sharding_metrics
+
+SHARDING_ROUTER_DEFAULT = getattr(settings, 'SHARDING_ROUTER_DEFAULT', 'apps.base.sharding_router.ModuloRouter')
+SHARDING_BUCKET_COUNT_DEFAULT = getattr(settings, 'SHARDING_BUCKET_COUNT_DEFAULT', 1000)
+SHARDING_ROUTER_REFRESH = getattr(settings, 'SHARDING_ROUTER_REFRESH', 5)
+
+sharding_routers = {}
+
+
+def get_router(model_class):
+    router = sharding_routers.get(model_class)
+    if router is None:
+        router_class = getattr(model_class, 'SHARDING_ROUTER', SHARDING_ROUTER_DEFAULT)
+        if isinstance(router_class, str):
+            router_class = import_string(router_class)
+        router = sharding_routers.setdefault(model_class, router_class(model_class))
+
+    return router
+
+
+class ModuloRouter(object):
+    def __init__(self, model_class):
+        self.model_class = model_class
+        self.shardings = [str(sharding) for sharding in range(model_class.get_sharding_count())]
+
+    def get_sharding(self, source):
+        return str(source % len(self.shardings))
+
+    def get_shardings(self):
+        """Return the list of shardings, the same list object as long as the routing does not change."""
+
+        return self.shardings
+
+    def get_read_shardings(self, source):
+        """Return the shardings to read the rows of `source` from, most recent first."""
+
+        return [self.get_sharding(source)]
+
+
+class BucketMap(object):
+    def __init__(self, buckets, targets):
+        self.buckets = buckets
+        self.targets = targets
+        shardings = set(buckets) | set(targets.values())
+        self.shardings = sorted(shardings, key=lambda sharding: (len(sharding), sharding))
+
+
+class BucketRouter(ModuloRouter):
+    def __init__(self, model_class):
+        super().__init__(model_class)
+        self.bucket_count = int(getattr(model_class, 'SHARDING_BUCKET_COUNT', SHARDING_BUCKET_COUNT_DEFAULT))
+        if self.bucket_count % len(self.shardings):
+            raise ValueError('SHARDING_BUCKET_COUNT of %s must be a multiple of its SHARDING_COUNT.'
+                             % model_class.__name__)
+
+        self.map = None
+        self.version = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def get_map(self):
+        if not apps.ready:
+            # Models are being imported, don't query the database yet and route by the default map.
+            return self.map or BucketMap(self.get_default_buckets(), {})
+
+        if self.map is None:
+            self.reload()
+        elif time.monotonic() - self.checked_at > SHARDING_ROUTER_REFRESH:
+            self.checked_at = time.monotonic()
+            if self.get_version() != self.version:
+                self.reload()
+
+        return self.map
+
+    def get_version(self):
+        from .models import ShardingBucketVersion
+
+        return ShardingBucketVersion.objects.filter(model=self.model_class._meta.label_lower).values_list(
+            'version', flat=True).first()
+
+    def bump_version(self):
+        """Make every process re-read the bucket map on its next check of the version, call it inside the change."""
+
+        from .models import ShardingBucketVersion
+
+        label = self.model_class._meta.label_lower
+        ShardingBucketVersion.objects.get_or_create(model=label)
+        ShardingBucketVersion.objects.filter(model=label).update(version=F('version') + 1)
+
+    def get_default_buckets(self):
+        return [str(bucket % len(self.shardings)) for bucket in range(self.bucket_count)]
+
+    def reload(self):
+        """Read the bucket map from the database, it is re-read whenever its version changes."""
+
+        from .models import ShardingBucket
+
+        version = self.get_version()
+        rows = ShardingBucket.objects.filter(model=self.model_class._meta.label_lower).values_list(
+            'bucket', 'sharding', 'target')
+        buckets = self.get_default_buckets()
+        targets = {}
+        for bucket, sharding, target in rows:
+            buckets[bucket] = sharding
+            if target is not None:
+                targets[bucket] = target
+
+        with self.lock:
+            if self.map is None or self.map.buckets != buckets or self.map.targets != targets:
+                self.map = BucketMap(buckets, targets)
+            self.version = version
+            self.checked_at = time.monotonic()
+
+    def get_bucket(self, source):
+        return source % self.bucket_count
+
+    def get_sharding(self, source):
+        bucket_map = self.get_map()
+        bucket = self.get_bucket(source)
+        return bucket_map.targets.get(bucket) or bucket_map.buckets[bucket]
+
+    def get_shardings(self):
+        return self.get_map().shardings
+
+    def get_read_shardings(self, source):
+        bucket_map = self.get_map()
+        bucket = self.get_bucket(source)
+        if bucket in bucket_map.targets:
+            return [bucket_map.targets[bucket], bucket_map.buckets[bucket]]
+
+        return [bucket_map.buckets[bucket]]
+
+    def plan(self, sharding_count):
+        """Return `{bucket: (sharding, target)}` of the buckets to move to spread them evenly on `sharding_count`."""
+
+        buckets = list(self.get_map().buckets)
+        shardings = [str(sharding) for sharding in range(sharding_count)]
+        quota, extra = divmod(self.bucket_count, sharding_count)
+        quotas = {sharding: quota + (1 if i < extra else 0) for i, sharding in enumerate(shardings)}
+
+        owned = {sharding: [] for sharding in shardings}
+        moving = []
+        for bucket, sharding in enumerate(buckets):
+            if sharding in owned and len(owned[sharding]) < quotas[sharding]:
+                owned[sharding].append(bucket)
+            else:
+                moving.append(bucket)
+
+        moves = {}
+        for sharding in shardings:
+            while len(owned[sharding]) < quotas[sharding]:
+                bucket = moving.pop(0)
+                owned[sharding].append(bucket)
+                moves[bucket] = (buckets[bucket], sharding)
+
+        return moves
+
+    def start_moves(self, moves):
+        """Persist the map with `moves` in progress: rows of moving buckets are written to their target from now on."""
+
+        from .models import ShardingBucket
+
+        label = self.model_class._meta.label_lower
+        buckets = self.get_map().buckets
+        with transaction.atomic():
+            existing = set(ShardingBucket.objects.filter(model=label).values_list('bucket', flat=True))
+            ShardingBucket.objects.bulk_create([
+                ShardingBucket(model=label, bucket=bucket, sharding=sharding)
+                for bucket, sharding in enumerate(buckets) if bucket not in existing
+            ])
+            for bucket, (sharding, target) in moves.items():
+                ShardingBucket.objects.filter(model=label, bucket=bucket).update(target=target)
+            self.bump_version()
+
+        self.reload()
+
+    def finish_moves(self):
+        """Cut the moving buckets over to their targets with a single UPDATE."""
+
+        from .models import ShardingBucket
+
+        label = self.model_class._meta.label_lower
+        with transaction.atomic():
+            ShardingBucket.objects.filter(model=label, target__isnull=False).update(sharding=F('target'), target=None)
+            self.bump_version()
+
+        self.reload()
+
+
+def move_bucket_rows(model_class, moves, batch_size=1000):
+    """Move the rows of the moving buckets of `moves` from their sharding to their target, see `move_rows`."""
+
+    router = get_router(model_class)
+    targets = {bucket: target for bucket, (sharding, target) in moves.items()}
+    return move_rows(model_class, sorted({sharding for sharding, target in moves.values()}),
+                     lambda row: targets.get(router.get_bucket(model_class.get_sharding_source(row))), batch_size)
+
+
+def move_rows(model_class, shardings, get_target, batch_size=1000):
+    """
+    Move the rows of `shardings` to the sharding `get_target(row)` returns for them, if any, in primary key batches of
+    `batch_size` with one transaction per batch and database. Rows get new primary keys in their target shard. A row
+    already written to the target under the same unique key aborts the move with an `IntegrityError` before the batch
+    is deleted from its source, so that no row is lost; the move resumes once the conflict is resolved. Return the
+    number of moved rows.
+    """
+
+    moved = 0
+    for sharding in shardings:
+        source_model = model_class.get_shard_model(sharding)
+        source_db = model_class.get_sharding_database(sharding)
+        last_pk = None
+        start = time.perf_counter()
+        sharding_moved = 0
+        while True:
+            with transaction.atomic(using=source_db):
+                qs = source_model.objects.select_for_update().order_by('pk')
+                if last_pk is not None:
+                    qs = qs.filter(pk__gt=last_pk)
+                rows = list(qs[:batch_size])
+                if not rows:
+                    break
+
+                last_pk = rows[-1].pk
+                groups = {}
+                for row in rows:
+                    target = get_target(row)
+                    if target is not None and target != sharding:
+                        groups.setdefault(target, []).append(row)
+
+                for target, target_rows in groups.items():
+                    target_model = model_class.get_shard_model(target)
+                    # Shards on another database commit right before the rows are deleted from the source shard.
+                    instances = [target_model(**model_class.get_field_values(row)) for row in target_rows]
+                    insert_moved_rows(model_class, target_model, instances)
+                    if sharding_index.get_indexed_fields(model_class):
+                        model_class.fill_bulk_created_pks(target_model, instances, model_class.SHARDING_KEY)
+                        sharding_index.index_objects(model_class, target, instances)
+                    source_model.objects.filter(pk__in=[row.pk for row in target_rows]).delete()
+                    sharding_moved += len(target_rows)
+
+        sharding_metrics.record_migration(model_class, sharding, sharding_moved, time.perf_counter() - start)
+        moved += sharding_moved
+
+    return moved
+
+
+def insert_moved_rows(model_class, target_model, instances):
+    try:
+        with transaction.atomic(using=model_class.get_sharding_database(target_model._sharding)):
+            target_model.objects.bulk_create(instances)
+    except IntegrityError as exc:
+        sharding_key = getattr(model_class, 'SHARDING_KEY', None)
+        conflicts = ''
+        if sharding_key is not None:
+            keys = target_model.objects.filter(**{'%s__in' % sharding_key: [
+                getattr(instance, sharding_key) for instance in instances]}).values_list(sharding_key, flat=True)
+            conflicts = ' (%s %s)' % (sharding_key, ', '.join(map(str, keys)))
+        raise IntegrityError('Rows of %s moved to shard %s conflict with rows written to it during the move%s: %s' % (
+            model_class.__name__, target_model._sharding, conflicts, exc)) from exc
+
+
+def reshard(model_class, sharding_count, batch_size=1000, grace=SHARDING_ROUTER_REFRESH):
+    """
+    Spread the buckets of `model_class` evenly on `sharding_count` shardings without downtime: persist the moves so
+    that writes go to the target shards and reads look at both shards, wait `grace` seconds for every process to
+    reload the map, move the rows, then cut over atomically. Return the moves and the number of moved rows.
+    """
+
+    router = get_router(model_class)
+    if not isinstance(router, BucketRouter):
+        raise TypeError('%s is not routed by a BucketRouter.' % model_class.__name__)
+
+    moves = router.plan(sharding_count)
+    if not moves:
+        return moves, 0
+
+    router.start_moves(moves)
+    model_class.provision_shards(sorted({target for sharding, target in moves.values()}))
+    if grace:
+        time.sleep(grace)
+
+    moved = move_bucket_rows(model_class, moves, batch_size)
+    router.finish_moves()
+    for sharding in set(chain.from_iterable(moves.values())):
+        sharding_counts.invalidate_count(model_class, sharding)
+
+    return moves, moved
+
+
+def rebalance(model_class, batch_size=1000):
+    """
+    Move every row of a precise sharding model which is not on the sharding its `SHARDING_KEY` routes to, e.g. the
+    rows written before the routing changed: the original routing sent every row whose md5 digest was not a single
+    digit, i.e. almost all of them, to sharding `0`. Rows are unreachable by `get_routed` until they are moved, run it
+    right after deploying a routing change. Return the number of moved rows.
+    """
+
+    if getattr(model_class, 'SHARDING_TYPE', 'date') == 'date':
+        raise TypeError('%s is not a precise sharding model.' % model_class.__name__)
+
+    router = get_router(model_class)
+    shardings = list(router.get_shardings())
+    moved = move_rows(model_class, shardings,
+                      lambda row: router.get_sharding(model_class.get_sharding_source(row)), batch_size)
+    for sharding in shardings:
+        sharding_counts.invalidate_count(model_class, sharding)
+
+    return moved
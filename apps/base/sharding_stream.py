@@ -0,0 +1,64 @@
+"""
+Streaming JSON serialization of the pages of the sharding models. The rows of a page are read lazily with
+`values()` and written to a `StreamingHttpResponse` as they are fetched, so that a large page is neither held in
+memory nor encoded at once, and its first bytes are sent before its last rows are read. Pages of at least
+`SHARDING_STREAM_PAGE_SIZE` rows are streamed by the demo views.
+"""
+
+import json
+from collections.abc import Iterator
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+SHARDING_STREAM_PAGE_SIZE = getattr(settings, 'SHARDING_STREAM_PAGE_SIZE', 100)
+# Number of characters buffered before a chunk of the response is sent.
+SHARDING_STREAM_CHUNK_SIZE = getattr(settings, 'SHARDING_STREAM_CHUNK_SIZE', 8192)
+
+
+def iter_json_parts(data, dumps):
+    yield '{'
+    for i, (key, value) in enumerate(data.items()):
+        yield '%s%s: ' % (', ' if i else '', dumps(key))
+        if isinstance(value, Iterator):
+            yield '['
+            for j, item in enumerate(value):
+                yield '%s%s' % (', ' if j else '', dumps(item))
+            yield ']'
+        else:
+            yield dumps(value)
+    yield '}'
+
+
+def iter_json(data, encoder=DjangoJSONEncoder, json_dumps_params=None, chunk_size=SHARDING_STREAM_CHUNK_SIZE):
+    """
+    Encode the dict `data` as JSON in chunks of about `chunk_size` characters. Values which are iterators, e.g.
+    generators of rows, are encoded as arrays item by item while they are consumed.
+    """
+
+    def dumps(value):
+        return json.dumps(value, cls=encoder, **(json_dumps_params or {}))
+
+    buffer, size = [], 0
+    for part in iter_json_parts(data, dumps):
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+
+    if buffer:
+        yield ''.join(buffer)
+
+
+def is_streamed(data):
+    return any(isinstance(value, Iterator) for value in data.values())
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """JSON response of the dict `data` encoded by `iter_json`, the streaming counterpart of `JsonResponse`."""
+
+    def __init__(self, data, encoder=DjangoJSONEncoder, json_dumps_params=None, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(iter_json(data, encoder, json_dumps_params), **kwargs)
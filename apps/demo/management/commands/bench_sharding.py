@@ -0,0 +1,228 @@
+import csv
+import json
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from apps.base import model_sharding, sharding_counts
+from apps.base.models import ShardingTable
+
+FIELDS = ('benchmark', 'shards', 'rows', 'iterations', 'total_s', 'mean_us', 'p50_us', 'p95_us', 'max_us', 'ops_per_s')
+
+
+def make_sharding_models(shard_count):
+    """Return a precise and a daily date sharding model of `shard_count` shards each, with tables of their own."""
+
+    def make_model(name, fields, **options):
+        # Shard model and table names end with the sharding, keep the ones of different shard counts apart.
+        name = '%s%d_' % (name, shard_count)
+        meta = type('Meta', (), {'abstract': True, 'app_label': 'demo', 'db_table': name.lower()})
+        return type(name, (models.Model, model_sharding.ShardingMixin), dict(
+            fields, __module__=__name__, Meta=meta, **options))
+
+    user_model = make_model('BenchUser', {
+        'user_name': models.CharField(max_length=50, unique=True),
+        'name': models.CharField(max_length=50),
+        'age': models.IntegerField(default=18),
+    }, SHARDING_TYPE='precise', SHARDING_COUNT=shard_count, SHARDING_KEY='user_name')
+    log_model = make_model('BenchLog', {
+        'level': models.PositiveSmallIntegerField(default=0),
+        'content': models.TextField(),
+        'time': models.DateTimeField(default=timezone.now),
+    }, SHARDING_TYPE='date', SHARDING_DATE_FORMAT='%Y%m%d', SHARDING_KEY='time',
+        SHARDING_DATE_START=(timezone.now().date() - timedelta(days=shard_count - 1)).strftime('%Y-%m-%d'))
+    return user_model, log_model
+
+
+class Timer(object):
+    def __init__(self):
+        self.samples = []
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.samples.append(time.perf_counter() - self.start)
+
+    def result(self, benchmark, shards, rows):
+        samples = sorted(self.samples)
+        total = sum(samples)
+        return {
+            'benchmark': benchmark,
+            'shards': shards,
+            'rows': rows,
+            'iterations': len(samples),
+            'total_s': round(total, 6),
+            'mean_us': round(statistics.mean(samples) * 1e6, 3),
+            'p50_us': round(samples[len(samples) // 2] * 1e6, 3),
+            'p95_us': round(samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1e6, 3),
+            'max_us': round(samples[-1] * 1e6, 3),
+            'ops_per_s': round(len(samples) / total, 3) if total else None,
+        }
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the hot paths of the sharding layer at several shard counts and print the results as JSON '
+            'lines or CSV. Runs in a throwaway test database unless --in-place is given.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[10, 100, 1000],
+                            help='Shard counts to benchmark at, e.g. --shards 10 1000 5000.')
+        parser.add_argument('--rows', type=int, default=1000, help='Number of rows inserted per sharding model.')
+        parser.add_argument('--iterations', type=int, default=200, help='Number of timed calls per benchmark.')
+        parser.add_argument('--page-size', type=int, default=20, help='Page size of the pagination benchmarks.')
+        parser.add_argument('--format', choices=['json', 'csv'], default='json', help='Output format.')
+        parser.add_argument('--output', help='File to write the results to, stdout by default.')
+        parser.add_argument('--in-place', action='store_true',
+                            help='Run against the configured databases instead of a test database.')
+
+    def handle(self, *args, **options):
+        if min(options['shards']) < 1 or options['iterations'] < 1 or options['rows'] < 0:
+            raise CommandError('--shards and --iterations must be positive, --rows must not be negative.')
+
+        old_config = None
+        if not options['in_place']:
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+
+        try:
+            results = []
+            for shard_count in options['shards']:
+                results.extend(self.bench_sharding_models(shard_count, options))
+            results.extend(self.bench_views(options))
+        finally:
+            if old_config is not None:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        self.write_results(results, options)
+
+    def write_results(self, results, options):
+        stream = open(options['output'], 'w', newline='') if options['output'] else self.stdout
+        try:
+            if options['format'] == 'csv':
+                writer = csv.DictWriter(stream, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(results)
+            else:
+                for result in results:
+                    stream.write(json.dumps(result) + '\n')
+        finally:
+            if options['output']:
+                stream.close()
+
+    def bench_sharding_models(self, shard_count, options):
+        iterations, rows = options['iterations'], options['rows']
+        user_model, log_model = make_sharding_models(shard_count)
+        results = []
+
+        timer = Timer()
+        for _ in range(iterations):
+            with timer:
+                log_shardings = list(log_model.get_date_sharding_list())
+        results.append(timer.result('get_date_sharding_list', shard_count, 0))
+
+        try:
+            for model_class in (user_model, log_model):
+                timer = Timer()
+                for sharding in model_class.get_sharding_list():
+                    with timer:
+                        model_sharding.create_model(model_class, sharding)
+                results.append(timer.result('create_model.%s' % model_class.SHARDING_TYPE, shard_count, 0))
+
+                timer = Timer()
+                with timer:
+                    model_class.provision_shards(model_class.get_sharding_list())
+                results.append(timer.result('provision_shards.%s' % model_class.SHARDING_TYPE, shard_count, 0))
+
+            timer = Timer()
+            for i in range(iterations):
+                with timer:
+                    user_model.shard(model_sharding.hash64(i))
+            results.append(timer.result('shard.precise', shard_count, 0))
+
+            timer = Timer()
+            for i in range(iterations):
+                with timer:
+                    log_model.shard(log_shardings[i % len(log_shardings)])
+            results.append(timer.result('shard.date', shard_count, 0))
+
+            now = timezone.now()
+            user_model.bulk_create_routed([
+                {'user_name': 'bench-%d' % i, 'name': 'bench'} for i in range(rows)])
+            log_model.bulk_create_routed([
+                {'content': 'bench %d' % i, 'time': now - timedelta(days=i % shard_count)} for i in range(rows)])
+
+            for model_class in (user_model, log_model):
+                max_page = max((rows + options['page_size'] - 1) // options['page_size'], 1)
+                for depth, page in (('first', 1), ('middle', max(max_page // 2, 1)), ('last', max_page)):
+                    timer = Timer()
+                    for _ in range(max(iterations // 10, 1)):
+                        with timer:
+                            model_class.paginate_sharding(page, options['page_size'])
+                    results.append(timer.result('paginate_sharding.%s.%s' % (model_class.SHARDING_TYPE, depth),
+                                                shard_count, rows))
+        finally:
+            self.drop_sharding_models(user_model, log_model)
+
+        return results
+
+    def drop_sharding_models(self, *model_classes):
+        for model_class in model_classes:
+            for sharding in model_class.get_sharding_list():
+                db_table = model_class.get_sharding_table(sharding)
+                using = model_class.get_sharding_database(sharding)
+                catalog = model_sharding.get_table_catalog(using)
+                shard_model = model_sharding.shard_tables.get(db_table)
+                if shard_model is None:
+                    if db_table not in catalog:
+                        continue
+                    # Evicted from the registry by the shard models created after it, its table is still there.
+                    shard_model = model_sharding.create_model(model_class, sharding)
+
+                if db_table in catalog:
+                    model_sharding.drop_table(shard_model, using)
+                    catalog.discard(db_table)
+                model_sharding.remove_model(shard_model)
+                sharding_counts.invalidate_count(model_class, sharding)
+            ShardingTable.objects.filter(model=model_class._meta.label_lower).delete()
+            model_sharding.sharding_models.remove(model_class)
+            model_sharding.sharding_indexes.pop(model_class, None)
+
+    def bench_views(self, options):
+        iterations = max(options['iterations'] // 4, 1)
+        client = Client()
+        user_url, log_url = reverse('demo:user'), reverse('demo:log')
+        timers = {name: Timer() for name in (
+            'view.user.create', 'view.user.get', 'view.user.update', 'view.user.delete',
+            'view.log.create', 'view.log.get', 'view.log.delete')}
+
+        for i in range(iterations):
+            user_name = 'bench-view-%d' % i
+            with timers['view.user.create']:
+                client.post(user_url, {'user_name': user_name})
+            with timers['view.user.get']:
+                client.get(user_url, {'user_name': user_name})
+            with timers['view.user.update']:
+                client.put(user_url, QUERY_STRING=urlencode({'user_name': user_name, 'age': 20}))
+            with timers['view.user.delete']:
+                client.delete(user_url, QUERY_STRING=urlencode({'user_name': user_name}))
+
+            with timers['view.log.create']:
+                response = client.post(log_url, {'content': 'bench'})
+            log_id = response.json()['result']['id']
+            with timers['view.log.get']:
+                client.get(log_url, {'id': log_id})
+            with timers['view.log.delete']:
+                client.delete(log_url, QUERY_STRING=urlencode({'id': log_id}))
+
+        return [timer.result(name, None, None) for name, timer in timers.items()]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Shard models are created at runtime and their tables are created by the sharding layer, drop the shard models of
+    the initial migration from the migration state and keep their tables.
+    """
+
+    dependencies = [
+        ('demo', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.DeleteModel(name=name)
+            for name in ['Log202003', 'Log202004'] + ['User%d' % i for i in range(10)]
+        ]),
+    ]
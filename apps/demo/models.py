@@ -14,6 +14,16 @@ class User(models.Model, model_sharding.ShardingMixin):
     # Constant-based sharding
     SHARDING_TYPE = 'precise'
     SHARDING_COUNT = 10
+    # Route through virtual buckets, so that `./manage.py reshard demo.user --count N` can add shards online
+    SHARDING_ROUTER = 'apps.base.sharding_router.BucketRouter'
+    SHARDING_BUCKET_COUNT = 1000
+    # Route by user_name, hashed with the default 64 bit `hash64`. Users written by a previous routing are moved to
+    # their shard by `./manage.py reshard demo.user --rebalance`
+    SHARDING_KEY = 'user_name'
+    # Set `SHARDING_LOOKUP_CACHE_TIMEOUT = 60` to cache `User.get_routed(user_name=...)` lookups for a minute once a
+    # cache shared by all processes, e.g. memcached, is configured for `SHARDING_LOOKUP_CACHE_ALIAS`
+    # Index users by name, so that `User.filter_indexed(name=...)` only queries the shards holding them
+    SHARDING_INDEXES = ('name',)
 
     def __str__(self):
         return "%s:%s" % (str(self.id), self.name)
@@ -27,11 +37,9 @@ def init_user_models():
     admin_opts = {
         'list_display': ('id', 'user_name', 'name', 'age', 'active', 'created_at', 'updated_at')
     }
+    # Shard models are created, and registered with the admin, on first access through `User.shard()`
     model_sharding.register_admin_opts(User._meta.label_lower, admin_opts)
 
-    for sharding in User.get_sharding_list():
-        model_sharding.create_model(User, sharding)
-
 
 init_user_models()
 
@@ -45,6 +53,7 @@ class Log(models.Model, model_sharding.ShardingMixin):
     SHARDING_TYPE = 'date'
     SHARDING_DATE_START = '2020-03-01'
     SHARDING_DATE_FORMAT = '%Y%m'
+    SHARDING_KEY = 'time'
 
     def __str__(self):
         return "%s %s %s" % (self.time, self.level, self.content)
@@ -58,10 +67,8 @@ def init_log_models():
     admin_opts = {
         'list_display': ('id', 'time', 'level', 'content')
     }
+    # Shard models are created, and registered with the admin, on first access through `Log.shard()`
     model_sharding.register_admin_opts(Log._meta.label_lower, admin_opts)
 
-    for sharding in Log.get_sharding_list():
-        model_sharding.create_model(Log, sharding)
-
 
 init_log_models()
@@ -1,18 +1,47 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date
 from hashlib import md5
+from io import StringIO
+from unittest import mock
 
+from django.apps import apps
 from django.conf import settings
-from django.test import TestCase
+from django.contrib import admin
+from django.contrib.auth.models import User as AuthUser
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router, transaction
+from django.db.models.signals import post_delete
+from django.forms.models import model_to_dict
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.http import urlencode
 
+from apps.base import (
+    model_sharding, sharding_buffer, sharding_cache, sharding_counts, sharding_executor, sharding_export,
+    sharding_locks, sharding_metrics, sharding_provisioner, sharding_router, sharding_stream
+)
+from apps.base.models import ShardingTable
 from apps.demo import models
 
 
 class TestUnit(TestCase):
+    def setUp(self):
+        # Shard tables created by a previous test are rolled back with its transaction, and so are cached rows.
+        model_sharding.refresh_table_catalogs()
+        cache.clear()
+
     def test_constant_based_sharding(self):
         user_name = 'iTraceur'
-        digest = int(md5(user_name.encode()).hexdigest(), base=16)
+        digest = model_sharding.hash64(user_name)
         models.User.shard(digest).objects.create(user_name=user_name, name='iTraceur', age=18)
         self.assertTrue(models.User.shard(digest).objects.filter(user_name=user_name).exists())
 
@@ -20,15 +49,15 @@ class TestUnit(TestCase):
             user_name = 'iTraceur-' + str(i)
             name = 'iTraceur-%d Zhao' % i
             age = 18 + i
-            digest = int(md5(user_name.encode()).hexdigest(), base=16)
+            digest = model_sharding.hash64(user_name)
             models.User.shard(digest).objects.create(user_name=user_name, name=name, age=age)
             self.assertTrue(models.User.shard(digest).objects.filter(user_name=user_name).exists())
 
         user_name = 'iTraceur-9'
-        digest = int(md5(user_name.encode()).hexdigest(), base=16)
+        digest = model_sharding.hash64(user_name)
         self.assertTrue(models.User.shard(digest).objects.filter(user_name=user_name).exists())
         user_name = 'iTraceur-1'
-        digest = int(md5(user_name.encode()).hexdigest(), base=16)
+        digest = model_sharding.hash64(user_name)
         self.assertTrue(models.User.shard(digest).objects.filter(user_name=user_name).exists())
 
         models.User.shard().objects.create(user_name='iTraceurZhao', name='iTraceur Zhao')
@@ -38,7 +67,7 @@ class TestUnit(TestCase):
 
         url = reverse('demo:user')
         user_name = 'iTraceur-test'
-        digest = int(md5(user_name.encode()).hexdigest(), base=16)
+        digest = model_sharding.hash64(user_name)
         data = {
             'user_name': user_name,
             'name': 'iTraceur from post',
@@ -88,23 +117,29 @@ class TestUnit(TestCase):
         self.assertLessEqual(date_start, default_date)
 
         models.Log.shard(202001).objects.create(content='test_date_based_sharding single 202001')
-        self.assertTrue(models.Log.shard(202001).objects.filter(content='test_date_based_sharding single 202001').exists())
+        self.assertTrue(models.Log.shard(202001).objects
+                        .filter(content='test_date_based_sharding single 202001').exists())
 
         models.Log.shard(202002).objects.create(content='test_date_based_sharding single 202002')
-        self.assertTrue(models.Log.shard(202002).objects.filter(content='test_date_based_sharding single 202002').exists())
+        self.assertTrue(models.Log.shard(202002).objects
+                        .filter(content='test_date_based_sharding single 202002').exists())
 
         models.Log.shard(202003).objects.create(content='test_date_based_sharding single 202003')
-        self.assertTrue(models.Log.shard('202003').objects.filter(content='test_date_based_sharding single 202003').exists())
+        self.assertTrue(models.Log.shard('202003').objects
+                        .filter(content='test_date_based_sharding single 202003').exists())
 
         models.Log.shard('202004').objects.create(content='test_date_based_sharding single 202004')
-        self.assertTrue(models.Log.shard('202004').objects.filter(content='test_date_based_sharding single 202004').exists())
+        self.assertTrue(models.Log.shard('202004').objects
+                        .filter(content='test_date_based_sharding single 202004').exists())
 
         models.Log.shard('190001').objects.create(content='test_date_based_sharding single 190001')
         self.assertTrue(models.Log.shard().objects.filter(content='test_date_based_sharding single 190001').exists())
-        self.assertTrue(models.Log.shard(190001).objects.filter(content='test_date_based_sharding single 190001').exists())
+        self.assertTrue(models.Log.shard(190001).objects
+                        .filter(content='test_date_based_sharding single 190001').exists())
         models.Log.shard(190001).objects.filter(content='test_date_based_sharding single 190001').delete()
         self.assertFalse(models.Log.shard().objects.filter(content='test_date_based_sharding single 190001').exists())
-        self.assertFalse(models.Log.shard('190001').objects.filter(content='test_date_based_sharding single 190001').exists())
+        self.assertFalse(models.Log.shard('190001').objects
+                         .filter(content='test_date_based_sharding single 190001').exists())
 
         url = reverse('demo:log')
         content = 'test log'
@@ -121,3 +156,805 @@ class TestUnit(TestCase):
         }
         response = self.client.delete(url, **params)
         self.assertEqual(response.json()['status_code'], 204)
+
+    def test_sharding_index(self):
+        digest = model_sharding.hash64('iTraceur')
+        self.assertEqual(models.User.get_sharding(str(digest)), str(digest % models.User.SHARDING_COUNT))
+        self.assertEqual(models.User.get_sharding(digest), models.User.get_sharding(str(digest)))
+        self.assertEqual(models.User.get_sharding('None'), models.User.default_sharding())
+        self.assertEqual(models.User.get_sharding_list(), [str(i) for i in range(models.User.SHARDING_COUNT)])
+
+        self.assertEqual(models.Log.get_sharding('202003'), '202003')
+        self.assertEqual(models.Log.get_sharding('190001'), models.Log.default_sharding())
+        self.assertEqual(models.Log.get_sharding_list(), list(models.Log.get_date_sharding_list()))
+
+        now = timezone.now()
+        index = model_sharding.ShardingIndex(models.Log)
+        self.assertEqual(len(index), len(models.Log.get_sharding_list()))
+        next_month = index.next_date.strftime(models.Log.SHARDING_DATE_FORMAT)
+        self.assertNotIn(next_month, index)
+        with mock.patch.object(model_sharding.timezone, 'now', return_value=now + timezone.timedelta(days=31)):
+            self.assertIn(next_month, index)
+            self.assertEqual(index.shardings[-1], next_month)
+
+    def test_cursor_pagination(self):
+        user_names = set()
+        for i in range(25):
+            user_name = 'iTraceur-cursor-%d' % i
+            digest = model_sharding.hash64(user_name)
+            models.User.shard(digest).objects.create(user_name=user_name, name=user_name)
+            user_names.add(user_name)
+
+        url = reverse('demo:user')
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get(url, {'cursor': cursor, 'page_size': 7})
+            self.assertEqual(response.json()['status_code'], 200)
+            self.assertLessEqual(len(response.json()['result']), 7)
+            seen.extend(user['user_name'] for user in response.json()['result'])
+            cursor = response.json()['next_cursor']
+
+        self.assertEqual(len(seen), len(user_names))
+        self.assertEqual(set(seen), user_names)
+
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(response.json()['status_code'], 400)
+        cursor = model_sharding.encode_sharding_cursor('0', [1])
+        self.assertEqual(self.client.get(url, {'cursor': cursor}).json()['status_code'], 400)
+        response = self.client.get(url, {'cursor': '', 'page_size': -1})
+        self.assertEqual(len(response.json()['result']), 1)
+        self.assertEqual(len(models.User.paginate_sharding(1, -1)['result']), 1)
+        response = self.client.get(reverse('demo:log'), {'page_size': -1})
+        self.assertEqual(response.json()['status_code'], 200)
+
+    def test_sharding_count_cache(self):
+        cache.clear()
+        self.assertEqual(models.User.count_sharding('3'), 0)
+
+        models.User.shard(3).objects.create(user_name='iTraceur-count-0', name='iTraceur')
+        user = models.User.shard(13).objects.create(user_name='iTraceur-count-1', name='iTraceur')
+        with self.assertNumQueries(0):
+            self.assertEqual(models.User.count_sharding('3'), 2)
+
+        user.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(models.User.count_sharding('3'), 1)
+
+        models.User.shard(3).objects.bulk_create([models.User.shard(3)(user_name='iTraceur-count-2', name='iTraceur')])
+        self.assertEqual(models.User.count_sharding('3'), 1)
+        self.assertEqual(sharding_counts.reconcile_counts(models.User, ['3']), {'3': 2})
+        self.assertEqual(models.User.count_sharding('3'), 2)
+        self.assertEqual(models.User.paginate_sharding(1, 10)['count'], 2)
+
+    def test_sharded_queryset(self):
+        for i in range(30):
+            models.User.shard(i).objects.create(user_name='iTraceur-qs-%d' % i, name='iTraceur', age=i % 17,
+                                                active=bool(i % 3))
+
+        qs = models.User.all_shards()
+        self.assertEqual(qs.count(), 30)
+        self.assertEqual([user.age for user in qs.order_by('-age', 'user_name')[:4]], [16, 15, 14, 13])
+        self.assertEqual([user.user_name for user in qs.order_by('age', '-user_name')[:3]],
+                         ['iTraceur-qs-17', 'iTraceur-qs-0', 'iTraceur-qs-18'])
+
+        expected = sorted((i % 17, 'iTraceur-qs-%d' % i) for i in range(30) if i % 3)
+        users = qs.filter(active=True).order_by('age', 'user_name')
+        self.assertEqual([(user.age, user.user_name) for user in users], expected)
+        self.assertEqual([user.user_name for user in users[2:5]], [user_name for _, user_name in expected[2:5]])
+        self.assertEqual(users[3].user_name, expected[3][1])
+        self.assertEqual(users[2:5].count(), 3)
+        self.assertEqual(qs.exclude(active=True).count(), 10)
+        self.assertFalse(qs.filter(age__gt=16).exists())
+        with self.assertRaises(IndexError):
+            users[100]
+        with self.assertRaises(TypeError):
+            users[:3].filter(age=1)
+
+    def test_between(self):
+        def day(*args):
+            return timezone.datetime(*args, tzinfo=timezone.utc)
+
+        def create_log(*args):
+            # `time` is set on creation, route and backdate the row like it was logged on that day.
+            log = models.Log.get_shard_model(models.Log.get_key_source(day(*args))).objects.create(content=str(args))
+            log.time = day(*args)
+            log.save(update_fields=['time'])
+            return log
+
+        logs = [create_log(2020, 5, 10), create_log(2020, 5, 20), create_log(2020, 6, 1), create_log(2020, 6, 15),
+                create_log(2020, 7, 1)]
+
+        self.assertEqual(models.Log.get_range_shardings(day(2020, 5, 15), day(2020, 5, 16)), ['202005'])
+        self.assertEqual(models.Log.get_range_shardings(day(2020, 5, 15), day(2020, 7, 1)), ['202005', '202006'])
+        self.assertEqual(models.Log.get_range_shardings(day(1900, 1, 1), day(2020, 3, 2)), ['202003'])
+        self.assertEqual(models.Log.get_range_shardings(day(1000, 1, 1), day(9999, 1, 1)),
+                         models.Log.get_sharding_list())
+        self.assertEqual(models.Log.get_range_shardings(date(2020, 5, 1), date(2020, 6, 1)), ['202005'])
+        self.assertEqual(list(models.Log.between(date(2020, 5, 15), date(2020, 5, 21))), [logs[1]])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(models.Log.between(day(2020, 5, 15), day(2020, 5, 21))), [logs[1]])
+        with self.assertNumQueries(3):
+            self.assertEqual(list(models.Log.between(day(2020, 5, 15), day(2020, 7, 2))), logs[1:])
+
+        qs = models.Log.between(day(2020, 5, 1), day(2020, 8, 1))
+        self.assertEqual(qs.count(), 5)
+        self.assertEqual(list(qs.order_by('-time')[:2]), [logs[4], logs[3]])
+        with self.assertNumQueries(1):
+            self.assertEqual(qs.first(), logs[0])
+        self.assertEqual(list(qs.filter(content__contains='6')), logs[2:4])
+        self.assertFalse(models.Log.between(day(2020, 6, 1), day(2020, 6, 1)).exists())
+        with self.assertRaises(TypeError):
+            models.User.between(day(2020, 6, 1), day(2020, 7, 1))
+
+        # Rows are routed by their UTC date, so are aware bounds of another time zone.
+        log = create_log(2020, 4, 30, 20)
+        tz = timezone.get_fixed_timezone(8 * 60)
+        start, end = timezone.datetime(2020, 5, 1, tzinfo=tz), timezone.datetime(2020, 5, 2, tzinfo=tz)
+        self.assertEqual(models.Log.get_range_shardings(start, end), ['202004', '202005'])
+        self.assertEqual(list(models.Log.between(start, end)), [log])
+
+    def test_lazy_shard_models(self):
+        models.Log.provision_shards(['209905'])
+        shard_model = model_sharding.shard_tables['demo_log_209905']
+        self.assertTrue(admin.site.is_registered(shard_model))
+        # Like in a process which did not access the shard yet.
+        model_sharding.remove_model(shard_model)
+        self.assertFalse(admin.site.is_registered(shard_model))
+
+        self.client.force_login(AuthUser.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        url = '/admin/demo/log209905/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('demo_log_209905', model_sharding.shard_tables)
+        self.assertContains(response, url + 'add/')
+        log = model_sharding.shard_tables['demo_log_209905'].objects.create(content='test_lazy_shard_models')
+        self.assertContains(self.client.get('%s%d/change/' % (url, log.pk)), '%s%d/history/' % (url, log.pk))
+        self.assertEqual(self.client.get(url + '%d/unknown/page/' % log.pk).status_code, 302)
+        self.assertContains(self.client.get('/admin/demo/'), 'href="%s"' % url)
+        self.assertEqual(self.client.get('/admin/demo/log209906/').status_code, 404)
+        self.assertNotIn('demo_log_209906', model_sharding.shard_tables)
+        self.assertEqual(self.client.get('/admin/auth/user/').status_code, 200)
+
+    def test_shard_model_eviction(self):
+        registry = model_sharding.shard_tables
+        self.addCleanup(setattr, registry, 'max_size', registry.max_size)
+        user_model = models.User.shard(0)
+        registry.max_size = 2
+        log_model = models.Log.get_shard_model('209801')
+        evicted_model = models.Log.get_shard_model('209802')
+        self.assertIs(models.Log.get_shard_model('209801'), log_model)
+        models.Log.get_shard_model('209803')
+
+        self.assertEqual(sorted(model_class._sharding for model_class in registry.values()
+                                if model_class._sharding_model is models.Log), ['209801', '209803'])
+        self.assertIs(models.User.shard(0), user_model)
+        self.assertNotIn('demo_log_209802', registry)
+        self.assertFalse(admin.site.is_registered(evicted_model))
+        self.assertNotIn(evicted_model._meta.model_name, apps.all_models['demo'])
+
+        recreated_model = models.Log.get_shard_model('209802')
+        self.assertIsNot(recreated_model, evicted_model)
+        self.assertIs(apps.get_model('demo', recreated_model._meta.model_name), recreated_model)
+        recreated_model.objects.create(content='test_shard_model_eviction')
+        self.assertEqual(evicted_model.objects.filter(content='test_shard_model_eviction').count(), 1)
+        self.assertNotIn('demo_log_209801', registry)
+
+    def test_bench_sharding(self):
+        out = StringIO()
+        # Date shard models evicted during the benchmark have their tables dropped too.
+        with mock.patch.object(model_sharding.shard_tables, 'max_size', 1):
+            call_command('bench_sharding', '--shards', '3', '--rows', '20', '--iterations', '4', '--page-size', '5',
+                         '--in-place', stdout=out)
+        results = {result['benchmark']: result for result in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(results['shard.date']['shards'], 3)
+        self.assertEqual(results['shard.precise']['iterations'], 4)
+        self.assertEqual(results['create_model.date']['iterations'], 3)
+        self.assertEqual(results['paginate_sharding.precise.last']['rows'], 20)
+        self.assertIn('view.user.update', results)
+        self.assertNotIn('demo_benchuser3_0', model_sharding.shard_tables)
+        self.assertEqual([table for table in connection.introspection.table_names() if table.startswith('demo_bench')],
+                         [])
+
+    def test_shard_metrics(self):
+        self.assertEqual(sharding_metrics.check_metrics_cache(None), [])
+        with mock.patch.object(sharding_metrics, 'SHARDING_METRICS', True):
+            # The default local memory cache would only aggregate the metrics of the current process.
+            self.assertEqual([error.id for error in sharding_metrics.check_metrics_cache(None)], ['sharding.E002'])
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        patcher = mock.patch.object(sharding_metrics, 'get_cache', return_value=FileBasedCache(cache_dir, {}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with mock.patch.object(sharding_metrics, 'SHARDING_METRICS', True):
+            self.assertEqual(sharding_metrics.check_metrics_cache(None), [])
+            sharding_metrics.install()
+            self.addCleanup(sharding_metrics.uninstall)
+            user_model = models.User.shard_for(user_name='iTraceur')
+            sharding = user_model._sharding
+            models.User.create(user_name='iTraceur', name='iTraceur')
+            self.assertEqual(len(list(user_model.objects.filter(user_name='iTraceur'))), 1)
+            self.assertEqual(user_model.objects.filter(user_name='iTraceur').update(age=20), 1)
+            models.Log.provision_shards(['209908'])
+
+        stats = sharding_metrics.get_shard_stats(models.User)[sharding]
+        self.assertEqual(stats['routed'], 2)
+        self.assertEqual(stats['queries'], 3)
+        self.assertEqual(stats['rows_read'], 1)
+        self.assertEqual(stats['rows_written'], 2)
+        self.assertEqual(sum(stats['latency_le_%s' % bound] for bound in sharding_metrics.LATENCY_BUCKETS + ('inf',)),
+                         3)
+        self.assertIsNotNone(stats['latency_p95_ms'])
+        self.assertEqual(sharding_metrics.get_shard_stats(models.Log, ['209908'])['209908']['created'], 1)
+
+        url = reverse('sharding_metrics')
+        self.assertEqual(self.client.get(url, {'model': 'demo.user'}).status_code, 302)
+        self.client.force_login(AuthUser.objects.create_user('staff', is_staff=True))
+        response = self.client.get(url, {'model': 'demo.user'})
+        self.assertEqual(response.json()['result']['demo.user'][sharding]['rows_read'], 1)
+        self.assertEqual(self.client.get(url, {'model': 'demo.unknown'}).status_code, 404)
+
+        out = StringIO()
+        call_command('shard_stats', 'demo.user', '--json', stdout=out)
+        report = json.loads(out.getvalue())['demo.user']
+        self.assertEqual([sharding for sharding, metrics in report.items() if metrics['hot']], [sharding])
+        self.assertEqual([sharding for sharding, metrics in report.items() if metrics['oversized']], [sharding])
+        call_command('shard_stats', 'demo.user', stdout=out)
+        self.assertIn('hot oversized', out.getvalue())
+
+    @mock.patch.object(models.User, 'SHARDING_LOOKUP_CACHE_TIMEOUT', 60, create=True)
+    def test_lookup_cache(self):
+        # Lookups cannot be cached in the default local memory cache, which every process has its own of.
+        self.assertEqual([error.id for error in sharding_cache.check_lookup_cache(None)], ['sharding.E001'])
+        with mock.patch.object(sharding_cache, 'get_cache', return_value=FileBasedCache(tempfile.gettempdir(), {})):
+            self.assertEqual(sharding_cache.check_lookup_cache(None), [])
+
+        user = models.User.create(user_name='iTraceur', name='iTraceur')
+        with self.assertNumQueries(1):
+            self.assertEqual(models.User.get_routed(user_name='iTraceur'), user)
+        with self.assertNumQueries(0):
+            cached_user = models.User.get_routed(user_name='iTraceur')
+        self.assertEqual((cached_user.pk, cached_user.name, cached_user.created_at),
+                         (user.pk, 'iTraceur', user.created_at))
+        self.assertFalse(cached_user._state.adding)
+        with self.assertNumQueries(1):
+            self.assertEqual(models.User.get_routed(user_name='iTraceur', active=True), user)
+
+        url = reverse('demo:user')
+        params = {'QUERY_STRING': urlencode({'user_name': 'iTraceur', 'name': 'Traceur'})}
+        self.assertEqual(self.client.put(url, **params).json()['status_code'], 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, {'user_name': 'iTraceur'}).json()['result']['name'], 'Traceur')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, {'user_name': 'iTraceur'}).json()['result']['name'], 'Traceur')
+
+        params = {'QUERY_STRING': urlencode({'user_name': 'iTraceur'})}
+        self.assertEqual(self.client.delete(url, **params).json()['status_code'], 204)
+        self.assertEqual(self.client.get(url, {'user_name': 'iTraceur'}).json()['status_code'], 404)
+
+    def test_single_statement_crud(self):
+        user = models.User.create(user_name='iTraceur', name='iTraceur')
+        sharding = user._sharding
+        self.assertEqual(models.User.count_sharding(sharding), 1)
+
+        url = reverse('demo:user')
+        with self.assertNumQueries(1):
+            response = self.client.put(url, QUERY_STRING=urlencode({'user_name': 'iTraceur', 'age': 20}))
+        self.assertEqual(response.json()['result'], {'user_name': 'iTraceur', 'age': 20})
+        user = models.User.get_routed(user_name='iTraceur')
+        self.assertEqual(user.age, 20)
+        self.assertGreater(user.updated_at, user.created_at)
+        self.assertRaises(ValueError, models.User.update_routed, {'user_name': 'Traceur'}, user_name='iTraceur')
+        self.assertEqual(self.client.put(url, QUERY_STRING=urlencode({'user_name': 'nobody', 'age': 20})).json()[
+            'status_code'], 404)
+
+        # The primary key of the user is read to remove it from the index of `User.SHARDING_INDEXES`.
+        with self.assertNumQueries(3):
+            response = self.client.delete(url, QUERY_STRING=urlencode({'user_name': 'iTraceur'}))
+        self.assertEqual(response.json()['status_code'], 204)
+        self.assertEqual(models.User.count_sharding(sharding), 0)
+        self.assertEqual(self.client.delete(url, QUERY_STRING=urlencode({'user_name': 'iTraceur'})).json()[
+            'status_code'], 404)
+
+        log = models.Log.shard().objects.create(content='test_single_statement_crud')
+        url = reverse('demo:log')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'id': log.id})
+        self.assertEqual(response.json()['result'], {'id': log.id, 'level': 0, 'content': 'test_single_statement_crud'})
+        with self.assertNumQueries(1):
+            response = self.client.delete(url, QUERY_STRING=urlencode({'id': log.id}))
+        self.assertEqual(response.json()['status_code'], 204)
+        self.assertEqual(self.client.get(url, {'id': log.id}).json()['status_code'], 404)
+
+    def test_streaming_pages(self):
+        now = timezone.now()
+        chunks = list(sharding_stream.iter_json({'time': now, 'result': iter(range(20)), 'count': 20}, chunk_size=8))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads(''.join(chunks))['result'], list(range(20)))
+
+        models.User.bulk_create_routed([{'user_name': 'iTraceur-%d' % i, 'name': 'iTraceur'} for i in range(120)])
+        page = models.User.paginate_sharding(1, 100, stream=True)
+        self.assertNotIsInstance(page['result'], list)
+        rows = models.User.paginate_sharding(1, 100)['result']
+        self.assertEqual(list(page['result']), rows)
+        self.assertEqual(rows[0], model_to_dict(models.User.get_routed(user_name=rows[0]['user_name'])))
+
+        url = reverse('demo:user')
+        response = self.client.get(url, {'page': 2, 'page_size': 100})
+        self.assertTrue(response.streaming)
+        page = json.loads(b''.join(response.streaming_content))
+        self.assertEqual((page['status_code'], page['count'], page['next_page'], len(page['result'])),
+                         (200, 120, None, 20))
+        self.assertFalse(self.client.get(url, {'page_size': 10}).streaming)
+
+        models.Log.bulk_create_routed([{'content': 'test_streaming_pages'}] * 150)
+        response = self.client.get(reverse('demo:log'), {'page_size': 100})
+        self.assertTrue(response.streaming)
+        page = json.loads(b''.join(response.streaming_content))
+        self.assertEqual((page['count'], page['next_page'], len(page['result'])), (150, 2, 100))
+        self.assertEqual(set(page['result'][0]), {'id', 'level', 'content'})
+
+    def test_provision_shards(self):
+        shardings = models.Log.get_upcoming_shardings(2)
+        self.assertEqual(len(shardings), 3)
+        self.assertEqual(shardings[0], models.Log.default_sharding())
+        self.assertEqual(shardings[1], model_sharding.get_next_sharding_date(
+            timezone.now().date(), models.Log.SHARDING_DATE_FORMAT).strftime(models.Log.SHARDING_DATE_FORMAT))
+        self.assertEqual(models.User.get_upcoming_shardings(), models.User.get_sharding_list())
+        self.assertIn(models.Log, model_sharding.get_sharding_models())
+
+        out = StringIO()
+        call_command('provision_shards', 'demo.user', stdout=out)
+        self.assertIn("Shards of 'demo.user' are up to date.", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('provision_shards', 'demo.unknown')
+
+        with mock.patch.object(sharding_provisioner, 'provision_upcoming_shards',
+                               side_effect=KeyboardInterrupt) as provision_upcoming_shards:
+            call_command('provision_shards', 'demo.user', watch=True, periods=2)
+        provision_upcoming_shards.assert_called_once_with([models.User], 2)
+
+    def test_create_shard_table(self):
+        self.assertEqual(models.Log.provision_shards(['209901']), ['209901'])
+        self.assertIn('demo_log_209901', connection.introspection.table_names())
+        self.assertTrue(ShardingTable.objects.filter(db_table='demo_log_209901', model='demo.log').exists())
+        model_sharding.shard_tables['demo_log_209901'].objects.create(content='test_create_shard_table')
+        self.assertEqual(models.Log.provision_shards(['209901']), [])
+
+        models.Log.shard()
+        with self.assertNumQueries(0):
+            self.assertIn('demo_log_209901', model_sharding.get_table_catalog())
+            models.Log.shard()
+
+    def test_postgresql_advisory_lock(self):
+        conn = mock.MagicMock(vendor='postgresql', in_atomic_block=False)
+        execute = conn.cursor.return_value.__enter__.return_value.execute
+        with mock.patch.object(sharding_locks, 'connections', {'default': conn}):
+            with self.assertRaises(ValueError), sharding_locks.database_lock('demo_log_209901'):
+                raise ValueError
+            self.assertEqual([call[0][0] for call in execute.call_args_list],
+                             ['SELECT pg_advisory_lock(%s)', 'SELECT pg_advisory_unlock(%s)'])
+
+            execute.reset_mock()
+            conn.in_atomic_block = True
+            with self.assertRaises(ValueError), sharding_locks.database_lock('demo_log_209901'):
+                raise ValueError
+            self.assertEqual([call[0][0] for call in execute.call_args_list], ['SELECT pg_advisory_xact_lock(%s)'])
+
+    def test_archive_shards(self):
+        models.Log.get_shard_model('202003').objects.create(content='test_archive_shards')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(model_sharding.sharding_indexes.pop, models.Log, None)
+        with mock.patch.object(models.Log, 'SHARDING_RETENTION', 18, create=True):
+            model_sharding.sharding_indexes.pop(models.Log, None)
+            self.assertEqual(models.Log.get_sharding_list(), list(models.Log.get_date_sharding_list())[-18:])
+            self.assertEqual(models.Log.get_sharding('202003'), models.Log.default_sharding())
+            self.assertEqual(models.Log.get_expired_shardings(), list(models.Log.get_date_sharding_list())[:-18])
+
+            out = StringIO()
+            call_command('archive_shards', 'demo.log', '--dir', directory, '--dry-run', stdout=out)
+            self.assertIn('202003', out.getvalue())
+            call_command('archive_shards', 'demo.log', '--dir', directory, stdout=out)
+            self.assertEqual(models.Log.get_expired_shardings()[0], '202003')
+
+        with gzip.open(os.path.join(directory, 'demo_log_202003.ndjson.gz'), 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['content'] for row in rows], ['test_archive_shards'])
+        self.assertNotIn('demo_log_202003', connection.introspection.table_names())
+        self.assertNotIn('demo_log_202003', model_sharding.shard_tables)
+        self.assertNotIn('demo_log_202003', model_sharding.get_table_catalog())
+        self.assertFalse(ShardingTable.objects.filter(db_table='demo_log_202003').exists())
+
+    def test_export_shards(self):
+        models.User.bulk_create_routed([{'user_name': 'iTraceur-%d' % i, 'name': 'iTraceur'} for i in range(30)])
+        user_names = {'iTraceur-%d' % i for i in range(30)}
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'users.ndjson')
+        checkpoint = os.path.join(directory, 'users.checkpoint')
+
+        # Interrupted after a few batches, the export resumes from its checkpoint without writing a row twice.
+        encode_rows = sharding_export.encode_rows
+        batches = []
+
+        def interrupt(*args):
+            batches.append(args)
+            if len(batches) > 3:
+                raise KeyboardInterrupt
+            return encode_rows(*args)
+
+        with mock.patch.object(sharding_export, 'encode_rows', interrupt):
+            self.assertRaises(KeyboardInterrupt, call_command, 'export_shards', 'demo.user', '--output', path,
+                              '--batch-size', '2', '--checkpoint', checkpoint, stdout=StringIO())
+        self.assertTrue(os.path.exists(checkpoint))
+        call_command('export_shards', 'demo.user', '--output', path, '--batch-size', '2', '--checkpoint', checkpoint,
+                     stdout=StringIO())
+        self.assertFalse(os.path.exists(checkpoint))
+        with open(path) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(sorted(row['user_name'] for row in rows), sorted(user_names))
+        self.assertEqual(set(rows[0]), {'id', 'user_name', 'name', 'age', 'active', 'created_at', 'updated_at'})
+
+        out = StringIO()
+        call_command('export_shards', 'demo.user', '--format', 'csv', '--parallel', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'id,user_name,name,age,active,created_at,updated_at')
+        self.assertEqual(len(lines), 31)
+        self.assertRaises(CommandError, call_command, 'export_shards', 'demo.user', '--shardings', '404')
+        out = StringIO()
+        call_command('export_shards', 'demo.user', stdout=out)
+        self.assertEqual(len([json.loads(line) for line in out.getvalue().splitlines()]), 30)
+
+        url = reverse('sharding_export')
+        self.assertEqual(self.client.get(url, {'model': 'demo.user'}).status_code, 302)
+        self.client.force_login(AuthUser.objects.create_user('staff', is_staff=True))
+        response = self.client.get(url, {'model': 'demo.user', 'shardings': '0,1,2'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(rows), sum(models.User.count_sharding(sharding) for sharding in '012'))
+        self.assertEqual(self.client.get(url, {'model': 'demo.none'}).status_code, 404)
+
+    def test_secondary_index(self):
+        users = models.User.bulk_create_routed([{'user_name': 'iTraceur-%d' % i, 'name': 'Zhao' if i % 7 else 'Traceur'}
+                                                for i in range(40)])
+        users.append(models.User.create(user_name='iTraceur', name='Traceur'))
+        traceurs = [user for user in users if user.name == 'Traceur']
+        shard_tables = {user._meta.db_table for user in traceurs}
+        self.assertLess(len(shard_tables), models.User.SHARDING_COUNT)
+
+        with CaptureQueriesContext(connection) as queries:
+            found = list(models.User.filter_indexed(name='Traceur'))
+        self.assertEqual(sorted(user.user_name for user in found), sorted(user.user_name for user in traceurs))
+        self.assertEqual(len(queries), len(shard_tables) + 1)
+        self.assertTrue(all(any(table in query['sql'] for table in shard_tables) for query in queries[1:]))
+        self.assertEqual(models.User.filter_indexed(name__in=['Traceur', 'Zhao'], age=18).count(), 41)
+        self.assertRaises(ValueError, models.User.filter_indexed, age=18)
+
+        models.User.update_routed({'name': 'iTraceur'}, user_name='iTraceur')
+        user = models.User.get_routed(user_name='iTraceur-0')
+        user.name = 'iTraceur'
+        user.save()
+        self.assertEqual(models.User.filter_indexed(name='Traceur').count(), len(traceurs) - 2)
+        self.assertEqual(sorted(user.user_name for user in models.User.filter_indexed(name='iTraceur')),
+                         ['iTraceur', 'iTraceur-0'])
+
+        models.User.delete_routed(user_name='iTraceur')
+        user.delete()
+        self.assertFalse(models.User.filter_indexed(name='iTraceur').exists())
+
+        url = reverse('demo:user')
+        result = self.client.get(url, {'name': 'Zhao'}).json()['result']
+        self.assertEqual(len(result), 40 - len(traceurs) + 1)
+        self.assertEqual(result[0], model_to_dict(models.User.get_routed(user_name=result[0]['user_name'])))
+
+        # Rows updated behind the back of the sharding layer are found again once indexed again.
+        users[1].__class__.objects.filter(user_name=users[1].user_name).update(name='Unindexed')
+        self.assertFalse(models.User.filter_indexed(name='Unindexed').exists())
+        call_command('rebuild_indexes', 'demo.user', stdout=StringIO())
+        self.assertEqual([user.user_name for user in models.User.filter_indexed(name='Unindexed')], ['iTraceur-1'])
+
+    def test_bulk_create_routed(self):
+        cache.clear()
+
+        def digest(user):
+            return model_sharding.hash64(user['user_name'])
+
+        users = [{'user_name': 'iTraceur-bulk-%d' % i, 'name': 'iTraceur', 'age': i} for i in range(50)]
+        created = models.User.bulk_create_routed(users, key=digest, batch_size=20)
+        self.assertEqual([user.user_name for user in created], [user['user_name'] for user in users])
+        for user in created:
+            self.assertEqual(user._sharding, models.User.get_sharding(str(digest({'user_name': user.user_name}))))
+        self.assertEqual(models.User.all_shards().count(), 50)
+        self.assertEqual(sum(models.User.count_sharding(s) for s in models.User.get_sharding_list()), 50)
+
+        logs = models.Log.bulk_create_routed([{'content': 'test_bulk_create_routed'}], key=lambda log: None)
+        self.assertEqual(logs[0]._sharding, models.Log.default_sharding())
+
+        created = models.User.bulk_create_routed(
+            [{'user_name': 'iTraceur-bulk-pk', 'name': 'iTraceur'}], key='user_name')
+        self.assertIsNotNone(created[0].pk)
+        self.assertEqual(models.User.shard(created[0]._sharding).objects.get(pk=created[0].pk).user_name,
+                         'iTraceur-bulk-pk')
+
+        users = list(models.User.all_shards().filter(user_name__startswith='iTraceur-bulk-'))
+        for user in users:
+            user.age += 100
+        models.User.bulk_update_routed(users, ['age'], batch_size=20)
+        self.assertFalse(models.User.all_shards().filter(age__lt=100).exists())
+        with self.assertRaises(TypeError):
+            models.User.bulk_update_routed([logs[0]], ['content'])
+
+    def test_bulk_update_routed_bookkeeping(self):
+        models.User.create(user_name='iTraceur', name='Alice')
+        user = models.User.get_routed(user_name='iTraceur')
+        self.assertEqual(models.User.get_routed(user_name='iTraceur').name, 'Alice')
+        user.name = 'Bob'
+        models.User.bulk_update_routed([user], ['name'])
+        self.assertEqual(models.User.get_routed(user_name='iTraceur').name, 'Bob')
+        self.assertEqual([user.user_name for user in models.User.filter_indexed(name='Bob')], ['iTraceur'])
+        self.assertFalse(models.User.filter_indexed(name='Alice').exists())
+        self.assertRaises(ValueError, models.User.bulk_update_routed, [user], ['user_name'])
+
+    def test_signal_receivers(self):
+        ShardingTable.objects.create(db_table='demo_log_209912', model='demo.log')
+        with CaptureQueriesContext(connection) as ctx:
+            ShardingTable.objects.filter(db_table='demo_log_209912').delete()
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        user_model = models.User.shard('iTraceur')
+        self.assertTrue(post_delete.has_listeners(user_model))
+        self.assertFalse(post_delete.has_listeners(AuthUser))
+        model_sharding.remove_model(user_model)
+        self.assertFalse(post_delete.has_listeners(user_model))
+
+    def test_buffered_log_ingestion(self):
+        buffer = sharding_buffer.ShardingWriteBuffer(models.Log, max_size=3, max_delay=3600)
+        self.addCleanup(buffer.close)
+        url = reverse('demo:log')
+        log_model = models.Log.shard()
+        with mock.patch.object(models.Log, 'SHARDING_WRITE_BUFFER', True, create=True), \
+                mock.patch.dict(sharding_buffer.write_buffers, {models.Log: buffer}):
+            for i in range(2):
+                response = self.client.post(url, {'content': 'test buffered log %d' % i})
+                self.assertEqual(response.status_code, 202)
+            self.assertEqual(len(buffer), 2)
+            self.assertFalse(log_model.objects.filter(content__startswith='test buffered log').exists())
+
+            response = self.client.post(url, {'content': 'test buffered log 2', 'level': 1})
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(len(buffer), 0)
+            self.assertEqual(log_model.objects.filter(content__startswith='test buffered log').count(), 3)
+
+            response = self.client.post(url + '?ack=1', {'content': 'test buffered log acked'})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json()['result']['content'], 'test buffered log acked')
+            self.assertEqual(log_model.objects.get(content='test buffered log acked').pk,
+                             response.json()['result']['id'])
+
+    def test_reshard(self):
+        self.addCleanup(sharding_router.sharding_routers.pop, models.User, None)
+
+        def digest(user_name):
+            return model_sharding.hash64(user_name)
+
+        user_names = ['iTraceur-reshard-%d' % i for i in range(60)]
+        models.User.bulk_create_routed([{'user_name': user_name, 'name': user_name} for user_name in user_names],
+                                       key=lambda user: digest(user['user_name']))
+        before = {user_name: models.User.get_sharding(str(digest(user_name))) for user_name in user_names}
+        self.assertEqual(before, {user_name: str(digest(user_name) % 10) for user_name in user_names})
+
+        router = models.User.get_sharding_router()
+        moves = router.plan(16)
+        self.assertEqual(len(moves), 372)
+        router.start_moves(moves)
+        self.assertEqual(len(models.User.get_sharding_list()), 16)
+        for user_name in user_names:
+            user = models.User.get_routed(digest(user_name), user_name=user_name)
+            self.assertEqual(user._sharding, before[user_name])
+
+        out = StringIO()
+        call_command('reshard', 'demo.user', '--count', '16', '--grace', '0', stdout=out)
+        self.assertIn('onto 16 shards', out.getvalue())
+        self.assertEqual(models.User.all_shards().count(), 60)
+        moved = 0
+        for user_name in user_names:
+            sharding = models.User.get_sharding(str(digest(user_name)))
+            self.assertEqual(len(models.User.shards_for_read(digest(user_name))), 1)
+            self.assertEqual(models.User.get_routed(digest(user_name), user_name=user_name)._sharding, sharding)
+            moved += sharding != before[user_name]
+            self.assertEqual([user._sharding for user in models.User.filter_indexed(name=user_name)], [sharding])
+        self.assertLess(moved, 40)
+        with self.assertRaises(CommandError):
+            call_command('reshard', 'demo.log', '--count', '2', '--grace', '0')
+
+    def test_reshard_conflict(self):
+        self.addCleanup(sharding_router.sharding_routers.pop, models.User, None)
+        router = models.User.get_sharding_router()
+        # The router of another process only re-reads the bucket map once its version in the database changed.
+        other_router = sharding_router.BucketRouter(models.User)
+        other_router.get_map()
+        user = models.User.create(user_name='iTraceur', name='Alice')
+        source = models.User.get_sharding_source(user)
+        target = str((int(user._sharding) + 1) % models.User.SHARDING_COUNT)
+        with mock.patch.object(sharding_router, 'SHARDING_ROUTER_REFRESH', 0):
+            with self.assertNumQueries(1):
+                other_router.get_map()
+            moves = {router.get_bucket(source): (user._sharding, target)}
+            router.start_moves(moves)
+            # Processes share no cache, e.g. with the default local memory cache.
+            cache.clear()
+            self.assertEqual(other_router.get_sharding(source), target)
+            self.assertEqual(other_router.get_read_shardings(source), [target, user._sharding])
+
+        # A row written to the target shard during the move aborts it instead of being overwritten or dropped.
+        models.User.get_shard_model(target).objects.create(user_name='iTraceur', name='Bob')
+        with self.assertRaisesMessage(IntegrityError, 'user_name iTraceur'):
+            sharding_router.move_bucket_rows(models.User, moves)
+        self.assertTrue(user.__class__.objects.filter(user_name='iTraceur', name='Alice').exists())
+
+        router.finish_moves()
+        cache.clear()
+        with mock.patch.object(sharding_router, 'SHARDING_ROUTER_REFRESH', 0):
+            self.assertEqual(other_router.get_read_shardings(source), [target])
+
+    def test_rebalance(self):
+        # The original routing sent almost every user to sharding 0.
+        user_names = ['iTraceur-rebalance-%d' % i for i in range(20)]
+        models.User.get_shard_model('0').objects.bulk_create([
+            models.User.get_shard_model('0')(user_name=user_name, name=user_name) for user_name in user_names])
+        out = StringIO()
+        call_command('reshard', 'demo.user', '--rebalance', stdout=out)
+        moved = sum(models.User.get_sharding(str(models.User.get_key_source(user_name))) != '0'
+                    for user_name in user_names)
+        self.assertIn('Moved %d rows' % moved, out.getvalue())
+        self.assertGreater(moved, 0)
+        self.assertEqual(models.User.all_shards().count(), 20)
+        for user_name in user_names:
+            self.assertEqual(models.User.get_routed(user_name=user_name).name, user_name)
+        self.assertRaises(CommandError, call_command, 'reshard', 'demo.log', '--rebalance')
+
+    def test_sharding_key(self):
+        user_name = 'iTraceur-key'
+        self.assertEqual(model_sharding.md5_hash(user_name), int(md5(user_name.encode()).hexdigest(), base=16))
+        digest = model_sharding.hash64(user_name)
+        self.assertLess(digest, 2 ** 64)
+        self.assertIs(models.User.shard_for(user_name=user_name), models.User.shard(digest))
+
+        user = models.User.create(user_name=user_name, name='iTraceur')
+        self.assertIs(user.__class__, models.User.shard(digest))
+        self.assertEqual(models.User.get_routed(user_name=user_name).pk, user.pk)
+        self.assertEqual(models.User.get_sharding_source(user), digest)
+        with self.assertRaises(TypeError):
+            models.User.shard_for(name=user_name)
+        with self.assertRaises(TypeError):
+            models.User.create(name=user_name)
+        with mock.patch.object(models.User, 'SHARDING_KEY', None), self.assertRaises(TypeError):
+            models.User.get_sharding_source(user)
+
+        users = models.User.bulk_create_routed([{'user_name': 'iTraceur-key-%d' % i, 'name': 'iTraceur'}
+                                                for i in range(5)])
+        for user in users:
+            self.assertIs(user.__class__, models.User.shard_for(user_name=user.user_name))
+
+        time = timezone.datetime(2020, 3, 15, tzinfo=timezone.utc)
+        self.assertIs(models.Log.shard_for(time=time), models.Log.shard('202003'))
+        self.assertIs(models.Log.create(content='test_sharding_key').__class__, models.Log.shard())
+
+    def test_sharding_databases(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        placement = model_sharding.DatabasePerSharding('test_log_%(sharding)s',
+                                                       os.path.join(directory, 'log_%(sharding)s.sqlite3'))
+
+        def unregister():
+            connections['test_log_209903'].close()
+            del connections['test_log_209903']
+            del connections.databases['test_log_209903']
+            model_sharding.table_catalogs.pop('test_log_209903', None)
+
+        with mock.patch.object(models.Log, 'SHARDING_DATABASES', placement, create=True):
+            self.addCleanup(unregister)
+            log_model = models.Log.get_shard_model('209903')
+            self.assertEqual(router.db_for_write(log_model), 'test_log_209903')
+            self.assertEqual(router.db_for_read(models.User.shard(0)), 'default')
+
+            log = log_model.objects.create(content='test_sharding_databases')
+            self.assertEqual(log._state.db, 'test_log_209903')
+            self.assertEqual(log_model.objects.get(pk=log.pk).content, 'test_sharding_databases')
+            self.assertIn('demo_log_209903', connections['test_log_209903'].introspection.table_names())
+            self.assertNotIn('demo_log_209903', connection.introspection.table_names())
+            self.assertEqual(ShardingTable.objects.get(db_table='demo_log_209903').database, 'test_log_209903')
+            self.assertTrue(os.path.exists(os.path.join(directory, 'log_209903.sqlite3')))
+
+
+class TestScatterGather(TransactionTestCase):
+    def setUp(self):
+        # Tables created by the test cases before, e.g. the index tables, are rolled back with their transactions.
+        model_sharding.refresh_table_catalogs()
+
+    def tearDown(self):
+        # Shard tables are unmanaged, so they are not flushed between transaction test cases.
+        for sharding in models.User.get_sharding_list():
+            models.User.shard(sharding).objects.all().delete()
+        cache.clear()
+
+    @mock.patch.object(models.User, 'SHARDING_LOOKUP_CACHE_TIMEOUT', 60, create=True)
+    def test_lookup_cache_invalidated_on_commit(self):
+        user = models.User.create(user_name='iTraceur', name='Alice')
+        stale_user = models.User.get_routed(user_name='iTraceur')
+        with transaction.atomic(using=router.db_for_write(user.__class__)):
+            user.name = 'Bob'
+            user.save()
+            # A reader of another connection caches the row before the write commits.
+            sharding_cache.cache_row(stale_user)
+            self.assertEqual(models.User.get_routed(user_name='iTraceur').name, 'Alice')
+        self.assertEqual(models.User.get_routed(user_name='iTraceur').name, 'Bob')
+
+    def test_scatter_gather(self):
+        cache.clear()
+        for i in range(30):
+            models.User.shard(i).objects.create(user_name='iTraceur-scatter-%d' % i, name='iTraceur', age=i)
+
+        self.assertTrue(sharding_executor.can_run_parallel())
+        counts = models.User.scatter_gather(lambda model, sharding: model.objects.filter(age__gte=10).count())
+        self.assertEqual(counts, [2] * models.User.SHARDING_COUNT)
+        self.assertEqual(models.User.scatter_gather(lambda model, sharding: model.objects.count(), merge=sum), 30)
+
+        user_names = []
+        for page in range(1, 5):
+            pagination_info = models.User.paginate_sharding(page, 8)
+            self.assertEqual(pagination_info['count'], 30)
+            user_names.extend(user['user_name'] for user in pagination_info['result'])
+        self.assertEqual(sorted(user_names), sorted('iTraceur-scatter-%d' % i for i in range(30)))
+        self.assertIsNone(pagination_info['next_page'])
+
+    def test_pool_connections(self):
+        def get_connection(item):
+            connection.ensure_connection()
+            return connections['default']
+
+        wrapper_class = connections['default'].__class__
+        with mock.patch.object(wrapper_class, 'close') as close:
+            # The connections of the pool threads stay open across tasks, even with CONN_MAX_AGE = 0.
+            pool_connections = set(sharding_executor.scatter_gather(get_connection, [(i,) for i in range(8)]))
+            pool_connections.update(sharding_executor.scatter_gather(get_connection, [(i,) for i in range(8)]))
+            self.assertNotIn(connections['default'], pool_connections)
+            self.assertEqual(close.call_count, 0)
+
+            sharding_executor.shutdown_executor()
+            self.assertGreaterEqual(close.call_count, len(pool_connections))
+
+
+class TestShardCreation(TransactionTestCase):
+    def tearDown(self):
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(model_sharding.shard_tables['demo_log_209902'])
+        model_sharding.get_table_catalog().discard('demo_log_209902')
+
+    def test_concurrent_shard_creation(self):
+        barrier = threading.Barrier(8)
+        results = []
+        errors = []
+
+        def provision():
+            barrier.wait()
+            try:
+                results.append(models.Log.provision_shards(['209902']))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=provision) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [[]] * 7 + [['209902']])
+        self.assertEqual(ShardingTable.objects.filter(db_table='demo_log_209902').count(), 1)
+        self.assertIn('demo_log_209902', connection.introspection.table_names())
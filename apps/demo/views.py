@@ -1,12 +1,13 @@
 import math
-from hashlib import md5
 
+from django.core.exceptions import ObjectDoesNotExist
 from django.forms.models import model_to_dict
 from django.http import JsonResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import View
 
+from apps.base import model_sharding, sharding_stream
 from . import models
 
 
@@ -24,7 +25,10 @@ class JSONResponseMixin(object):
         self.response_kwargs = {}
 
     def render_to_response(self, context):
-        return self.response_class(context, json_dumps_params=self.params, **self.response_kwargs)
+        response_class = self.response_class
+        if sharding_stream.is_streamed(context):
+            response_class = sharding_stream.StreamingJSONResponse
+        return response_class(context, json_dumps_params=self.params, **self.response_kwargs)
 
 
 class UserView(JSONResponseMixin, View):
@@ -35,19 +39,33 @@ class UserView(JSONResponseMixin, View):
     def get(self, request, *args, **kwargs):
         if request.GET.get('user_name', None):
             user_name = request.GET['user_name']
-            digest = int(md5(user_name.encode()).hexdigest(), base=16)
-            qs = models.User.shard(digest).objects.filter(user_name=user_name)
-            if not qs.exists():
+            try:
+                user = models.User.get_routed(user_name=user_name)
+            except ObjectDoesNotExist:
                 self.ret['status_code'] = 404
                 self.ret['message'] = '用户不存在'
             else:
-                user = qs.get()
                 self.ret['status_code'] = 200
                 self.ret['result'] = model_to_dict(user)
+        elif request.GET.get('name', None):
+            users = models.User.filter_indexed(name=request.GET['name']).order_by('id')
+            self.ret['status_code'] = 200
+            self.ret['result'] = [model_to_dict(user) for user in users]
+        elif 'cursor' in request.GET:
+            page_size = max(int(request.GET.get('page_size', 0)) or 10, 1)
+            try:
+                pagination_info = models.User.paginate_sharding_by_cursor(request.GET['cursor'], page_size)
+            except ValueError:
+                self.ret['status_code'] = 400
+                self.ret['message'] = '请求错误，cursor参数无效'
+            else:
+                self.ret['status_code'] = 200
+                self.ret.update(pagination_info)
         else:
-            page_size = int(request.GET.get('page_size', 0)) or 10
+            page_size = max(int(request.GET.get('page_size', 0)) or 10, 1)
             page = int(request.GET.get('page', 0)) or 1
-            pagination_info = models.User.paginate_sharding(page, page_size)
+            stream = page_size >= sharding_stream.SHARDING_STREAM_PAGE_SIZE
+            pagination_info = models.User.paginate_sharding(page, page_size, stream=stream)
             self.ret['status_code'] = 200
             self.ret.update(pagination_info)
 
@@ -57,9 +75,8 @@ class UserView(JSONResponseMixin, View):
         if 'user_name' in request.POST:
             user_name = request.POST['user_name']
             name = request.POST.get('name', user_name)
-            digest = int(md5(user_name.encode()).hexdigest(), base=16)
             try:
-                user = models.User.shard(digest).objects.create(user_name=user_name, name=name)
+                user = models.User.create(user_name=user_name, name=name)
             except Exception as exc:
                 self.ret['status_code'] = 500
                 self.ret['message'] = str(exc)
@@ -83,22 +100,19 @@ class UserView(JSONResponseMixin, View):
             if request.GET.get('active'):
                 update_map['active'] = request.GET['active']
 
-            digest = int(md5(user_name.encode()).hexdigest(), base=16)
-            user_model = models.User.shard(digest)
             try:
-                user = user_model.objects.get(user_name=user_name)
-                for k, v in update_map.items():
-                    setattr(user, k, v)
-                user.save(update_fields=update_map.keys())
-            except user_model.DoesNotExist:
-                self.ret['status_code'] = 404
-                self.ret['message'] = '用户不存在'
+                # A single conditional UPDATE, the result holds the fields written rather than the whole row.
+                rows = models.User.update_routed(update_map, user_name=user_name)
             except Exception as exc:
                 self.ret['status_code'] = 500
                 self.ret['message'] = str(exc)
             else:
-                self.ret['status_code'] = 200
-                self.ret['result'] = model_to_dict(user)
+                if rows:
+                    self.ret['status_code'] = 200
+                    self.ret['result'] = dict(update_map, user_name=user_name)
+                else:
+                    self.ret['status_code'] = 404
+                    self.ret['message'] = '用户不存在'
         else:
             self.ret['message'] = '请求错误，缺少user_name参数'
             self.ret['status_code'] = 400
@@ -108,20 +122,18 @@ class UserView(JSONResponseMixin, View):
     def delete(self, request, *args, **kwargs):
         if 'user_name' in request.GET:
             user_name = request.GET['user_name']
-            digest = int(md5(user_name.encode()).hexdigest(), base=16)
-            user_model = models.User.shard(digest)
             try:
-                user = user_model.objects.get(user_name=user_name)
-                user.delete()
-            except user_model.DoesNotExist:
-                self.ret['status_code'] = 404
-                self.ret['message'] = '用户不存在'
+                rows = models.User.delete_routed(user_name=user_name)
             except Exception as exc:
                 self.ret['status_code'] = 500
                 self.ret['message'] = str(exc)
             else:
-                self.ret['status_code'] = 204
-                self.ret['result'] = 'ok'
+                if rows:
+                    self.ret['status_code'] = 204
+                    self.ret['result'] = 'ok'
+                else:
+                    self.ret['status_code'] = 404
+                    self.ret['message'] = '用户不存在'
         else:
             self.ret['message'] = '请求错误，缺少user_name参数'
             self.ret['status_code'] = 400
@@ -142,15 +154,26 @@ class LogView(JSONResponseMixin, View):
 
         qs = log_model.objects.all()
         if request.GET.get('id', None):
-            qs = qs.filter(id=request.GET['id'])
-            if not qs.exists():
+            log = qs.filter(id=request.GET['id']).values(*model_sharding.get_dict_fields(log_model)).first()
+            if log is None:
                 self.ret['status_code'] = 404
                 self.ret['message'] = '日志不存在'
             else:
                 self.ret['status_code'] = 200
-                self.ret['result'] = model_to_dict(qs.get())
+                self.ret['result'] = log
+        elif 'cursor' in request.GET:
+            page_size = max(int(request.GET.get('page_size', 0)) or 10, 1)
+            sharding = models.Log.get_sharding(str(request.GET.get('date') or None))
+            try:
+                pagination_info = models.Log.paginate_sharding_by_cursor(request.GET['cursor'], page_size, [sharding])
+            except ValueError:
+                self.ret['status_code'] = 400
+                self.ret['message'] = '请求错误，cursor参数无效'
+            else:
+                self.ret['status_code'] = 200
+                self.ret.update(pagination_info)
         else:
-            page_size = int(request.GET.get('page_size', 0)) or 10
+            page_size = max(int(request.GET.get('page_size', 0)) or 10, 1)
             page = int(request.GET.get('page', 0)) or 1
 
             count = qs.count()
@@ -160,20 +183,22 @@ class LogView(JSONResponseMixin, View):
 
             start = (page - 1) * page_size
             end = page * page_size
-            qs = qs[start:end]
-
-            result = []
-            for log in qs:
-                result.append(model_to_dict(log))
+            qs = qs.values(*model_sharding.get_dict_fields(log_model))[start:end]
 
             self.ret['status_code'] = 200
-            self.ret['result'] = result
+            if page_size >= sharding_stream.SHARDING_STREAM_PAGE_SIZE:
+                self.ret['result'] = qs.iterator()
+            else:
+                self.ret['result'] = list(qs)
             self.ret['count'] = count
             self.ret['next_page'] = page + 1 if page < max_page else -1
 
         return self.render_to_response(self.ret)
 
     def post(self, request, *args, **kwargs):
+        if models.Log.uses_write_buffer():
+            return self.post_buffered(request)
+
         if request.GET.get('date', None):
             log_model = models.Log.shard(request.GET['date'])
         else:
@@ -196,26 +221,47 @@ class LogView(JSONResponseMixin, View):
 
         return self.render_to_response(self.ret)
 
-    def delete(self, request, *args, **kwargs):
-        if request.GET.get('date', None):
-            log_model = models.Log.shard(request.GET['date'])
+    def post_buffered(self, request):
+        """Queue the log for a write-behind batch insert, wait for it to be written only if `ack` is given."""
+
+        if 'content' in request.POST:
+            content = request.POST['content']
+            level = request.POST.get('level', 0)
+            ack = bool(request.GET.get('ack'))
+            try:
+                log = models.Log.create_buffered(request.GET.get('date') or None, wait=ack, level=level,
+                                                 content=content)
+            except Exception as exc:
+                self.ret['status_code'] = 500
+                self.ret['message'] = str(exc)
+            else:
+                if ack:
+                    self.response_kwargs['status'] = self.ret['status_code'] = 201
+                    self.ret['result'] = model_to_dict(log)
+                else:
+                    self.response_kwargs['status'] = self.ret['status_code'] = 202
+                    self.ret['result'] = 'queued'
         else:
-            log_model = models.Log.shard()
+            self.ret['message'] = '请求错误，缺少content参数'
+            self.ret['status_code'] = 400
 
+        return self.render_to_response(self.ret)
+
+    def delete(self, request, *args, **kwargs):
         if 'id' in request.GET:
             log_id = request.GET['id']
             try:
-                log = log_model.objects.get(id=log_id)
-                log.delete()
-            except log_model.DoesNotExist:
-                self.ret['status_code'] = 404
-                self.ret['message'] = '日志不存在'
+                rows = models.Log.delete_routed(request.GET.get('date') or None, id=log_id)
             except Exception as exc:
                 self.ret['status_code'] = 500
                 self.ret['message'] = str(exc)
             else:
-                self.ret['status_code'] = 204
-                self.ret['result'] = 'ok'
+                if rows:
+                    self.ret['status_code'] = 204
+                    self.ret['result'] = 'ok'
+                else:
+                    self.ret['status_code'] = 404
+                    self.ret['message'] = '日志不存在'
         else:
             self.ret['message'] = '请求错误，缺少content参数'
             self.ret['status_code'] = 400
@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
 
+    'apps.base',
     'apps.demo',
 ]
 
@@ -83,6 +84,8 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['apps.base.database_router.ShardingDatabaseRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -16,7 +16,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from apps.base import sharding_admin, sharding_export, sharding_metrics
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
+    path('admin/', sharding_admin.get_urls(admin.site)),
+    path('sharding/metrics/', sharding_metrics.metrics_view, name='sharding_metrics'),
+    path('sharding/export/', sharding_export.export_view, name='sharding_export'),
     path('demo/', include(('apps.demo.urls', 'demo'), namespace='demo'))
 ]